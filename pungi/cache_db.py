@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+SQLite database backing persistent caches shared across composes.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class CacheDatabase(object):
+    """Wrapper around SQLite database file.
+
+    One connection is kept open for each process and queries from multiple
+    threads are serialized. A process forked after the connection was opened
+    opens its own connection, as SQLite connections can not be used across a
+    fork. The timeout allows concurrent composes to use the same database.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _get_connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def execute(self, query, args=()):
+        """Run a query in its own transaction and return the first row."""
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                return conn.execute(query, args).fetchone()
+
+    def fetchall(self, query, args=()):
+        """Run a query and return all rows."""
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                return conn.execute(query, args).fetchall()
+
+    def executemany(self, query, rows):
+        """Run a query for each row, all in a single transaction."""
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                conn.executemany(query, rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
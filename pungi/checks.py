@@ -652,7 +652,22 @@ def make_schema():
             },
             "gather_profiler": {"type": "boolean", "default": False},
             "gather_allow_reuse": {"type": "boolean", "default": False},
+            "gather_num_threads": {"type": "number", "default": get_num_cpus()},
+            "gather_processes": {"type": "boolean", "default": False},
+            "gather_dnf_server": {"type": "boolean", "default": False},
+            "gather_dnf_deps_cache": {"type": "string"},
+            "gather_hybrid_solver": {
+                "type": "string",
+                "enum": ["fus", "libsolv"],
+                "default": "fus",
+            },
+            "gather_hybrid_solver_cache": {"type": "string"},
+            "gather_lookaside_cache": {"type": "string"},
             "pkgset_allow_reuse": {"type": "boolean", "default": True},
+            "pkgset_incremental_reuse": {"type": "boolean", "default": False},
+            "pkgset_compact_store": {"type": "boolean", "default": False},
+            "pkgset_reader_processes": {"type": "number", "default": 0},
+            "pkgset_header_cache": {"type": "string"},
             "pkgset_source": {"type": "string", "enum": ["koji", "repos"]},
             "createrepo_c": {"type": "boolean", "default": True},
             "createrepo_checksum": {
@@ -661,8 +676,18 @@ def make_schema():
                 "enum": ["sha1", "sha256", "sha512"],
             },
             "createrepo_use_xz": {"type": "boolean", "default": False},
+            "createrepo_backend": {
+                "type": "string",
+                "enum": ["cli", "python", "slice"],
+                "default": "cli",
+            },
             "createrepo_num_threads": {"type": "number", "default": get_num_cpus()},
             "createrepo_num_workers": {"type": "number", "default": 3},
+            "createrepo_cpu_budget": {"type": "number", "default": get_num_cpus()},
+            "createrepo_memory_budget": {
+                "type": "number",
+                "default": get_total_memory(),
+            },
             "createrepo_database": {"type": "boolean"},
             "createrepo_extra_args": {
                 "type": "array",
@@ -789,6 +814,8 @@ def make_schema():
             "cts_keytab": {"type": "string"},
             "koji_profile": {"type": "string"},
             "koji_event": {"type": "number"},
+            "koji_multicall_chunk_size": {"type": "number", "default": 1000},
+            "koji_multicall_threads": {"type": "number", "default": 4},
             "pkgset_koji_tag": {"$ref": "#/definitions/strings"},
             "pkgset_koji_builds": {"$ref": "#/definitions/strings"},
             "pkgset_koji_scratch_tasks": {"$ref": "#/definitions/strings"},
@@ -886,6 +913,12 @@ def make_schema():
                 ],
                 "default": "hardlink-or-copy",
             },
+            "link_threads_per_filesystem": {"type": "number", "default": 10},
+            "hot_path_log_format": {
+                "type": "string",
+                "enum": ["text", "jsonl"],
+                "default": "text",
+            },
             "product_id": {"$ref": "#/definitions/str_or_scm_dict"},
             "product_id_allow_missing": {"type": "boolean", "default": False},
             "product_id_allow_name_prefix": {"type": "boolean", "default": True},
@@ -1310,6 +1343,14 @@ def get_num_cpus():
         return 3
 
 
+def get_total_memory():
+    """Return size of physical memory in MiB."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+    except (AttributeError, ValueError, OSError):
+        return 8192
+
+
 # This is a mapping of configuration option dependencies and conflicts.
 #
 # The key in this mapping is the trigger for the check. When the option is
@@ -51,6 +51,9 @@ try:
 except ImportError:
     SUPPORTED_MILESTONES = ["RC", "Update", "SecurityFix"]
 
+# Messages logged from these functions go only to excluding-arch.log.
+EXCLUDING_ARCH_LOG_FUNCS = ("is_excluded", "_log_excluded")
+
 
 def get_compose_info(
     conf,
@@ -237,18 +240,16 @@ class Compose(kobo.log.LoggingBase):
 
             class PungiLogFilter(logging.Filter):
                 def filter(self, record):
-                    return (
-                        False
-                        if record.funcName and record.funcName == "is_excluded"
-                        else True
-                    )
+                    return record.funcName not in EXCLUDING_ARCH_LOG_FUNCS
 
             class ExcludingArchLogFilter(logging.Filter):
                 def filter(self, record):
-                    message = record.getMessage()
-                    if "Populating package set for arch:" in message or (
-                        record.funcName and record.funcName == "is_excluded"
-                    ):
+                    if record.funcName in EXCLUDING_ARCH_LOG_FUNCS:
+                        return True
+                    # Only the unformatted message is checked, so that the
+                    # filter does not format every message logged in the
+                    # compose just to drop it.
+                    if "Populating package set for arch:" in str(record.msg):
                         return True
                     else:
                         return False
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Structured log of per-file events on hot paths.
+
+Linking files and reading package sets can log a line for every single file.
+Formatting such lines and passing them through all handlers of the compose
+logger is slow for large composes and makes the main log huge. When
+``hot_path_log_format`` is set to ``jsonl``, the events are recorded here
+instead, buffered and appended to a gzip compressed file with one JSON object
+per line. The main log only gets a summary.
+"""
+
+import gzip
+import json
+import threading
+import time
+
+
+class DetailLog(object):
+    def __init__(self, path, buffer_size=1000):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        # Separate lock for writing, so that records can be added while a
+        # full buffer is being compressed.
+        self._write_lock = threading.Lock()
+
+    def record(self, event, **fields):
+        """Add an event. The buffer is written once it is full."""
+        fields["event"] = event
+        fields["time"] = time.time()
+        with self._lock:
+            self._buffer.append(fields)
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered events. Each flush appends a new gzip member to
+        the file, gzip readers handle that transparently.
+        """
+        with self._write_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return
+            data = "".join(json.dumps(e, sort_keys=True) + "\n" for e in events)
+            with gzip.open(self.path, "ab") as f:
+                f.write(data.encode("utf-8"))
+
+
+# {(compose topdir, name): DetailLog}
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_detail_log(compose, name):
+    """Return the detail log with given name for the compose, or None if
+    per-file events should go to the main log as text.
+    """
+    if compose.conf.get("hot_path_log_format", "text") != "jsonl":
+        return None
+    key = (compose.topdir, name)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = DetailLog(compose.paths.log.detail_log_file("global", name))
+        return _logs[key]
+
+
+def close_detail_logs(compose):
+    """Write remaining events of all detail logs of the compose."""
+    with _logs_lock:
+        keys = [key for key in _logs if key[0] == compose.topdir]
+        logs = [_logs.pop(key) for key in keys]
+    for log in logs:
+        log.flush()
@@ -15,7 +15,9 @@
 
 
 from enum import Enum
+import hashlib
 from itertools import count
+import json
 import logging
 import os
 import re
@@ -26,6 +28,7 @@ import pungi.common
 import pungi.dnf_wrapper
 import pungi.multilib_dnf
 import pungi.util
+from pungi.cache_db import CacheDatabase
 from pungi.linker import Linker
 from pungi.profiler import Profiler
 from pungi.util import DEBUG_PATTERNS
@@ -119,6 +122,98 @@ class QueryCache(object):
         return self.cache.get(key, None)
 
 
+def get_package_id(pkg):
+    """Return a string identifying the package in a sack. The same NEVRA can
+    be in multiple repos, e.g. in a lookaside and in a regular repo.
+    """
+    return "%s@%s" % (pkg, pkg.repoid)
+
+
+class DepsCache(object):
+    """Packages providing a requirement, shared by Gather objects using the
+    same repos.
+
+    The providers depend on which packages are excluded, so each lookup needs
+    a state of the queues in addition to the requirement. Only the candidate
+    providers are stored, picking the best one still happens in each Gather,
+    because it depends on packages already in the result.
+
+    When ``repo_state`` identifying content of all repos is known and a
+    ``path`` is given, the providers are also stored in an SQLite database
+    and reused by following runs. All rows for the repo state are loaded on
+    first lookup, new rows are written in a single transaction by ``flush``.
+    """
+
+    # Bump this when the stored data or the key changes.
+    VERSION = 2
+
+    def __init__(self, repo_state=None, path=None):
+        self.repo_state = repo_state
+        self._db = None
+        if repo_state and path:
+            self._db = CacheDatabase(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS deps ("
+                "repo_state TEXT, key TEXT, version INTEGER, providers TEXT, "
+                "PRIMARY KEY (repo_state, key))"
+            )
+        # (queue state, debuginfo, requirement) -> list of package ids
+        self._providers = {}
+        # database key -> serialized list of package ids, loaded lazily
+        self._stored = None
+        # rows not yet written to the database
+        self._new_rows = []
+
+    def _get_db_key(self, key):
+        data = json.dumps(list(key))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        rows = self._db.fetchall(
+            "SELECT key, providers FROM deps WHERE repo_state = ? AND version = ?",
+            (self.repo_state, self.VERSION),
+        )
+        self._stored = dict(rows)
+
+    def get(self, queue_state, debuginfo, req):
+        """Return list of ids of packages providing the requirement, or None
+        if it's not known.
+        """
+        key = (queue_state, debuginfo, req)
+        if key in self._providers:
+            return self._providers[key]
+        if self._db:
+            if self._stored is None:
+                self._load()
+            data = self._stored.get(self._get_db_key(key))
+            if data is not None:
+                self._providers[key] = json.loads(data)
+                return self._providers[key]
+        return None
+
+    def put(self, queue_state, debuginfo, req, providers):
+        key = (queue_state, debuginfo, req)
+        self._providers[key] = sorted(providers)
+        if self._db:
+            self._new_rows.append(
+                (
+                    self.repo_state,
+                    self._get_db_key(key),
+                    self.VERSION,
+                    json.dumps(self._providers[key]),
+                )
+            )
+
+    def flush(self):
+        """Write providers added since last flush to the database."""
+        if not self._db or not self._new_rows:
+            return
+        rows, self._new_rows = self._new_rows, []
+        self._db.executemany("INSERT OR REPLACE INTO deps VALUES (?, ?, ?, ?)", rows)
+        if self._stored is not None:
+            self._stored.update((row[1], row[3]) for row in rows)
+
+
 class PkgFlag(Enum):
     lookaside = 1
     input = 2
@@ -132,38 +227,50 @@ class PkgFlag(Enum):
     fulltree_exclude = 512
 
 
-class GatherBase(object):
-    def __init__(self, dnf_obj):
-        self.dnf = dnf_obj
+def get_query_partitions(dnf_obj):
+    """Split all packages in the sack into queries by type and arch. The
+    queries don't depend on any gather options, so they can be shared by
+    multiple Gather objects using the same sack.
+    """
+    q = dnf_obj._sack.query()
+    # We can not filter only latest packages yet, because we need to apply
+    # excludes only to main repos and not lookaside. Filtering latest here
+    # makes that impossible as it could remove older versions from
+    # lookaside.
+
+    # source packages
+    q_source_packages = q.filter(arch=dnf_obj.arch_wrapper.source_arches).apply()
+    q = q.difference(q_source_packages)
+
+    # filter arches
+    q = q.filter(arch=dnf_obj.arch_wrapper.all_arches).apply()
+    q_noarch = q.filter(arch="noarch").apply()
+    q_native = q.filter(arch=dnf_obj.arch_wrapper.native_arches).apply()
+    q_multilib = q.difference(q_native).union(q_noarch).apply()
+
+    # debug packages
+    q_debug_packages = q.filter(name__glob=DEBUG_PATTERNS).apply()
+
+    return {
+        "q_source_packages": q_source_packages,
+        "q_debug_packages": q_debug_packages,
+        "q_native_debug_packages": q_debug_packages.intersection(q_native),
+        "q_multilib_debug_packages": q_debug_packages.intersection(q_multilib),
+        # binary packages
+        "q_binary_packages": q.difference(q_debug_packages),
+        "q_native_binary_packages": q_native.difference(q_debug_packages),
+        "q_multilib_binary_packages": q_multilib.difference(q_debug_packages),
+        "q_noarch_binary_packages": q_noarch.difference(q_debug_packages),
+    }
 
-        q = self._query
-        # We can not filter only latest packages yet, because we need to apply
-        # excludes only to main repos and not lookaside. Filtering latest here
-        # makes that impossible as it could remove older versions from
-        # lookaside.
-
-        # source packages
-        self.q_source_packages = q.filter(
-            arch=self.dnf.arch_wrapper.source_arches
-        ).apply()
-        q = q.difference(self.q_source_packages)
-
-        # filter arches
-        q = q.filter(arch=self.dnf.arch_wrapper.all_arches).apply()
-        q_noarch = q.filter(arch="noarch").apply()
-        q_native = q.filter(arch=self.dnf.arch_wrapper.native_arches).apply()
-        q_multilib = q.difference(q_native).union(q_noarch).apply()
-
-        # debug packages
-        self.q_debug_packages = q.filter(name__glob=DEBUG_PATTERNS).apply()
-        self.q_native_debug_packages = self.q_debug_packages.intersection(q_native)
-        self.q_multilib_debug_packages = self.q_debug_packages.intersection(q_multilib)
 
-        # binary packages
-        self.q_binary_packages = q.difference(self.q_debug_packages)
-        self.q_native_binary_packages = q_native.difference(self.q_debug_packages)
-        self.q_multilib_binary_packages = q_multilib.difference(self.q_debug_packages)
-        self.q_noarch_binary_packages = q_noarch.difference(self.q_debug_packages)
+class GatherBase(object):
+    def __init__(self, dnf_obj, partitions=None):
+        self.dnf = dnf_obj
+        # Gathering replaces the queries with filtered ones, the shared
+        # partitions are not modified.
+        for name, query in (partitions or get_query_partitions(dnf_obj)).items():
+            setattr(self, name, query)
 
     @property
     def _query(self):
@@ -183,8 +290,10 @@ class GatherBase(object):
 
 
 class Gather(GatherBase):
-    def __init__(self, dnf_obj, gather_options, logger=None):
-        super(Gather, self).__init__(dnf_obj)
+    def __init__(
+        self, dnf_obj, gather_options, logger=None, partitions=None, deps_cache=None
+    ):
+        super(Gather, self).__init__(dnf_obj, partitions)
         self.logger = logger
         if not self.logger:
             # default logger
@@ -219,6 +328,12 @@ class Gather(GatherBase):
 
         self.finished_get_package_deps_reqs = {}
 
+        # Providers of requirements shared with other runs, see DepsCache.
+        self.deps_cache = deps_cache
+        # Identifies the excluded packages, set by _apply_excludes().
+        self.queue_state = None
+        self._package_index = {}  # {debuginfo: {package id: pkg}}
+
         self.finished_add_conditional_packages = {}  # {pkg: [pkgs]}
         self.finished_add_source_packages = {}  # {pkg: src-pkg|None}
         self.sourcerpm_cache = {}  # {src_nvra: src-pkg|None}
@@ -368,15 +483,27 @@ class Gather(GatherBase):
             + getattr(pkg, "requires_post", [])
         )
 
-        q = queue.filter(provides=requires).apply()
+        q = None
         for req in requires:
             deps = self.finished_get_package_deps_reqs.setdefault(str(req), set())
             if deps:
                 result.update((dep, req) for dep in deps)
                 continue
 
-            # TODO: need query also debuginfo
-            deps = q.filter(provides=req)
+            deps = self._get_cached_providers(req, debuginfo)
+            if deps is None:
+                with Profiler("Gather._get_package_deps():cache-miss"):
+                    if q is None:
+                        q = queue.filter(provides=requires).apply()
+                    # TODO: need query also debuginfo
+                    deps = q.filter(provides=req)
+                    if self.deps_cache and self.queue_state:
+                        self.deps_cache.put(
+                            self.queue_state,
+                            debuginfo,
+                            str(req),
+                            [get_package_id(dep) for dep in deps],
+                        )
             if deps:
                 deps = self._get_best_package(deps, req=req, debuginfo=debuginfo)
                 self.finished_get_package_deps_reqs[str(req)].update(deps)
@@ -388,6 +515,24 @@ class Gather(GatherBase):
 
         return result
 
+    def _get_cached_providers(self, req, debuginfo):
+        """Return list of packages providing the requirement if they are in
+        the shared cache, None otherwise.
+        """
+        if not self.deps_cache or not self.queue_state:
+            return None
+        provider_ids = self.deps_cache.get(self.queue_state, debuginfo, str(req))
+        if provider_ids is None:
+            return None
+        with Profiler("Gather._get_package_deps():cache-hit"):
+            if debuginfo not in self._package_index:
+                queue = self.q_debug_packages if debuginfo else self.q_binary_packages
+                self._package_index[debuginfo] = dict(
+                    (get_package_id(pkg), pkg) for pkg in queue
+                )
+            index = self._package_index[debuginfo]
+            return [index[i] for i in provider_ids if i in index]
+
     def _filter_queue(self, queue, exclude):
         """Given an name of a queue (stored as attribute in `self`), exclude
         all given packages and keep only the latest per package name and arch.
@@ -456,6 +601,10 @@ class Gather(GatherBase):
             for queue in all_queues:
                 self._filter_queue(queue, exclude)
 
+        self.queue_state = hashlib.sha256(
+            json.dumps(sorted(get_package_id(pkg) for pkg in exclude)).encode("utf-8")
+        ).hexdigest()
+
     @Profiler("Gather.add_initial_packages()")
     def add_initial_packages(self, pattern_list):
         added = set()
@@ -1014,6 +1163,9 @@ class Gather(GatherBase):
             # nothing added -> break depsolving cycle
             break
 
+        if self.deps_cache:
+            self.deps_cache.flush()
+
     def download(self, destdir):
         pkglist = (
             self.result_binary_packages
@@ -16,17 +16,86 @@
 
 import contextlib
 import errno
+import fcntl
 import os
 import shutil
+import stat
+import sys
+import threading
+import time
 
 import kobo.log
+import six
+from six.moves import queue
 from kobo.shortcuts import relative_path
 from kobo.threads import WorkerThread, ThreadPool
 
+from pungi.detail_log import get_detail_log
 from pungi.util import makedirs
 
+# ioctl cloning a whole file on filesystems with reflink support (btrfs, XFS),
+# from linux/fs.h.
+FICLONE = 0x40049409
+
+# Errors meaning that a faster way of copying is not supported for the files.
+COPY_FALLBACK_ERRNOS = set(
+    [
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.EPERM,
+        errno.EXDEV,
+    ]
+)
+
+
+def _copy_file_range(fsrc, fdst, size):
+    """Copy the file in the kernel without passing the data through user
+    space. Returns False if it is not supported.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    while copied < size:
+        try:
+            count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+        except OSError as ex:
+            if copied == 0 and ex.errno in COPY_FALLBACK_ERRNOS:
+                return False
+            raise
+        if count == 0:
+            break
+        copied += count
+    return True
+
+
+def copy_file(src, dst):
+    """Copy content and metadata of a regular file, like shutil.copy2. If the
+    filesystem supports it, the destination shares data blocks with the
+    source (reflink). Otherwise the data is copied in the kernel if possible,
+    and as the last option in user space.
+    """
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except (IOError, OSError) as ex:
+                if ex.errno not in COPY_FALLBACK_ERRNOS:
+                    raise
+                if not _copy_file_range(fsrc, fdst, os.fstat(fsrc.fileno()).st_size):
+                    shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copystat(src, dst)
+
 
 class LinkerPool(ThreadPool):
+    """Pool of threads linking files given as (src, dst) tuples.
+
+    Pungi itself links files through LinkService. This pool and
+    LinkerThread are kept for external callers.
+    """
+
     def __init__(self, link_type="hardlink-or-copy", logger=None):
         ThreadPool.__init__(self, logger)
         self.link_type = link_type
@@ -57,39 +126,96 @@ class LinkerThread(WorkerThread):
 
         if (num % 100 == 0) or (num == self.pool.queue_total):
             self.pool.log_debug(
-                "Linked %s out of %s packages" % (num, self.pool.queue_total)
+                "Linked %s out of %s packages", num, self.pool.queue_total
             )
 
-        directory = os.path.dirname(dst)
-        makedirs(directory)
+        self.pool.linker.ensure_dir(os.path.dirname(dst))
         self.pool.linker.link(src, dst, link_type=self.pool.link_type)
 
 
 class Linker(kobo.log.LoggingBase):
-    def __init__(self, always_copy=None, test=False, logger=None):
+    def __init__(self, always_copy=None, test=False, logger=None, detail_log=None):
         kobo.log.LoggingBase.__init__(self, logger=logger)
         self.always_copy = always_copy or []
         self.test = test
+        # With a DetailLog, linked files are recorded there and only counted
+        # here instead of being logged one by one.
+        self.detail_log = detail_log
+        self.counts = {}  # {action: number of files}
+        self._counts_lock = threading.Lock()
         self._inode_map = {}
+        # Directories known to exist, so that they are not created again for
+        # each file linked into them.
+        self._dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    def _log_action(self, action, msg, src, dst):
+        """Log linking of a single file. The message can refer to the paths
+        as ``%(src)s`` and ``%(dst)s``, it's formatted only if it is logged.
+        """
+        if self.detail_log is None:
+            if self.test:
+                msg = "TEST: " + msg
+            self.log_info(msg, {"src": src, "dst": dst})
+            return
+        with self._counts_lock:
+            self.counts[action] = self.counts.get(action, 0) + 1
+        self.detail_log.record(action, src=src, dst=dst, test=self.test)
+
+    def get_summary(self):
+        """Return a string with numbers of files per action."""
+        with self._counts_lock:
+            return ", ".join(
+                "%s: %s" % (action, count)
+                for action, count in sorted(self.counts.items())
+            )
+
+    def ensure_dir(self, path):
+        """Create the directory unless it was already created by this
+        linker.
+        """
+        with self._dirs_lock:
+            if path in self._dirs:
+                return
+        makedirs(path)
+        with self._dirs_lock:
+            self._dirs.add(path)
+
+    def _stat(self, path):
+        """Return a tuple (lstat, stat) for the path. The second item is None
+        for a broken symlink. For anything else than a symlink both items are
+        the same, so only one syscall is needed.
+        """
+        lst = os.lstat(path)
+        if not stat.S_ISLNK(lst.st_mode):
+            return lst, lst
+        try:
+            return lst, os.stat(path)
+        except OSError:
+            return lst, None
+
+    def _get_type(self, path):
+        lst, st = self._stat(path)
+        return (
+            stat.S_ISLNK(lst.st_mode),
+            st is not None and stat.S_ISDIR(st.st_mode),
+            st is not None and stat.S_ISREG(st.st_mode),
+        )
 
     def _is_same_type(self, path1, path2):
-        if not os.path.islink(path1) == os.path.islink(path2):
-            return False
-        if not os.path.isdir(path1) == os.path.isdir(path2):
-            return False
-        if not os.path.isfile(path1) == os.path.isfile(path2):
-            return False
-        return True
+        return self._get_type(path1) == self._get_type(path2)
 
     def _is_same(self, path1, path2):
         if path1 == path2:
             return True
-        if os.path.islink(path2) and not os.path.exists(path2):
+        _, st2 = self._stat(path2)
+        if st2 is None:
             # Broken symlink
             return True
-        if os.path.getsize(path1) != os.path.getsize(path2):
+        st1 = os.stat(path1)
+        if st1.st_size != st2.st_size:
             return False
-        if int(os.path.getmtime(path1)) != int(os.path.getmtime(path2)):
+        if int(st1.st_mtime) != int(st2.st_mtime):
             return False
         return True
 
@@ -105,11 +231,9 @@ class Linker(kobo.log.LoggingBase):
         if relative:
             src = relative_path(src, dst)
 
-        msg = "Symlinking %s -> %s" % (dst, src)
+        self._log_action("symlink", "Symlinking %(dst)s -> %(src)s", src, dst)
         if self.test:
-            self.log_info("TEST: %s" % msg)
             return
-        self.log_info(msg)
 
         try:
             os.symlink(src, dst)
@@ -120,8 +244,9 @@ class Linker(kobo.log.LoggingBase):
                 if os.readlink(dst) != src:
                     raise
                 self.log_debug(
-                    "The same file already exists, skipping symlink %s -> %s"
-                    % (dst, src)
+                    "The same file already exists, skipping symlink %s -> %s",
+                    dst,
+                    src,
                 )
             else:
                 raise
@@ -130,11 +255,9 @@ class Linker(kobo.log.LoggingBase):
         if src == dst:
             return
 
-        msg = "Hardlinking %s to %s" % (src, dst)
+        self._log_action("hardlink", "Hardlinking %(src)s to %(dst)s", src, dst)
         if self.test:
-            self.log_info("TEST: %s" % msg)
             return
-        self.log_info(msg)
 
         try:
             os.link(src, dst)
@@ -149,8 +272,9 @@ class Linker(kobo.log.LoggingBase):
                     )
                     raise
                 self.log_debug(
-                    "The same file already exists, skipping hardlink %s to %s"
-                    % (src, dst)
+                    "The same file already exists, skipping hardlink %s to %s",
+                    src,
+                    dst,
                 )
             else:
                 raise
@@ -159,15 +283,16 @@ class Linker(kobo.log.LoggingBase):
         if src == dst:
             return True
 
-        if os.path.islink(src):
-            msg = "Copying symlink %s to %s" % (src, dst)
+        src_is_link = os.path.islink(src)
+        if src_is_link:
+            self._log_action(
+                "copy-symlink", "Copying symlink %(src)s to %(dst)s", src, dst
+            )
         else:
-            msg = "Copying file %s to %s" % (src, dst)
+            self._log_action("copy", "Copying file %(src)s to %(dst)s", src, dst)
 
         if self.test:
-            self.log_info("TEST: %s" % msg)
             return
-        self.log_info(msg)
 
         if os.path.exists(dst):
             if self._is_same(src, dst):
@@ -178,13 +303,13 @@ class Linker(kobo.log.LoggingBase):
                     )
                     raise OSError(errno.EEXIST, "File exists")
                 self.log_debug(
-                    "The same file already exists, skipping copy %s to %s" % (src, dst)
+                    "The same file already exists, skipping copy %s to %s", src, dst
                 )
                 return
             else:
                 raise OSError(errno.EEXIST, "File exists")
 
-        if os.path.islink(src):
+        if src_is_link:
             if not os.path.islink(dst):
                 os.symlink(os.readlink(src), dst)
                 return
@@ -195,14 +320,15 @@ class Linker(kobo.log.LoggingBase):
         if src_key in self._inode_map:
             # (st_dev, st_ino) found in the mapping
             self.log_debug(
-                "Harlink detected, hardlinking in destination %s to %s"
-                % (self._inode_map[src_key], dst)
+                "Harlink detected, hardlinking in destination %s to %s",
+                self._inode_map[src_key],
+                dst,
             )
             os.link(self._inode_map[src_key], dst)
             return
 
-        # BEWARE: shutil.copy2 automatically *rewrites* existing files
-        shutil.copy2(src, dst)
+        # BEWARE: copy_file automatically *rewrites* existing files
+        copy_file(src, dst)
         self._inode_map[src_key] = dst
 
     def _link_file(self, src, dst, link_type):
@@ -229,7 +355,8 @@ class Linker(kobo.log.LoggingBase):
 
     def link(self, src, dst, link_type="hardlink-or-copy"):
         """Link directories recursively."""
-        if os.path.isfile(src) or os.path.islink(src):
+        mode = os.lstat(src).st_mode
+        if stat.S_ISREG(mode) or stat.S_ISLNK(mode):
             self._link_file(src, dst, link_type)
             return
 
@@ -237,11 +364,253 @@ class Linker(kobo.log.LoggingBase):
             raise OSError(errno.EEXIST, "File exists")
 
         if not self.test:
-            if not os.path.exists(dst):
-                makedirs(dst)
+            self.ensure_dir(dst)
             shutil.copystat(src, dst)
 
         for i in os.listdir(src):
             src_path = os.path.join(src, i)
             dst_path = os.path.join(dst, i)
             self.link(src_path, dst_path, link_type)
+
+
+class LinkBatch(object):
+    """Files submitted to LinkService together. Use wait() to block until
+    all of them are linked.
+    """
+
+    def __init__(self, phase, total, msg=None, logger=None, detail_log=None):
+        self.phase = phase
+        self.total = total
+        self.msg = msg
+        # Each batch has its own linker, so that copies of hardlinked files
+        # are only hardlinked within the batch, same as with LinkerPool.
+        self.linker = Linker(logger=logger, detail_log=detail_log)
+        self.files = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.end = None
+        self.exc_info = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def item_done(self, size=0, exc_info=None):
+        """Record a processed file and return how many files are done."""
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            if exc_info and not self.exc_info:
+                self.exc_info = exc_info
+            return self.files
+
+    def finish(self):
+        self.end = time.time()
+        self._done.set()
+
+    @property
+    def failed(self):
+        return self.exc_info is not None
+
+    def wait(self):
+        """Wait for all files to be linked. The first error is raised."""
+        self._done.wait()
+        if self.exc_info:
+            six.reraise(*self.exc_info)
+
+
+class LinkService(kobo.log.LoggingBase):
+    """Compose-wide service linking batches of files in long-lived threads.
+
+    Each destination filesystem has its own queue served by
+    ``threads_per_filesystem`` threads, so a slow filesystem does not hold
+    back linking to other ones, and batches submitted at the same time do
+    not overload one filesystem. Files and bytes linked are counted per
+    phase.
+
+    If a DetailLog is given, the linked files are recorded in it and only a
+    summary for each batch is logged.
+    """
+
+    def __init__(self, threads_per_filesystem=10, logger=None, detail_log=None):
+        kobo.log.LoggingBase.__init__(self, logger=logger)
+        self.threads_per_filesystem = int(threads_per_filesystem)
+        self.detail_log = detail_log
+        # Used only to create directories once for all batches.
+        self._dir_linker = Linker(logger=logger)
+        self._queues = {}  # {st_dev: Queue}
+        self._threads = []
+        self._devices = {}  # {directory: st_dev}
+        self._lock = threading.Lock()
+        # {phase: {"files": int, "bytes": int, "start": float, "end": float}}
+        self.stats = {}
+
+    def _get_device(self, path):
+        """Return device of the filesystem where the path would be created."""
+        directory = os.path.dirname(path)
+        with self._lock:
+            if directory in self._devices:
+                return self._devices[directory]
+        existing = directory
+        while True:
+            try:
+                device = os.stat(existing).st_dev
+                break
+            except OSError as ex:
+                if ex.errno != errno.ENOENT or existing == os.path.dirname(existing):
+                    raise
+                existing = os.path.dirname(existing)
+        with self._lock:
+            self._devices[directory] = device
+        return device
+
+    def _get_queue(self, device):
+        with self._lock:
+            if device not in self._queues:
+                self._queues[device] = queue.Queue()
+                for _ in range(self.threads_per_filesystem):
+                    t = threading.Thread(
+                        target=self._worker, args=(self._queues[device],)
+                    )
+                    t.daemon = True
+                    t.start()
+                    self._threads.append(t)
+            return self._queues[device]
+
+    def submit(self, items, link_type="hardlink-or-copy", phase=None, msg=None):
+        """Queue (src, dst) pairs for linking and return a LinkBatch. If
+        ``msg`` is given, it's logged once the whole batch is linked.
+        """
+        items = list(items)
+        batch = LinkBatch(
+            phase, len(items), msg=msg, logger=self._logger, detail_log=self.detail_log
+        )
+        with self._lock:
+            stats = self.stats.setdefault(
+                phase, {"files": 0, "bytes": 0, "start": batch.start, "end": None}
+            )
+            stats["start"] = min(stats["start"], batch.start)
+        if not items:
+            self._batch_done(batch)
+        # Resolve all destinations first, so that nothing is queued if any of
+        # them fails.
+        queues = [self._get_queue(self._get_device(dst)) for _, dst in items]
+        for q, (src, dst) in zip(queues, items):
+            q.put((batch, src, dst, link_type))
+        return batch
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            batch, src, dst, link_type = item
+            size = 0
+            exc_info = None
+            if not batch.failed:
+                try:
+                    self._dir_linker.ensure_dir(os.path.dirname(dst))
+                    size = os.lstat(src).st_size
+                    batch.linker.link(src, dst, link_type=link_type)
+                except Exception:
+                    exc_info = sys.exc_info()
+            num = batch.item_done(size, exc_info)
+            if num % 100 == 0 or num == batch.total:
+                self.log_debug("Linked %s out of %s packages", num, batch.total)
+            if num == batch.total:
+                self._batch_done(batch)
+
+    def _batch_done(self, batch):
+        """Update stats and log the batch. The batch is always finished, even
+        if this fails, so that nobody waits for it forever.
+        """
+        try:
+            end = time.time()
+            with self._lock:
+                stats = self.stats[batch.phase]
+                stats["files"] += batch.files
+                stats["bytes"] += batch.bytes
+                stats["end"] = max(stats["end"] or end, end)
+            if self.detail_log is not None:
+                self.detail_log.flush()
+            if batch.msg and not batch.failed:
+                if self.detail_log is not None:
+                    self.log_info(
+                        "[DONE ] %s (%s, details in %s)",
+                        batch.msg,
+                        batch.linker.get_summary() or "no files",
+                        self.detail_log.path,
+                    )
+                else:
+                    self.log_info("[DONE ] %s" % batch.msg)
+        except Exception:
+            if not batch.exc_info:
+                batch.exc_info = sys.exc_info()
+        finally:
+            batch.finish()
+
+    def get_report(self):
+        """Return lines describing throughput of linking in each phase. The
+        time is measured from the first submitted batch to the last finished
+        one.
+        """
+        lines = []
+        for phase, stats in sorted(self.stats.items(), key=lambda x: str(x[0])):
+            if stats["end"] is None:
+                continue
+            duration = max(stats["end"] - stats["start"], 0.001)
+            lines.append(
+                "%s: %d files, %.1f MiB in %.2f s (%.1f files/s, %.1f MiB/s)"
+                % (
+                    phase,
+                    stats["files"],
+                    stats["bytes"] / 1024.0 / 1024,
+                    duration,
+                    stats["files"] / duration,
+                    stats["bytes"] / 1024.0 / 1024 / duration,
+                )
+            )
+        return lines
+
+    def stop(self):
+        """Stop all threads. Batches that are still queued are finished
+        first.
+        """
+        with self._lock:
+            queues = list(self._queues.values())
+            threads = self._threads
+            self._queues = {}
+            self._threads = []
+        for q in queues:
+            for _ in range(self.threads_per_filesystem):
+                q.put(None)
+        for t in threads:
+            t.join()
+
+
+# {compose topdir: LinkService}
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_link_service(compose):
+    """Return the link service shared by all phases of the compose."""
+    with _services_lock:
+        if compose.topdir not in _services:
+            _services[compose.topdir] = LinkService(
+                compose.conf.get("link_threads_per_filesystem", 10),
+                logger=compose._logger,
+                detail_log=get_detail_log(compose, "linker"),
+            )
+        return _services[compose.topdir]
+
+
+def close_link_service(compose):
+    """Stop the link service of the compose, if it was started, and log the
+    throughput of each phase.
+    """
+    with _services_lock:
+        service = _services.pop(compose.topdir, None)
+    if not service:
+        return
+    service.stop()
+    for line in service.get_report():
+        compose.log_info("Linking throughput: %s" % line)
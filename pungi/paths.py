@@ -121,6 +121,17 @@ class LogPaths(object):
             self.topdir(arch, create_dir=create_dir), "%s.%s.log" % (log_name, arch)
         )
 
+    def detail_log_file(self, arch, log_name, create_dir=True):
+        """
+        Examples:
+            logs/global/linker.global.jsonl.gz
+        """
+        arch = arch or "global"
+        return os.path.join(
+            self.topdir(arch, create_dir=create_dir),
+            "%s.%s.jsonl.gz" % (log_name, arch),
+        )
+
 
 class WorkPaths(object):
     def __init__(self, compose):
@@ -514,17 +525,17 @@ class WorkPaths(object):
         PackageSetBase.file_cache should be stored.
 
         Example:
-            work/global/pkgset_f33-compose_file_cache.pickle
+            work/global/pkgset_f33-compose_file_cache.bin
         """
-        filename = "pkgset_%s_file_cache.pickle" % pkgset_name
+        filename = "pkgset_%s_file_cache.bin" % pkgset_name
         return os.path.join(self.topdir(arch="global"), filename)
 
     def pkgset_reuse_file(self, pkgset_name):
         """
         Example:
-            work/global/pkgset_f30-compose_reuse.pickle
+            work/global/pkgset_f30-compose_reuse.bin
         """
-        filename = "pkgset_%s_reuse.pickle" % pkgset_name
+        filename = "pkgset_%s_reuse.bin" % pkgset_name
         return os.path.join(self.topdir(arch="global", create_dir=False), filename)
 
 
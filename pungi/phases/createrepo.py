@@ -29,6 +29,7 @@ from kobo.threads import ThreadPool, WorkerThread
 from kobo.shortcuts import run, relative_path
 
 from ..wrappers.scm import get_dir_from_scm
+from ..wrappers import createrepo_lib
 from ..wrappers.createrepo import CreaterepoWrapper
 from .base import PhaseBase
 from ..util import get_arch_variant_data, temp_dir
@@ -50,6 +51,10 @@ class CreaterepoPhase(PhaseBase):
         self.pool = ThreadPool(logger=self.compose._logger)
         self.modules_metadata = ModulesMetadata(compose)
         self.pkgset_phase = pkgset_phase
+        # Metadata of package set repos shared by all variant repos created
+        # with createrepo_c Python bindings.
+        self.metadata_cache = None
+        self.rpms_index = None
 
     def validate(self):
         errors = []
@@ -65,9 +70,19 @@ class CreaterepoPhase(PhaseBase):
         reference_pkgset = None
         if self.pkgset_phase and self.pkgset_phase.package_sets:
             reference_pkgset = self.pkgset_phase.package_sets[-1]
+        if self.compose.conf["createrepo_backend"] == "python":
+            self.metadata_cache = createrepo_lib.MetadataCache()
+        # The manifest is the same for all repos, only read it once.
+        self.rpms_index = get_rpms_index(self.compose)
         for i in range(self.compose.conf["createrepo_num_threads"]):
             self.pool.add(
-                CreaterepoThread(self.pool, reference_pkgset, self.modules_metadata)
+                CreaterepoThread(
+                    self.pool,
+                    reference_pkgset,
+                    self.modules_metadata,
+                    self.metadata_cache,
+                    self.rpms_index,
+                )
             )
 
         for variant in self.compose.get_variants():
@@ -91,10 +106,46 @@ class CreaterepoPhase(PhaseBase):
     def stop(self):
         super(CreaterepoPhase, self).stop()
         self.modules_metadata.write_modules_metadata()
+        if self.metadata_cache:
+            self.compose.log_debug(
+                "Createrepo metadata cache: %s hits, %s misses",
+                self.metadata_cache.hits,
+                self.metadata_cache.misses,
+            )
+            self.metadata_cache = None
+        self.rpms_index = None
+
+
+def get_rpms_index(compose):
+    """Read the RPM manifest of the compose and return paths of packages
+    indexed by ``(variant uid, arch, category)``. Paths are relative to the
+    ``compose`` directory. Packages from all arches of a variant are also
+    available under arch ``None``.
+    """
+    manifest_file = compose.paths.compose.metadata("rpms.json")
+    manifest = productmd.rpms.Rpms()
+    manifest.load(manifest_file)
+
+    index = {}
+    for variant_uid, variant_data in manifest.rpms.items():
+        for rpms_arch, data in variant_data.items():
+            for srpm_data in data.values():
+                for rpm_data in srpm_data.values():
+                    for arch in (rpms_arch, None):
+                        key = (variant_uid, arch, rpm_data["category"])
+                        index.setdefault(key, set()).add(rpm_data["path"])
+    return index
 
 
 def create_variant_repo(
-    compose, arch, variant, pkg_type, pkgset, modules_metadata=None
+    compose,
+    arch,
+    variant,
+    pkg_type,
+    pkgset,
+    modules_metadata=None,
+    metadata_cache=None,
+    rpms_index=None,
 ):
     types = {
         "rpm": (
@@ -152,25 +203,14 @@ def create_variant_repo(
     # We only want delta RPMs for binary repos.
     with_deltas = pkg_type == "rpm" and _has_deltas(compose, variant, arch)
 
-    rpms = set()
-    rpm_nevras = set()
-
     # read rpms from metadata rather than guessing it by scanning filesystem
-    manifest_file = compose.paths.compose.metadata("rpms.json")
-    manifest = productmd.rpms.Rpms()
-    manifest.load(manifest_file)
+    if rpms_index is None:
+        rpms_index = get_rpms_index(compose)
 
-    for rpms_arch, data in manifest.rpms.get(variant.uid, {}).items():
-        if arch is not None and arch != rpms_arch:
-            continue
-        for srpm_data in data.values():
-            for rpm_nevra, rpm_data in srpm_data.items():
-                if types[pkg_type][0] != rpm_data["category"]:
-                    continue
-                path = os.path.join(compose.topdir, "compose", rpm_data["path"])
-                rel_path = relative_path(path, repo_dir.rstrip("/") + "/")
-                rpms.add(rel_path)
-                rpm_nevras.add(str(rpm_nevra))
+    rpms = set()
+    for path in rpms_index.get((variant.uid, arch, types[pkg_type][0]), ()):
+        path = os.path.join(compose.topdir, "compose", path)
+        rpms.add(relative_path(path, repo_dir.rstrip("/") + "/"))
 
     file_list = compose.paths.work.repo_package_list(arch, variant, pkg_type)
     with open(file_list, "w") as f:
@@ -188,26 +228,63 @@ def create_variant_repo(
     comps_path = None
     if compose.has_comps and pkg_type == "rpm":
         comps_path = compose.paths.work.comps(arch=arch, variant=variant)
-    cmd = repo.get_createrepo_cmd(
-        repo_dir,
-        update=True,
-        database=compose.should_create_yum_database,
-        skip_stat=True,
-        pkglist=file_list,
-        outputdir=repo_dir,
-        workers=compose.conf["createrepo_num_workers"],
-        groupfile=comps_path,
-        update_md_path=repo_dir_arch,
-        checksum=createrepo_checksum,
-        deltas=with_deltas,
-        oldpackagedirs=old_package_dirs,
-        use_xz=compose.conf["createrepo_use_xz"],
-        extra_args=compose.conf["createrepo_extra_args"],
-    )
-    log_file = compose.paths.log.log_file(
-        arch, "createrepo-%s.%s" % (variant, pkg_type)
-    )
-    run(cmd, logfile=log_file, show_cmd=True)
+    backend = _get_createrepo_backend(compose, with_deltas)
+    if backend == "slice" and repo_dir_arch:
+        copied, read = createrepo_lib.slice_repo(
+            repo_dir,
+            sorted(rpms),
+            repo_dir_arch,
+            checksum=createrepo_checksum,
+            database=compose.should_create_yum_database,
+            groupfile=comps_path,
+            use_xz=compose.conf["createrepo_use_xz"],
+        )
+        compose.log_debug(
+            "Sliced repodata in %s from %s: %s packages copied, %s read from RPMs",
+            repo_dir,
+            repo_dir_arch,
+            copied,
+            read,
+        )
+    elif backend in ("python", "slice"):
+        reused, read = createrepo_lib.create_repo(
+            repo_dir,
+            sorted(rpms),
+            checksum=createrepo_checksum,
+            database=compose.should_create_yum_database,
+            groupfile=comps_path,
+            use_xz=compose.conf["createrepo_use_xz"],
+            update_md_path=repo_dir_arch,
+            cache=metadata_cache,
+        )
+        compose.log_debug(
+            "Created repodata in %s: %s packages from existing metadata, "
+            "%s read from RPMs",
+            repo_dir,
+            reused,
+            read,
+        )
+    else:
+        cmd = repo.get_createrepo_cmd(
+            repo_dir,
+            update=True,
+            database=compose.should_create_yum_database,
+            skip_stat=True,
+            pkglist=file_list,
+            outputdir=repo_dir,
+            workers=compose.conf["createrepo_num_workers"],
+            groupfile=comps_path,
+            update_md_path=repo_dir_arch,
+            checksum=createrepo_checksum,
+            deltas=with_deltas,
+            oldpackagedirs=old_package_dirs,
+            use_xz=compose.conf["createrepo_use_xz"],
+            extra_args=compose.conf["createrepo_extra_args"],
+        )
+        log_file = compose.paths.log.log_file(
+            arch, "createrepo-%s.%s" % (variant, pkg_type)
+        )
+        run(cmd, logfile=log_file, show_cmd=True)
 
     # call modifyrepo to inject productid
     product_id = compose.conf.get("product_id")
@@ -281,6 +358,22 @@ def create_variant_repo(
     compose.log_info("[DONE ] %s" % msg)
 
 
+def _get_createrepo_backend(compose, with_deltas):
+    """Return the configured way of creating the repo, unless it has to be
+    created with the command. Delta RPMs and extra arguments are supported
+    only by the command.
+    """
+    backend = compose.conf["createrepo_backend"]
+    if backend == "cli" or not compose.conf["createrepo_c"]:
+        return "cli"
+    if with_deltas or compose.conf["createrepo_extra_args"]:
+        compose.log_debug(
+            "Deltas or extra arguments requested, using createrepo_c command"
+        )
+        return "cli"
+    return backend
+
+
 def add_modular_metadata(repo, repo_path, mod_index, log_file):
     """Add modular metadata into a repository."""
     # Dumping empty index fails, we need to check for that.
@@ -311,10 +404,19 @@ def find_file_in_repodata(repo_path, type_):
 
 
 class CreaterepoThread(WorkerThread):
-    def __init__(self, pool, reference_pkgset, modules_metadata):
+    def __init__(
+        self,
+        pool,
+        reference_pkgset,
+        modules_metadata,
+        metadata_cache=None,
+        rpms_index=None,
+    ):
         super(CreaterepoThread, self).__init__(pool)
         self.reference_pkgset = reference_pkgset
         self.modules_metadata = modules_metadata
+        self.metadata_cache = metadata_cache
+        self.rpms_index = rpms_index
 
     def process(self, item, num):
         compose, arch, variant, pkg_type = item
@@ -325,6 +427,8 @@ class CreaterepoThread(WorkerThread):
             pkg_type=pkg_type,
             pkgset=self.reference_pkgset,
             modules_metadata=self.modules_metadata,
+            metadata_cache=self.metadata_cache,
+            rpms_index=self.rpms_index,
         )
 
 
@@ -24,6 +24,7 @@ from pungi.util import get_arch_variant_data, pkg_is_rpm, copy_all
 from pungi.arch import split_name_arch
 from pungi.wrappers.scm import get_file_from_scm, get_dir_from_scm
 from pungi.phases.base import ConfigGuardedPhase
+from pungi.phases.pkgset.common import get_package_index
 from pungi import metadata
 
 
@@ -96,12 +97,15 @@ def copy_extra_files(
             pattern = scm_dict["repo"] % var_dict
             pkg_name, pkg_arch = split_name_arch(pattern)
             for package_set in package_sets:
-                for pkgset_file in package_set[arch]:
-                    pkg_obj = package_set[arch][pkgset_file]
-                    if pkg_is_rpm(pkg_obj) and _pkg_matches(
-                        pkg_obj, pkg_name, pkg_arch
-                    ):
-                        rpms.append(pkg_obj.file_path)
+                # Gather frees the indexes when it's done, this phase must
+                # not create one that would be kept in memory.
+                index = get_package_index(package_set, arch, "name", cache=False)
+                for name in fnmatch.filter(index, pkg_name):
+                    for pkg_obj in index[name]:
+                        if pkg_is_rpm(pkg_obj) and _pkg_matches(
+                            pkg_obj, pkg_name, pkg_arch
+                        ):
+                            rpms.append(pkg_obj.file_path)
             if not rpms:
                 raise RuntimeError(
                     "No package matching %s in the package set." % pattern
@@ -14,25 +14,29 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import functools
 import json
 import glob
+import multiprocessing
 import os
 import shutil
+import sys
 import threading
+import time
+
+import six
 from six.moves import cPickle as pickle
 
 from kobo.rpmlib import parse_nvra
 from kobo.shortcuts import run
 from productmd.rpms import Rpms
 
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
-
+from pungi.wrappers import libsolv
+from pungi.wrappers.pungi import close_gather_servers
 from pungi.wrappers.scm import get_file_from_scm
 from .link import link_files
 from ...wrappers.createrepo import CreaterepoWrapper
+import pungi.linker
 import pungi.wrappers.kojiwrapper
 
 from pungi.compose import get_ordered_variant_uids
@@ -41,6 +45,9 @@ from pungi.phases.base import PhaseBase
 from pungi.util import get_arch_data, get_arch_variant_data, get_variant_data, makedirs
 from pungi.module_util import Modulemd, collect_module_defaults
 from pungi.phases.createrepo import add_modular_metadata
+from pungi.phases.gather.solver_cache import get_solver_cache
+from pungi.phases.pkgset.common import PACKAGE_INDEXES
+from pungi.scheduler import Scheduler
 
 
 def get_gather_source(name):
@@ -71,6 +78,8 @@ class GatherPhase(PhaseBase):
         self.manifest.compose.type = self.compose.compose_type
         self.manifest.compose.date = self.compose.compose_date
         self.manifest.compose.respin = self.compose.compose_respin
+        # Worker processes for gathering, see start_processes().
+        self._process_pool = None
 
     def validate(self):
         errors = []
@@ -92,6 +101,22 @@ class GatherPhase(PhaseBase):
                     "required by %r" % (required, requiring)
                 )
 
+        if self.compose.conf["gather_hybrid_solver"] == "libsolv" and not libsolv.solv:
+            errors.append("Using libsolv in hybrid solver requires libsolv bindings.")
+
+        # Gather servers and libsolv sessions are started lazily and kept in
+        # the process using them. Each worker process would start its own.
+        if self.compose.conf["gather_processes"]:
+            if self.compose.conf["gather_dnf_server"]:
+                errors.append(
+                    "gather_dnf_server can not be used with gather_processes."
+                )
+            if self.compose.conf["gather_hybrid_solver"] == "libsolv":
+                errors.append(
+                    "Using libsolv in hybrid solver is not possible with "
+                    "gather_processes."
+                )
+
         if errors:
             raise ValueError("\n".join(errors))
 
@@ -99,28 +124,117 @@ class GatherPhase(PhaseBase):
         self.compose.log_info("Writing RPM manifest: %s" % self.manifest_file)
         self.manifest.dump(self.manifest_file)
 
-    def run(self):
-        pkg_map = gather_wrapper(
-            self.compose, self.pkgset_phase.package_sets, self.pkgset_phase.path_prefix
+    def start_processes(self):
+        """Fork the worker processes if ``gather_processes`` is enabled.
+
+        This must be called before other phases start, as forking while other
+        threads are running could copy locks they hold (e.g. in logging) into
+        the workers, which would then deadlock.
+        """
+        if not self.compose.conf["gather_processes"] or self.skip():
+            return
+        # The service is started again when linking in this phase.
+        pungi.linker.close_link_service(self.compose)
+        # Worker threads of the package set phase may still be finishing.
+        running = _join_other_threads(timeout=60)
+        if running:
+            raise RuntimeError(
+                "Can not fork gather processes, other threads are running: %s"
+                % ", ".join(sorted(t.name for t in running))
+            )
+        self._process_pool = start_gather_processes(
+            self.compose, self.pkgset_phase.package_sets
         )
 
-        for variant_uid in get_ordered_variant_uids(self.compose):
-            variant = self.compose.all_variants[variant_uid]
-            if variant.is_empty:
-                continue
-            for arch in variant.arches:
-                link_files(
-                    self.compose,
-                    arch,
-                    variant,
-                    pkg_map[arch][variant.uid],
-                    self.pkgset_phase.package_sets,
-                    manifest=self.manifest,
-                )
+    def _stop_processes(self):
+        if self._process_pool:
+            self._process_pool.terminate()
+            self._process_pool.join()
+            self._process_pool = None
+
+    def run(self):
+        try:
+            pkg_map = gather_wrapper(
+                self.compose,
+                self.pkgset_phase.package_sets,
+                self.pkgset_phase.path_prefix,
+                pool=self._process_pool,
+            )
+        finally:
+            self._stop_processes()
+
+        # Linking of all variants runs in parallel in the compose-wide link
+        # service, wait for all of it before writing the manifest.
+        # If submitting or linking fails, still wait for all submitted
+        # batches, so that nothing is linked in the background while the
+        # compose is being aborted.
+        batches = []
+        exc_info = None
+        try:
+            for variant_uid in get_ordered_variant_uids(self.compose):
+                variant = self.compose.all_variants[variant_uid]
+                if variant.is_empty:
+                    continue
+                for arch in variant.arches:
+                    batches.append(
+                        link_files(
+                            self.compose,
+                            arch,
+                            variant,
+                            pkg_map[arch][variant.uid],
+                            self.pkgset_phase.package_sets,
+                            manifest=self.manifest,
+                        )
+                    )
+        except Exception:
+            exc_info = sys.exc_info()
+        for batch in batches:
+            try:
+                batch.wait()
+            except Exception:
+                exc_info = exc_info or sys.exc_info()
+        if exc_info:
+            six.reraise(*exc_info)
 
         self._write_manifest()
+        self._free_pkgset_indexes()
+        count = libsolv.close_sessions()
+        if count:
+            self.compose.log_debug("Closed %s libsolv sessions", count)
+        count = close_gather_servers()
+        if count:
+            self.compose.log_debug("Stopped %s pungi-gather servers", count)
+        solver_cache = get_solver_cache(self.compose)
+        if solver_cache:
+            # Lookups from worker processes are not counted.
+            self.compose.log_debug(
+                "Hybrid solver cache: %s hits, %s misses",
+                solver_cache.hits,
+                solver_cache.misses,
+            )
+
+    def _free_pkgset_indexes(self):
+        """Package set indexes are shared by gather methods and linking. Once
+        it's all done, release the memory.
+        """
+        for pkgset in self.pkgset_phase.package_sets:
+            for (arch, kind), size in sorted(pkgset.index_sizes.items()):
+                self.compose.log_debug(
+                    "Package set %s: %s index for %s used %.1f MiB",
+                    pkgset.name,
+                    kind,
+                    arch,
+                    size / 1024.0**2,
+                )
+            size = pkgset.free_indexes()
+            self.compose.log_info(
+                "Package set %s: freed indexes using %.1f MiB",
+                pkgset.name,
+                size / 1024.0**2,
+            )
 
     def stop(self):
+        self._stop_processes()
         super(GatherPhase, self).stop()
 
 
@@ -724,68 +838,202 @@ def _update_lookaside_config(compose, variant, arch, pkg_map, package_sets=None)
         _update_config(compose, variant.uid, arch, repo)
 
 
-def _gather_variants(
-    result, compose, variant_type, package_sets, exclude_fulltree=False
-):
-    """Run gathering on all arches of all variants of given type.
+def _gather_variants(result, compose, package_sets, pool=None):
+    """Run gathering on all arches of all variants.
 
-    If ``exclude_fulltree`` is set, all source packages from parent variants
-    will be added to fulltree excludes for the processed variants.
+    Gathering for each variant and arch starts as soon as everything it needs
+    is available. That is results of parent variant (source packages from
+    addons and layered products are added to fulltree excludes) and results
+    of variants used as lookaside. At most ``gather_num_threads`` run at the
+    same time. If a pool created by start_gather_processes is given, the
+    gathering itself runs in its worker processes.
     """
+    scheduler = Scheduler()
+    lock = threading.Lock()
+    lookasides = {}
+    for dest, lookaside_variant_uid in compose.conf.get("variant_as_lookaside", []):
+        lookasides.setdefault(dest, []).append(lookaside_variant_uid)
+
+    def gather_name(variant_uid, arch):
+        return "gather-%s.%s" % (variant_uid, arch)
+
+    def lookaside_name(variant_uid, arch):
+        return "lookaside-%s.%s" % (variant_uid, arch)
+
+    def get_deps(variant, arch):
+        deps = []
+        if variant.parent and arch in variant.parent.arches:
+            deps.append(gather_name(variant.parent.uid, arch))
+        for lookaside_variant_uid in lookasides.get(variant.uid, []):
+            lookaside_variant = compose.all_variants[lookaside_variant_uid]
+            if arch in lookaside_variant.arches:
+                deps.append(lookaside_name(lookaside_variant_uid, arch))
+        return deps
+
+    def gather(variant, arch):
+        fulltree_excludes = set()
+        if variant.type in ("addon", "layered-product"):
+            for pkg_name, pkg_arch in get_parent_pkgs(arch, variant, result)["srpm"]:
+                fulltree_excludes.add(pkg_name)
+
+        # Get lookaside repos for this variant from other variants. Based on
+        # the dependencies we already know that we have the packages from
+        # there.
+        _update_lookaside_config(compose, variant, arch, result, package_sets)
+
+        if pool:
+            pkg_map = pool.apply(
+                _gather_in_process,
+                (
+                    variant.uid,
+                    arch,
+                    fulltree_excludes,
+                    compose.conf.get("gather_lookaside_repos", []),
+                ),
+            )
+        else:
+            pkg_map = _gather_variant_arch(
+                compose, arch, variant, package_sets, fulltree_excludes
+            )
+        with lock:
+            result.setdefault(arch, {})[variant.uid] = pkg_map
 
-    for variant_uid in get_ordered_variant_uids(compose):
-        variant = compose.all_variants[variant_uid]
-        if variant.type != variant_type:
-            continue
-        threads_list = []
-        que = Queue()
-        errors = Queue()
-        for arch in variant.arches:
-            fulltree_excludes = set()
-            if exclude_fulltree:
-                for pkg_name, pkg_arch in get_parent_pkgs(arch, variant, result)[
-                    "srpm"
-                ]:
-                    fulltree_excludes.add(pkg_name)
-
-            # Get lookaside repos for this variant from other variants. Based
-            # on the ordering we already know that we have the packages from
-            # there.
-            _update_lookaside_config(compose, variant, arch, result, package_sets)
-
-            def worker(que, errors, arch, *args, **kwargs):
-                try:
-                    que.put((arch, gather_packages(*args, **kwargs)))
-                except Exception as exc:
-                    compose.log_error(
-                        "Error in gathering for %s.%s: %s", variant, arch, exc
+    def cleanup(variant):
+        # Remove the module -> pkgset mapping to save memory
+        variant.nsvc_to_pkgset = None
+
+    lookaside_variants = set(uid for uids in lookasides.values() for uid in uids)
+    # Tasks must be added after their dependencies.
+    pending = [
+        compose.all_variants[variant_uid]
+        for variant_uid in get_ordered_variant_uids(compose)
+    ]
+    while pending:
+        waiting = []
+        for variant in pending:
+            deps = set(
+                dep for arch in variant.arches for dep in get_deps(variant, arch)
+            )
+            if not deps.issubset(scheduler.tasks):
+                waiting.append(variant)
+                continue
+            for arch in variant.arches:
+                scheduler.add(
+                    gather_name(variant.uid, arch),
+                    functools.partial(gather, variant, arch),
+                    deps=get_deps(variant, arch),
+                )
+                if variant.uid in lookaside_variants:
+                    scheduler.add(
+                        lookaside_name(variant.uid, arch),
+                        functools.partial(
+                            _make_lookaside_repo,
+                            compose,
+                            variant,
+                            arch,
+                            result,
+                            package_sets,
+                        ),
+                        deps=[gather_name(variant.uid, arch)],
                     )
-                    compose.traceback("gather-%s-%s" % (variant, arch))
-                    errors.put(exc)
-
-            # Run gather_packages() in parallel with multi threads and store
-            # its return value in a Queue() for later use.
-            t = threading.Thread(
-                target=worker,
-                args=(que, errors, arch, compose, arch, variant, package_sets),
-                kwargs={"fulltree_excludes": fulltree_excludes},
+            scheduler.add(
+                "cleanup-%s" % variant.uid,
+                functools.partial(cleanup, variant),
+                deps=[gather_name(variant.uid, arch) for arch in variant.arches],
+            )
+        if len(waiting) == len(pending):
+            raise ValueError(
+                "Variants %s depend on each other"
+                % ", ".join(variant.uid for variant in waiting)
             )
-            threads_list.append(t)
-            t.start()
+        pending = waiting
 
-        for t in threads_list:
-            t.join()
+    scheduler.run(threads=compose.conf["gather_num_threads"])
+    for line in scheduler.get_report():
+        compose.log_debug("Gather: %s", line)
 
-        while not errors.empty():
-            exc = errors.get()
-            raise exc
 
-        while not que.empty():
-            arch, pkg_map = que.get()
-            result.setdefault(arch, {})[variant.uid] = pkg_map
+def _gather_variant_arch(compose, arch, variant, package_sets, fulltree_excludes):
+    try:
+        return gather_packages(
+            compose, arch, variant, package_sets, fulltree_excludes=fulltree_excludes
+        )
+    except Exception as exc:
+        compose.log_error("Error in gathering for %s.%s: %s", variant, arch, exc)
+        compose.traceback("gather-%s-%s" % (variant, arch))
+        raise
+
+
+def start_gather_processes(compose, package_sets):
+    """Create a pool of ``gather_num_threads`` worker processes for
+    gathering. The workers get the package sets with all indexes from the
+    parent process memory. No other threads may be running when this is
+    called.
+    """
+    _prepare_package_indexes(compose, package_sets)
+    return _get_fork_context().Pool(
+        int(compose.conf["gather_num_threads"]),
+        initializer=_init_gather_process,
+        initargs=(compose, package_sets),
+    )
 
-        # Remove the module -> pkgset mapping to save memory
-        variant.nsvc_to_pkgset = None
+
+def _join_other_threads(timeout):
+    """Wait for all threads except the current one to finish. Returns the
+    threads that are still running after the timeout.
+    """
+    deadline = time.time() + timeout
+    for t in threading.enumerate():
+        if t is not threading.current_thread():
+            t.join(max(deadline - time.time(), 0))
+    return [t for t in threading.enumerate() if t is not threading.current_thread()]
+
+
+def _get_fork_context():
+    try:
+        return multiprocessing.get_context("fork")
+    except AttributeError:
+        # Python 2 always forks.
+        return multiprocessing
+
+
+def _prepare_package_indexes(compose, package_sets):
+    """Build all package set indexes before worker processes are forked. The
+    workers get them from the parent process memory, so they don't need to
+    build them again or receive them pickled.
+    """
+    for pkgset in package_sets:
+        if not hasattr(pkgset, "get_index"):
+            continue
+        for arch in compose.get_arches():
+            for kind in PACKAGE_INDEXES:
+                pkgset.get_index(arch, kind)
+
+
+# Data inherited by gather worker processes from the parent process.
+_process_state = {}
+
+
+def _init_gather_process(compose, package_sets):
+    _process_state["compose"] = compose
+    _process_state["package_sets"] = package_sets
+
+
+def _gather_in_process(variant_uid, arch, fulltree_excludes, lookaside_repos):
+    """Gather packages for a variant and arch in a worker process. Only the
+    resulting package map is sent back to the parent. Lookaside repos for
+    other variants are created after the worker was started, so the current
+    configuration is passed in.
+    """
+    compose = _process_state["compose"]
+    compose.conf["gather_lookaside_repos"] = lookaside_repos
+    return _gather_variant_arch(
+        compose,
+        arch,
+        compose.all_variants[variant_uid],
+        _process_state["package_sets"],
+        fulltree_excludes,
+    )
 
 
 def _trim_variants(
@@ -828,15 +1076,10 @@ def _trim_variants(
     return all_included_packages
 
 
-def gather_wrapper(compose, package_sets, path_prefix):
+def gather_wrapper(compose, package_sets, path_prefix, pool=None):
     result = {}
 
-    _gather_variants(result, compose, "variant", package_sets)
-    _gather_variants(result, compose, "addon", package_sets, exclude_fulltree=True)
-    _gather_variants(
-        result, compose, "layered-product", package_sets, exclude_fulltree=True
-    )
-    _gather_variants(result, compose, "optional", package_sets)
+    _gather_variants(result, compose, package_sets, pool=pool)
 
     all_addon_pkgs = _trim_variants(result, compose, "addon")
     # TODO do we really want to move packages to parent here?
@@ -18,7 +18,8 @@ import os
 
 import kobo.rpmlib
 
-from pungi.linker import LinkerPool
+from pungi.linker import get_link_service
+from pungi.phases.pkgset.common import get_merged_index
 
 
 # TODO: global Linker instance - to keep hardlinks on dest?
@@ -58,22 +59,22 @@ def get_package_path(filename, hashed_directory=False):
 
 
 def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={}):
+    """Update the manifest and submit the packages for linking into the
+    compose. Returns a LinkBatch that has to be waited for.
+    """
     # srpm_map instance is shared between link_files() runs
 
     msg = "Linking packages (arch: %s, variant: %s)" % (arch, variant)
     compose.log_info("[BEGIN] %s" % msg)
     link_type = compose.conf["link_type"]
 
-    pool = LinkerPool.with_workers(10, link_type, logger=compose._logger)
+    files = []
 
     hashed_directories = compose.conf["hashed_directories"]
 
-    # Create temporary dict mapping package path to package object from pkgset
-    # so we do not have to search all pkg_sets for every package in pkg_map.
-    pkg_by_path = {}
-    for pkg_set in pkg_sets:
-        for path in pkg_set[arch]:
-            pkg_by_path[path] = pkg_set[arch][path]
+    # Mapping from package path to package object from pkgset, so we do not
+    # have to search all pkg_sets for every package in pkg_map.
+    pkg_by_path = get_merged_index(pkg_sets, arch, "path")
 
     packages_dir = compose.paths.compose.packages("src", variant)
     packages_dir_relpath = compose.paths.compose.packages("src", variant, relative=True)
@@ -87,7 +88,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        files.append((pkg["path"], dst))
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -116,7 +117,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        files.append((pkg["path"], dst))
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -146,7 +147,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        files.append((pkg["path"], dst))
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -162,6 +163,4 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
             srpm_nevra=src_nevra,
         )
 
-    pool.start()
-    pool.stop()
-    compose.log_info("[DONE ] %s" % msg)
+    return get_link_service(compose).submit(files, link_type, phase="gather", msg=msg)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Cache of file names of packages in lookaside repositories.
+
+The same lookaside repos are used by many variants and arches. Parsing their
+primary metadata (and possibly downloading it first) each time is wasteful.
+Only repomd.xml is read every time, the list of packages is looked up by
+checksum of the primary metadata. Optionally the lists are stored in an
+SQLite database and reused by following composes.
+"""
+
+import json
+import os
+import threading
+
+import createrepo_c as cr
+
+from pungi.cache_db import CacheDatabase
+from pungi.util import as_local_file
+
+
+def read_repomd(path):
+    with as_local_file(os.path.join(path, "repodata/repomd.xml")) as url_:
+        return cr.Repomd(url_)
+
+
+def read_package_names(path, record):
+    """Return set of file names of packages listed in the primary metadata
+    described by given repomd record.
+    """
+    packages = set()
+
+    def callback(pkg):
+        packages.add(os.path.basename(pkg.location_href))
+
+    with as_local_file(os.path.join(path, record.location_href)) as url_:
+        cr.xml_parse_primary(url_, pkgcb=callback, do_files=False)
+    return packages
+
+
+class LookasideCache(object):
+    # Bump this when the stored data changes.
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # checksum of primary metadata -> frozenset of file names
+        self._packages = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if self.path:
+            self._db = CacheDatabase(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS packages ("
+                "checksum TEXT PRIMARY KEY, version INTEGER, packages TEXT)"
+            )
+
+    def get(self, repo):
+        """Return set of file names of packages in the given repository."""
+        packages = set()
+        for rec in read_repomd(repo).records:
+            if rec.type == "primary":
+                packages.update(self._get_primary(repo, rec))
+        return packages
+
+    def _get_primary(self, repo, rec):
+        key = "%s:%s" % (rec.checksum_type, rec.checksum)
+        with self._lock:
+            if key in self._packages:
+                self.hits += 1
+                return self._packages[key]
+
+        packages = None
+        if self._db:
+            row = self._db.execute(
+                "SELECT version, packages FROM packages WHERE checksum = ?", (key,)
+            )
+            if row and row[0] == self.VERSION:
+                packages = frozenset(json.loads(row[1]))
+
+        if packages is None:
+            packages = frozenset(read_package_names(repo, rec))
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO packages VALUES (?, ?, ?)",
+                    (key, self.VERSION, json.dumps(sorted(packages))),
+                )
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.hits += 1
+
+        with self._lock:
+            self._packages[key] = packages
+        return packages
+
+
+# Path to persistent database (or None) -> LookasideCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_lookaside_cache(compose):
+    """Return the cache shared by all variants and arches in the compose."""
+    path = compose.conf.get("gather_lookaside_cache")
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = LookasideCache(path)
+        return _caches[path]
@@ -17,16 +17,16 @@
 import os
 import shutil
 
+import six
+
 from kobo.shortcuts import run
-from kobo.pkgset import SimpleRpmWrapper, RpmWrapper
 from kobo.rpmlib import parse_nvra
 
 from pungi.util import get_arch_variant_data, temp_dir
-from pungi.wrappers.pungi import PungiWrapper
+from pungi.wrappers.pungi import PungiWrapper, get_gather_server
 
 from pungi.arch import tree_arch_to_yum_arch
 import pungi.phases.gather
-from pungi.phases.pkgset.pkgsets import ExtendedRpmWrapper
 
 import pungi.phases.gather.method
 
@@ -97,10 +97,10 @@ def _format_packages(pkgs):
     """Sort packages and merge name with arch."""
     result = set()
     for pkg, pkg_arch in pkgs:
-        if type(pkg) in [SimpleRpmWrapper, RpmWrapper, ExtendedRpmWrapper]:
-            pkg_name = pkg.name
-        else:
+        if isinstance(pkg, six.string_types):
             pkg_name = pkg
+        else:
+            pkg_name = pkg.name
         if pkg_arch:
             result.add("%s.%s" % (pkg_name, pkg_arch))
         else:
@@ -136,19 +136,7 @@ def write_pungi_config(
     for i, pkgset in enumerate(package_sets or []):
         if not variant.pkgsets or pkgset.name in variant.pkgsets:
             repos["pungi-repo-%d" % i] = pkgset.paths[arch]
-    if compose.has_comps:
-        repos["comps-repo"] = compose.paths.work.comps_repo(arch=arch, variant=variant)
-    if variant.type == "optional":
-        for var in variant.parent.get_variants(
-            arch=arch, types=["self", "variant", "addon", "layered-product"]
-        ):
-            repos["%s-comps" % var.uid] = compose.paths.work.comps_repo(
-                arch=arch, variant=var
-            )
-    if variant.type in ["addon", "layered-product"]:
-        repos["parent-comps"] = compose.paths.work.comps_repo(
-            arch=arch, variant=variant.parent
-        )
+    repos.update(get_comps_repos(compose, arch, variant))
 
     lookaside_repos = {}
     for i, repo_url in enumerate(
@@ -179,6 +167,25 @@ def write_pungi_config(
     )
 
 
+def get_comps_repos(compose, arch, variant):
+    """Return dict mapping name to path of repos that only provide comps."""
+    repos = {}
+    if compose.has_comps:
+        repos["comps-repo"] = compose.paths.work.comps_repo(arch=arch, variant=variant)
+    if variant.type == "optional":
+        for var in variant.parent.get_variants(
+            arch=arch, types=["self", "variant", "addon", "layered-product"]
+        ):
+            repos["%s-comps" % var.uid] = compose.paths.work.comps_repo(
+                arch=arch, variant=var
+            )
+    if variant.type in ["addon", "layered-product"]:
+        repos["parent-comps"] = compose.paths.work.comps_repo(
+            arch=arch, variant=variant.parent
+        )
+    return repos
+
+
 def resolve_deps(compose, arch, variant, source_name=None):
     pungi_wrapper = PungiWrapper()
     pungi_log = compose.paths.work.pungi_log(arch, variant, source_name=source_name)
@@ -240,10 +247,27 @@ def resolve_deps(compose, arch, variant, source_name=None):
         multilib_methods=multilib_methods,
         profiler=profiler,
     )
-    # Use temp working directory directory as workaround for
-    # https://bugzilla.redhat.com/show_bug.cgi?id=795137
-    with temp_dir(prefix="pungi_") as work_dir:
-        run(cmd, logfile=pungi_log, show_cmd=True, workdir=work_dir, env=os.environ)
+    if compose.conf["gather_backend"] == "dnf" and compose.conf.get(
+        "gather_dnf_deps_cache"
+    ):
+        cmd.append("--deps-cache=%s" % compose.conf["gather_dnf_deps_cache"])
+    if compose.conf["gather_backend"] == "dnf" and compose.conf["gather_dnf_server"]:
+        # All variants for the arch are processed by one pungi-gather process,
+        # which loads the repos only once if they are the same.
+        server = get_gather_server(
+            arch,
+            compose.paths.work.tmp_dir(arch),
+            compose.paths.log.log_file(arch, "pungi-gather-server"),
+        )
+        for repo in sorted(get_comps_repos(compose, arch, variant)):
+            cmd.append("--comps-repo=%s" % repo)
+        compose.log_debug("Sending to pungi-gather server: %s", " ".join(cmd[1:]))
+        server.run(cmd[1:], pungi_log)
+    else:
+        # Use temp working directory directory as workaround for
+        # https://bugzilla.redhat.com/show_bug.cgi?id=795137
+        with temp_dir(prefix="pungi_") as work_dir:
+            run(cmd, logfile=pungi_log, show_cmd=True, workdir=work_dir, env=os.environ)
 
     # Clean up tmp dir
     # Workaround for rpm not honoring sgid bit which only appears when yum is used.
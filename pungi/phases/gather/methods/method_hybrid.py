@@ -15,7 +15,6 @@
 
 import gzip
 import os
-from collections import defaultdict
 from fnmatch import fnmatch
 
 import createrepo_c as cr
@@ -27,8 +26,20 @@ from pungi import multilib_dnf
 from pungi.module_util import Modulemd
 from pungi.arch import get_valid_arches, tree_arch_to_yum_arch
 from pungi.phases.gather import _mk_pkg_map
+from pungi.phases.gather.lookaside_cache import (
+    get_lookaside_cache,
+    read_package_names,
+    read_repomd,
+)
+from pungi.phases.gather.solver_cache import get_solver_cache
+from pungi.phases.pkgset.common import (
+    format_nevra,
+    get_merged_index,
+    get_package_index,
+    get_package_nevra,
+)
 from pungi.util import get_arch_variant_data, pkg_is_debug, temp_dir, as_local_file
-from pungi.wrappers import fus
+from pungi.wrappers import fus, libsolv
 from pungi.wrappers.comps import CompsWrapper
 
 from .method_nodeps import expand_groups
@@ -71,8 +82,8 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
         self.added_langpacks = set()
         # Set of NEVRAs of modular packages
         self.modular_packages = set()
-        # Arch -> pkg name -> set of pkg object
-        self.debuginfo = defaultdict(lambda: defaultdict(set))
+        # Persistent cache of solver results, if configured
+        self.solver_cache = get_solver_cache(self.compose)
 
         # caches for processed packages
         self.processed_multilib = set()
@@ -87,12 +98,7 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
         zero. This makes it easier to query by results for the depsolver.
         """
         if arch not in self.package_maps:
-            pkg_map = {}
-            for pkgset in self.package_sets:
-                for pkg_arch in pkgset.package_sets[arch].rpms_by_arch:
-                    for pkg in pkgset.package_sets[arch].rpms_by_arch[pkg_arch]:
-                        pkg_map[_fmt_nevra(pkg, pkg_arch)] = pkg
-            self.package_maps[arch] = pkg_map
+            self.package_maps[arch] = get_merged_index(self.package_sets, arch, "nevra")
 
         return self.package_maps[arch]
 
@@ -103,41 +109,37 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
             for key in md.keys():
                 pkg = md.get(key)
                 if pkg.arch in self.valid_arches:
-                    self.packages[_fmt_nevra(pkg, arch=pkg.arch)] = FakePackage(pkg)
+                    self.packages[get_package_nevra(pkg)] = FakePackage(pkg)
 
     def _get_package(self, nevra):
         if not self.packages:
             self._prepare_packages()
         return self.packages[nevra]
 
-    def _prepare_debuginfo(self):
-        """Prepare cache of debuginfo packages for easy access. The cache is
-        indexed by package architecture and then by package name. There can be
-        more than one debuginfo package with the same name.
+    def _get_debuginfo(self, name, arch):
+        """Find debuginfo packages with given name and architecture. There can
+        be more than one debuginfo package with the same name.
         """
+        result = set()
         for pkgset in self.package_sets:
-            for pkg_arch in pkgset.package_sets[self.arch].rpms_by_arch:
-                for pkg in pkgset.package_sets[self.arch].rpms_by_arch[pkg_arch]:
-                    self.debuginfo[pkg.arch][pkg.name].add(pkg)
+            index = get_package_index(pkgset, self.arch, "name_arch")
+            result.update(index.get((name, arch), []))
+        return result
 
-    def _get_debuginfo(self, name, arch):
-        if not self.debuginfo:
-            self._prepare_debuginfo()
-        return self.debuginfo.get(arch, {}).get(name, set())
+    def _iter_packages_by_name(self, arch, patterns):
+        """Yield packages whose name matches any of the globs."""
+        for pkgset in self.package_sets:
+            index = get_package_index(pkgset, arch, "name")
+            for name in index:
+                if any(fnmatch(name, pattern) for pattern in patterns):
+                    for pkg in index[name]:
+                        yield pkg
 
     def expand_list(self, patterns):
         """Given a list of globs, create a list of package names matching any
         of the pattern.
         """
-        expanded = set()
-        for pkgset in self.package_sets:
-            for pkg_arch in pkgset.package_sets[self.arch].rpms_by_arch:
-                for pkg in pkgset.package_sets[self.arch].rpms_by_arch[pkg_arch]:
-                    for pattern in patterns:
-                        if fnmatch(pkg.name, pattern):
-                            expanded.add(pkg)
-                            break
-        return expanded
+        return set(self._iter_packages_by_name(self.arch, patterns))
 
     def prepare_modular_packages(self):
         for var in self.compose.all_variants.values():
@@ -154,17 +156,12 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
             # Replace %s with * for fnmatch.
             install_match = install % "*"
             self.langpacks[name] = set()
-            for pkgset in self.package_sets:
-                for pkg_arch in pkgset.package_sets[arch].rpms_by_arch:
-                    for pkg in pkgset.package_sets[arch].rpms_by_arch[pkg_arch]:
-                        if not fnmatch(pkg.name, install_match):
-                            # Does not match the pattern, ignore...
-                            continue
-                        if pkg.name.endswith("-devel") or pkg.name.endswith("-static"):
-                            continue
-                        if pkg_is_debug(pkg):
-                            continue
-                        self.langpacks[name].add(pkg.name)
+            for pkg in self._iter_packages_by_name(arch, [install_match]):
+                if pkg.name.endswith("-devel") or pkg.name.endswith("-static"):
+                    continue
+                if pkg_is_debug(pkg):
+                    continue
+                self.langpacks[name].add(pkg.name)
 
     def __call__(
         self,
@@ -219,6 +216,7 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
             pungi.phases.gather.get_lookaside_repos(self.compose, arch, variant),
             nvrs,
             filter_packages=filter_packages,
+            lookaside_cache=get_lookaside_cache(self.compose),
         )
         # maybe check invalid sigkeys
 
@@ -243,37 +241,59 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
         for pkg_name, pkg_arch in packages:
             input_packages.extend(self._expand_wildcard(pkg_name, pkg_arch))
 
+        lookasides = pungi.phases.gather.get_lookaside_repos(
+            self.compose, arch, variant
+        )
+        session = self.get_solver_session(variant, arch, repos, lookasides, modules)
+
         step = 0
 
         while True:
             step += 1
-            conf_file = self.compose.paths.work.fus_conf(arch, variant, step)
-            fus.write_config(conf_file, sorted(modules), sorted(input_packages))
-            cmd = fus.get_cmd(
-                conf_file,
-                tree_arch_to_yum_arch(arch),
-                repos,
-                pungi.phases.gather.get_lookaside_repos(self.compose, arch, variant),
-                platform=platform,
-                filter_packages=filter_packages,
-            )
             logfile = self.compose.paths.log.log_file(
                 arch, "hybrid-depsolver-%s-iter-%d" % (variant, step)
             )
-            # Adding this environment variable will tell GLib not to prefix
-            # any log messages with the PID of the fus process (which is quite
-            # useless for us anyway).
-            env = os.environ.copy()
-            env["G_MESSAGES_PREFIXED"] = ""
-            env["XDG_CACHE_HOME"] = cache_dir
-            self.compose.log_debug(
-                "[BEGIN] Running fus (arch: %s, variant: %s)" % (arch, variant)
-            )
-            run(cmd, logfile=logfile, show_cmd=True, env=env)
-            output, out_modules = fus.parse_output(logfile)
-            self.compose.log_debug(
-                "[DONE ] Running fus (arch: %s, variant: %s)" % (arch, variant)
-            )
+            key = cached = None
+            if self.solver_cache:
+                key = self.solver_cache.get_key(
+                    "libsolv" if session else "fus",
+                    tree_arch_to_yum_arch(arch),
+                    repos,
+                    lookasides,
+                    packages=input_packages,
+                    modules=modules,
+                    platform=platform,
+                    filter_packages=filter_packages,
+                )
+                cached = self.solver_cache.get(key)
+            if cached:
+                output, out_modules = cached
+                self.compose.log_debug(
+                    "[CACHED] Depsolving iteration %d (arch: %s, variant: %s)"
+                    % (step, arch, variant)
+                )
+                with open(logfile, "w") as f:
+                    f.write("Result taken from solver cache %s\n" % key)
+            elif session:
+                output, out_modules = self.run_libsolv(
+                    session, variant, arch, input_packages, filter_packages, logfile
+                )
+            else:
+                output, out_modules = self.run_fus(
+                    variant,
+                    arch,
+                    repos,
+                    lookasides,
+                    modules,
+                    input_packages,
+                    platform,
+                    filter_packages,
+                    cache_dir,
+                    step,
+                    logfile,
+                )
+            if key and not cached:
+                self.solver_cache.put(key, output, out_modules)
             # No need to resolve modules again. They are not going to change.
             modules = []
             # Reset input packages as well to only solve newly added things.
@@ -303,6 +323,87 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
 
         return results, result_modules
 
+    def get_solver_session(self, variant, arch, repos, lookasides, modules):
+        """Return libsolv session to use for depsolving, or None if fus
+        should be used.
+        """
+        if self.compose.conf["gather_hybrid_solver"] != "libsolv":
+            return None
+        if modules:
+            self.compose.log_debug(
+                "Variant %s.%s has modules, depsolving with fus" % (variant, arch)
+            )
+            return None
+        session = libsolv.get_session(tree_arch_to_yum_arch(arch), repos, lookasides)
+        if session.modular:
+            self.compose.log_debug(
+                "Repos for %s.%s contain modules, depsolving with fus" % (variant, arch)
+            )
+            return None
+        return session
+
+    def run_fus(
+        self,
+        variant,
+        arch,
+        repos,
+        lookasides,
+        modules,
+        input_packages,
+        platform,
+        filter_packages,
+        cache_dir,
+        step,
+        logfile,
+    ):
+        conf_file = self.compose.paths.work.fus_conf(arch, variant, step)
+        fus.write_config(conf_file, sorted(modules), sorted(input_packages))
+        cmd = fus.get_cmd(
+            conf_file,
+            tree_arch_to_yum_arch(arch),
+            repos,
+            lookasides,
+            platform=platform,
+            filter_packages=filter_packages,
+        )
+        # Adding this environment variable will tell GLib not to prefix
+        # any log messages with the PID of the fus process (which is quite
+        # useless for us anyway).
+        env = os.environ.copy()
+        env["G_MESSAGES_PREFIXED"] = ""
+        env["XDG_CACHE_HOME"] = cache_dir
+        self.compose.log_debug(
+            "[BEGIN] Running fus (arch: %s, variant: %s)" % (arch, variant)
+        )
+        run(cmd, logfile=logfile, show_cmd=True, env=env)
+        output, out_modules = fus.parse_output(logfile)
+        self.compose.log_debug(
+            "[DONE ] Running fus (arch: %s, variant: %s)" % (arch, variant)
+        )
+        return output, out_modules
+
+    def run_libsolv(
+        self, session, variant, arch, input_packages, filter_packages, logfile
+    ):
+        self.compose.log_debug(
+            "[BEGIN] Running libsolv (arch: %s, variant: %s)" % (arch, variant)
+        )
+        output, problems = session.solve(sorted(input_packages), filter_packages)
+        with open(logfile, "w") as f:
+            f.write("Input:\n")
+            for pkg in sorted(input_packages):
+                f.write("  %s\n" % pkg)
+            f.write("Problems:\n")
+            for problem in problems:
+                f.write("  %s\n" % problem)
+            f.write("Result:\n")
+            for nvr, pkg_arch, _ in sorted(output):
+                f.write("  %s.%s\n" % (nvr, pkg_arch))
+        self.compose.log_debug(
+            "[DONE ] Running libsolv (arch: %s, variant: %s)" % (arch, variant)
+        )
+        return output, set()
+
     def add_multilib(self, variant, arch, nvrs):
         added = set()
         if not self.multilib_methods:
@@ -409,7 +510,7 @@ class GatherMethodHybrid(pungi.phases.gather.method.GatherMethodBase):
                 # Wildcards should not match modular packages.
                 continue
 
-            packages.append(_fmt_nevra(pkg, pkg.arch))
+            packages.append(get_package_nevra(pkg))
 
         return packages
 
@@ -473,26 +574,10 @@ def _fmt_pkg(pkg_name, arch):
     return pkg_name
 
 
-def _nevra(**kwargs):
-    if kwargs.get("epoch") not in (None, "", 0, "0"):
-        return "%(name)s-%(epoch)s:%(version)s-%(release)s.%(arch)s" % kwargs
-    return "%(name)s-%(version)s-%(release)s.%(arch)s" % kwargs
-
-
-def _fmt_nevra(pkg, arch):
-    return _nevra(
-        name=pkg.name,
-        epoch=pkg.epoch,
-        version=pkg.version,
-        release=pkg.release,
-        arch=arch,
-    )
-
-
 def _get_srpm_nevra(pkg):
     nevra = kobo.rpmlib.parse_nvra(pkg.sourcerpm)
     nevra["epoch"] = nevra["epoch"] or pkg.epoch
-    return _nevra(**nevra)
+    return format_nevra(**nevra)
 
 
 def _make_result(paths):
@@ -501,27 +586,19 @@ def _make_result(paths):
 
 def get_repo_packages(path):
     """Extract file names of all packages in the given repository."""
-
     packages = set()
-
-    def callback(pkg):
-        packages.add(os.path.basename(pkg.location_href))
-
-    repomd = os.path.join(path, "repodata/repomd.xml")
-    with as_local_file(repomd) as url_:
-        repomd = cr.Repomd(url_)
-    for rec in repomd.records:
-        if rec.type != "primary":
-            continue
-        record_url = os.path.join(path, rec.location_href)
-        with as_local_file(record_url) as url_:
-            cr.xml_parse_primary(url_, pkgcb=callback, do_files=False)
-
+    for rec in read_repomd(path).records:
+        if rec.type == "primary":
+            packages.update(read_package_names(path, rec))
     return packages
 
 
-def expand_packages(nevra_to_pkg, lookasides, nvrs, filter_packages):
-    """For each package add source RPM."""
+def expand_packages(
+    nevra_to_pkg, lookasides, nvrs, filter_packages, lookaside_cache=None
+):
+    """For each package add source RPM. If a LookasideCache is given, it's
+    used to find packages in lookaside repos.
+    """
     # This will serve as the final result. We collect sets of paths to the
     # packages.
     rpms = set()
@@ -532,7 +609,10 @@ def expand_packages(nevra_to_pkg, lookasides, nvrs, filter_packages):
 
     lookaside_packages = set()
     for repo in lookasides:
-        lookaside_packages.update(get_repo_packages(repo))
+        if lookaside_cache:
+            lookaside_packages.update(lookaside_cache.get(repo))
+        else:
+            lookaside_packages.update(get_repo_packages(repo))
 
     for nvr, pkg_arch, flags in nvrs:
         pkg = nevra_to_pkg["%s.%s" % (nvr, pkg_arch)]
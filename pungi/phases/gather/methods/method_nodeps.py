@@ -16,15 +16,16 @@
 import os
 from pprint import pformat
 import re
+
+import kobo.rpmlib
 import six
 
 import pungi.arch
 from pungi.util import pkg_is_rpm, pkg_is_srpm, pkg_is_debug
 from pungi.wrappers.comps import CompsWrapper
-from pungi.phases.pkgset.pkgsets import ExtendedRpmWrapper
+from pungi.phases.pkgset.common import get_package_index
 
 import pungi.phases.gather.method
-from kobo.pkgset import SimpleRpmWrapper, RpmWrapper
 
 
 class GatherMethodNodeps(pungi.phases.gather.method.GatherMethodBase):
@@ -69,64 +70,82 @@ class GatherMethodNodeps(pungi.phases.gather.method.GatherMethodBase):
         for i in valid_arches:
             compatible_arches[i] = pungi.arch.get_compatible_arches(i)
 
+        # Split requested packages into name patterns and exact packages.
+        arches_by_pattern = {}
+        by_nevra = {}
+        for gathered_pkg, pkg_arch in packages:
+            if isinstance(gathered_pkg, six.string_types):
+                arches_by_pattern.setdefault(gathered_pkg, []).append(pkg_arch)
+            else:
+                by_nevra.setdefault(gathered_pkg.nevra, []).append(
+                    (gathered_pkg, pkg_arch)
+                )
+        matcher = NameMatcher(arches_by_pattern)
+
         log.write("\nGathering rpms\n")
-        for pkg in iterate_packages(package_sets, arch):
-            if not pkg_is_rpm(pkg):
-                continue
-            for gathered_pkg, pkg_arch in packages:
-                if isinstance(gathered_pkg, six.string_types) and not re.match(
-                    gathered_pkg.replace(".", "\\.")
-                    .replace("+", "\\+")
-                    .replace("*", ".*")
-                    + "$",
-                    pkg.name,
-                ):
-                    continue
-                elif (
-                    type(gathered_pkg)
-                    in [SimpleRpmWrapper, RpmWrapper, ExtendedRpmWrapper]
-                    and pkg.nevra != gathered_pkg.nevra
-                ):
-                    continue
-                if (
-                    pkg_arch is not None
-                    and pkg.arch != pkg_arch
-                    and pkg.arch != "noarch"
-                ):
+        for pkgset in package_sets:
+            for name, pkgs in get_package_index(pkgset, arch, "name").items():
+                patterns = matcher.match(name)
+                if not patterns and not by_nevra:
                     continue
-                result["rpm"].append({"path": pkg.file_path, "flags": ["input"]})
-                seen_rpms.setdefault(pkg.name, set()).add(pkg.arch)
-                seen_srpms.setdefault(pkg.sourcerpm, set()).add(pkg.arch)
-                log.write(
-                    "Added %s (matched %s.%s) (sourcerpm: %s)\n"
-                    % (pkg, gathered_pkg, pkg_arch, pkg.sourcerpm)
-                )
+                for pkg in pkgs:
+                    if not pkg_is_rpm(pkg):
+                        continue
+                    matches = [
+                        (pattern, pkg_arch)
+                        for pattern in patterns
+                        for pkg_arch in arches_by_pattern[pattern]
+                    ]
+                    matches.extend(by_nevra.get(pkg.nevra, []))
+                    for gathered_pkg, pkg_arch in matches:
+                        if (
+                            pkg_arch is not None
+                            and pkg.arch != pkg_arch
+                            and pkg.arch != "noarch"
+                        ):
+                            continue
+                        result["rpm"].append(
+                            {"path": pkg.file_path, "flags": ["input"]}
+                        )
+                        seen_rpms.setdefault(pkg.name, set()).add(pkg.arch)
+                        seen_srpms.setdefault(pkg.sourcerpm, set()).add(pkg.arch)
+                        log.write(
+                            "Added %s (matched %s.%s) (sourcerpm: %s)\n"
+                            % (pkg, gathered_pkg, pkg_arch, pkg.sourcerpm)
+                        )
 
         log.write("\nGathering source rpms\n")
-        for pkg in iterate_packages(package_sets, arch):
-            if not pkg_is_srpm(pkg):
-                continue
-            if pkg.file_name in seen_srpms:
-                result["srpm"].append({"path": pkg.file_path, "flags": ["input"]})
-                log.write("Adding %s\n" % pkg)
+        for pkgset in package_sets:
+            index = get_package_index(pkgset, arch, "name")
+            for sourcerpm in seen_srpms:
+                name = kobo.rpmlib.parse_nvra(sourcerpm)["name"]
+                for pkg in index.get(name, []):
+                    if pkg_is_srpm(pkg) and pkg.file_name == sourcerpm:
+                        result["srpm"].append(
+                            {"path": pkg.file_path, "flags": ["input"]}
+                        )
+                        log.write("Adding %s\n" % pkg)
 
         log.write("\nGathering debuginfo packages\n")
-        for pkg in iterate_packages(package_sets, arch):
-            if not pkg_is_debug(pkg):
-                continue
-            if pkg.sourcerpm not in seen_srpms:
-                log.write("Not considering %s: corresponding srpm not included\n" % pkg)
-                continue
-            pkg_arches = set(compatible_arches[pkg.arch]) - set(["noarch"])
-            seen_arches = set(seen_srpms[pkg.sourcerpm]) - set(["noarch"])
-            if not (pkg_arches & seen_arches):
-                # We only want to pull in a debuginfo if we have a binary
-                # package for a compatible arch. Noarch packages should not
-                # pull debuginfo (they would pull in all architectures).
-                log.write("Not including %s: no package for this arch\n" % pkg)
-                continue
-            result["debuginfo"].append({"path": pkg.file_path, "flags": ["input"]})
-            log.write("Adding %s\n" % pkg)
+        for pkgset in package_sets:
+            index = get_package_index(pkgset, arch, "sourcerpm")
+            for sourcerpm, seen_arches in seen_srpms.items():
+                seen_arches = set(seen_arches) - set(["noarch"])
+                for pkg in index.get(sourcerpm, []):
+                    if not pkg_is_debug(pkg):
+                        continue
+                    pkg_arches = set(compatible_arches[pkg.arch]) - set(["noarch"])
+                    if not (pkg_arches & seen_arches):
+                        # We only want to pull in a debuginfo if we have a binary
+                        # package for a compatible arch. Noarch packages should
+                        # not pull debuginfo (they would pull in all
+                        # architectures).
+                        log.write("Not including %s: no package for this arch\n" % pkg)
+                        continue
+                    result["debuginfo"].append(
+                        {"path": pkg.file_path, "flags": ["input"]}
+                    )
+                    log.write("Adding %s\n" % pkg)
 
         return result
 
@@ -178,6 +197,71 @@ def expand_groups(compose, arch, variant, groups, set_pkg_arch=True):
     return packages
 
 
+# Characters with special meaning in the name patterns. Patterns without any of
+# them can only match a package with exactly that name.
+PATTERN_CHARS = set("*?[]{}()|^$\\")
+
+
+def _pattern_to_regex(pattern):
+    return pattern.replace(".", "\\.").replace("+", "\\+").replace("*", ".*") + "$"
+
+
+class NameMatcher(object):
+    """Find which of the patterns match a package name. A pattern is a package
+    name which can contain ``*`` as a wildcard. Other regular expression
+    syntax is supported as well.
+
+    Exact names are looked up in a dict. Patterns with only wildcards are
+    grouped by the literal prefix before the first wildcard, so only patterns
+    whose prefix matches the start of the name are tried. The remaining
+    patterns, including the ones starting with a wildcard, are compiled into a
+    single expression used to quickly reject names none of them matches.
+    Results are cached per name, as the same name usually exists for multiple
+    arches.
+    """
+
+    def __init__(self, patterns):
+        self.exact = {}
+        # literal prefix -> list of (pattern, compiled regex)
+        self.by_prefix = {}
+        self.other = []
+        for pattern in patterns:
+            if not PATTERN_CHARS.intersection(pattern):
+                self.exact.setdefault(pattern, []).append(pattern)
+                continue
+            regex = re.compile(_pattern_to_regex(pattern))
+            prefix = pattern.split("*", 1)[0]
+            if prefix and not PATTERN_CHARS.intersection(pattern.replace("*", "")):
+                self.by_prefix.setdefault(prefix, []).append((pattern, regex))
+            else:
+                self.other.append((pattern, regex))
+        self.prefix_lengths = sorted(set(len(prefix) for prefix in self.by_prefix))
+        self.other_regex = None
+        if self.other:
+            self.other_regex = re.compile(
+                "|".join("(?:%s)" % regex.pattern for _, regex in self.other)
+            )
+        self.cache = {}
+
+    def match(self, name):
+        """Return list of patterns matching given name."""
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        result = list(self.exact.get(name, []))
+        for length in self.prefix_lengths:
+            if length > len(name):
+                break
+            for pattern, regex in self.by_prefix.get(name[:length], []):
+                if regex.match(name):
+                    result.append(pattern)
+        if self.other_regex and self.other_regex.match(name):
+            result.extend(pattern for pattern, regex in self.other if regex.match(name))
+        self.cache[name] = result
+        return result
+
+
 def iterate_packages(package_sets, arch):
     for pkgset in package_sets:
         for pkg in pkgset[arch]:
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Persistent cache of hybrid depsolver results shared across composes.
+
+Each solver run is identified by the content of all repositories and
+lookasides it uses together with all its inputs. A repository is identified
+by checksums of the metadata relevant for solving, as listed in its
+repomd.xml. The repomd.xml itself contains timestamps, so it changes even if
+the content does not.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import createrepo_c as cr
+
+from pungi.cache_db import CacheDatabase
+from pungi.util import as_local_file
+
+# Types of repodata that can change the result of solving.
+SOLVER_METADATA = ("primary", "filelists", "modules")
+
+
+class SolverCache(object):
+    # Bump this when the stored data or the key changes.
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # repo path -> checksum of its metadata
+        self._repo_checksums = {}
+        self._lock = threading.Lock()
+        self._db = CacheDatabase(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, version INTEGER, result TEXT)"
+        )
+
+    def get_repo_checksum(self, path):
+        """Return a checksum identifying metadata of the repo at given path
+        or URL.
+        """
+        with self._lock:
+            if path in self._repo_checksums:
+                return self._repo_checksums[path]
+        with as_local_file(os.path.join(path, "repodata/repomd.xml")) as url_:
+            repomd = cr.Repomd(url_)
+        checksums = sorted(
+            (rec.type, rec.checksum_open or rec.checksum)
+            for rec in repomd.records
+            if rec.type in SOLVER_METADATA
+        )
+        checksum = hashlib.sha256(json.dumps(checksums).encode("utf-8")).hexdigest()
+        with self._lock:
+            self._repo_checksums[path] = checksum
+        return checksum
+
+    def get_key(self, solver, arch, repos, lookasides, **inputs):
+        """Create a key for a solver run. The order of repos and lookasides
+        matters, inputs are compared after sorting.
+        """
+        data = {
+            "solver": solver,
+            "arch": arch,
+            "repos": [self.get_repo_checksum(repo) for repo in repos],
+            "lookasides": [self.get_repo_checksum(repo) for repo in lookasides],
+        }
+        for name, value in inputs.items():
+            if isinstance(value, (list, set, tuple)):
+                value = sorted(value)
+            data[name] = value
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """Return cached result as a tuple (packages, modules) in the format
+        of fus.parse_output, or None if there is nothing cached.
+        """
+        row = self._db.execute(
+            "SELECT version, result FROM results WHERE key = ?", (key,)
+        )
+        with self._lock:
+            if row is None or row[0] != self.VERSION:
+                self.misses += 1
+                return None
+            self.hits += 1
+        packages, modules = json.loads(row[1])
+        return (
+            set((nvr, arch, frozenset(flags)) for nvr, arch, flags in packages),
+            set(modules),
+        )
+
+    def put(self, key, packages, modules):
+        result = json.dumps(
+            [
+                sorted((nvr, arch, sorted(flags)) for nvr, arch, flags in packages),
+                sorted(modules),
+            ]
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+            (key, self.VERSION, result),
+        )
+
+
+# Path to database -> SolverCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_solver_cache(compose):
+    """Open the persistent solver cache if it's configured. The cache is
+    shared by all variants and arches in the compose.
+    """
+    path = compose.conf.get("gather_hybrid_solver_cache")
+    if not path:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = SolverCache(path)
+        return _caches[path]
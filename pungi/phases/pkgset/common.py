@@ -14,38 +14,43 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import functools
 import os
+import sys
 import threading
 
 from kobo.shortcuts import run
-from kobo.threads import run_in_threads
 
 from pungi.arch import get_valid_arches
 from pungi.wrappers.createrepo import CreaterepoWrapper
 from pungi.util import (
     copy_all,
     is_arch_multilib,
-    PartialFuncWorkerThread,
-    PartialFuncThreadPool,
 )
 from pungi.module_util import Modulemd, collect_module_defaults
 from pungi.phases.createrepo import add_modular_metadata
+from pungi.phases.pkgset.header_cache import HeaderCache
+from pungi.scheduler import BudgetScheduler, Scheduler
 
 
-def populate_arch_pkgsets(compose, path_prefix, global_pkgset):
-    result = {}
+# Rough estimates of resources needed by createrepo for a package set, used to
+# decide how many package sets can be processed at the same time.
+CREATEREPO_BASE_MEMORY = 100  # MiB
+CREATEREPO_MEMORY_PER_PACKAGE = 0.1  # MiB, for global repo and all arch repos
+CREATEREPO_BYTES_PER_CPU = 2 * 1024**3
+
+
+def populate_arch_pkgsets(compose, global_pkgset):
+    """Create package sets for all tree arches. The file lists are not
+    written here.
+    """
     exclusive_noarch = compose.conf["pkgset_exclusive_arch_considers_noarch"]
+    arch_lists = {}
     for arch in compose.get_arches():
         compose.log_info("Populating package set for arch: %s", arch)
         is_multilib = is_arch_multilib(compose.conf, arch)
-        arches = get_valid_arches(arch, is_multilib, add_src=True)
-        pkgset = global_pkgset.subset(arch, arches, exclusive_noarch=exclusive_noarch)
-        pkgset.save_file_list(
-            compose.paths.work.package_list(arch=arch, pkgset=global_pkgset),
-            remove_path_prefix=path_prefix,
-        )
-        result[arch] = pkgset
-    return result
+        arch_lists[arch] = get_valid_arches(arch, is_multilib, add_src=True)
+    return global_pkgset.subsets(arch_lists, exclusive_noarch=exclusive_noarch)
 
 
 def get_create_global_repo_cmd(compose, path_prefix, repo_dir_global, pkgset):
@@ -89,27 +94,11 @@ def run_create_global_repo(compose, cmd, logfile):
     compose.log_info("[DONE ] %s", msg)
 
 
-def create_arch_repos(compose, path_prefix, paths, pkgset, mmds):
-    run_in_threads(
-        _create_arch_repo,
-        [
-            (
-                compose,
-                arch,
-                path_prefix,
-                paths,
-                pkgset,
-                mmds.get(arch) if mmds else None,
-            )
-            for arch in compose.get_arches()
-        ],
-        threads=compose.conf["createrepo_num_threads"],
-    )
-
-
-def _create_arch_repo(worker_thread, args, task_num):
-    """Create a single pkgset repo for given arch."""
-    compose, arch, path_prefix, paths, pkgset, mmd = args
+def create_arch_repo(compose, arch, path_prefix, paths, pkgset, mmd):
+    """Create a single pkgset repo for given arch. The package list for the
+    arch must already exist, and unless an old repo is reused, so must the
+    global repo, as it is used as --update-md-path.
+    """
     repo_dir = compose.paths.work.pkgset_repo(pkgset.name, arch=arch)
     paths[arch] = repo_dir
 
@@ -171,6 +160,92 @@ def _create_arch_repo(worker_thread, args, task_num):
     compose.log_info("[DONE ] %s", msg)
 
 
+def format_nevra(**kwargs):
+    """NEVRA with epoch only when it is not zero. This is the format used in
+    depsolver results.
+    """
+    if kwargs.get("epoch") not in (None, "", 0, "0"):
+        return "%(name)s-%(epoch)s:%(version)s-%(release)s.%(arch)s" % kwargs
+    return "%(name)s-%(version)s-%(release)s.%(arch)s" % kwargs
+
+
+def get_package_nevra(pkg):
+    return format_nevra(
+        name=pkg.name,
+        epoch=pkg.epoch,
+        version=pkg.version,
+        release=pkg.release,
+        arch=pkg.arch,
+    )
+
+
+# Functions creating keys for each kind of package index, and whether the key
+# is unique. Indexes with unique keys map the key to a single package, others
+# map it to a list of packages.
+PACKAGE_INDEXES = {
+    "path": (lambda pkg: pkg.file_path, True),
+    "nevra": (get_package_nevra, True),
+    "name": (lambda pkg: pkg.name, False),
+    "name_arch": (lambda pkg: (pkg.name, pkg.arch), False),
+    "sourcerpm": (lambda pkg: pkg.sourcerpm, False),
+}
+
+
+def build_package_index(packages, kind):
+    """Create a dict mapping key of given kind to packages."""
+    get_key, unique = PACKAGE_INDEXES[kind]
+    index = {}
+    if unique:
+        for pkg in packages:
+            index[get_key(pkg)] = pkg
+    else:
+        for pkg in packages:
+            index.setdefault(get_key(pkg), []).append(pkg)
+    return index
+
+
+def get_index_size(index):
+    """Approximate memory used by the index in bytes, not counting the
+    packages themselves.
+    """
+    size = sys.getsizeof(index)
+    for key, value in index.items():
+        size += sys.getsizeof(key)
+        if isinstance(value, list):
+            size += sys.getsizeof(value)
+    return size
+
+
+def get_package_index(package_set, arch, kind, cache=True):
+    """Return index of packages for given arch. For MaterializedPackageSet
+    the index is cached and shared by all callers (see get_index), for other
+    mappings from arch to package set a new one is created.
+    """
+    if isinstance(package_set, MaterializedPackageSet):
+        return package_set.get_index(arch, kind, cache=cache)
+    pkgset = package_set[arch]
+    return build_package_index((pkgset[path] for path in pkgset), kind)
+
+
+def get_merged_index(package_sets, arch, kind):
+    """Return index of given kind with packages for given arch from all
+    package sets. The result must not be modified, it can be the index shared
+    by all users of the package set.
+    """
+    indexes = [get_package_index(pkgset, arch, kind) for pkgset in package_sets]
+    if len(indexes) == 1:
+        return indexes[0]
+    result = {}
+    if PACKAGE_INDEXES[kind][1]:
+        for index in indexes:
+            result.update(index)
+    else:
+        for index in indexes:
+            for key, packages in index.items():
+                result.setdefault(key, []).extend(packages)
+    return result
+
+
 class MaterializedPackageSet(object):
     """A wrapper for PkgsetBase object that represents the package set created
     as repos on the filesystem.
@@ -179,6 +254,69 @@ class MaterializedPackageSet(object):
     def __init__(self, package_sets, paths):
         self.package_sets = package_sets
         self.paths = paths
+        # (arch, kind) -> index created by get_index
+        self._indexes = {}
+        # (arch, kind) -> approximate size of the index in bytes
+        self.index_sizes = {}
+        self._indexes_lock = threading.Lock()
+        # (arch, kind) -> lock held while the index is being built
+        self._build_locks = {}
+
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        result["_indexes"] = {}
+        result["index_sizes"] = {}
+        del result["_indexes_lock"]
+        del result["_build_locks"]
+        return result
+
+    def __setstate__(self, data):
+        self.__dict__.update(data)
+        self._indexes_lock = threading.Lock()
+        self._build_locks = {}
+
+    def get_index(self, arch, kind, cache=True):
+        """Return a dict with packages for given arch indexed by given kind of
+        key (see PACKAGE_INDEXES). The index is created on first use and
+        shared by all callers until free_indexes is called. Different indexes
+        can be built at the same time.
+
+        With ``cache=False`` an index that is not cached yet is built only for
+        the caller and not kept.
+        """
+        key = (arch, kind)
+        with self._indexes_lock:
+            if key in self._indexes:
+                return self._indexes[key]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        if not cache:
+            return build_package_index(self._iter_arch_packages(arch), kind)
+        with build_lock:
+            with self._indexes_lock:
+                if key in self._indexes:
+                    # Built by another thread while waiting for the lock.
+                    return self._indexes[key]
+            index = build_package_index(self._iter_arch_packages(arch), kind)
+            size = get_index_size(index)
+            with self._indexes_lock:
+                self._indexes[key] = index
+                self.index_sizes[key] = size
+            return index
+
+    def _iter_arch_packages(self, arch):
+        for packages in self.package_sets[arch].rpms_by_arch.values():
+            for pkg in packages:
+                yield pkg
+
+    def free_indexes(self):
+        """Drop all cached indexes. Return approximate number of bytes they
+        used.
+        """
+        with self._indexes_lock:
+            size = sum(self.index_sizes.values())
+            self._indexes = {}
+            self.index_sizes = {}
+            return size
 
     @property
     def name(self):
@@ -212,14 +350,32 @@ class MaterializedPackageSet(object):
         )
         paths = {"global": repo_dir_global}
 
-        pkgset_global.save_file_list(
-            compose.paths.work.package_list(arch="global", pkgset=pkgset_global),
-            remove_path_prefix=path_prefix,
+        package_sets = {}
+        # Stages of the creation and dependencies between them:
+        #
+        #   global-file-list --> global-repo -----------------+
+        #                                                     v
+        #   subsets --> file-list-<arch> -------------> repo-<arch>
+        #
+        # Arch repos use the global repodata as --update-md-path, so they can
+        # not start before it exists. Everything else runs in parallel.
+        scheduler = Scheduler()
+        scheduler.add(
+            "global-file-list",
+            functools.partial(
+                pkgset_global.save_file_list,
+                compose.paths.work.package_list(arch="global", pkgset=pkgset_global),
+                remove_path_prefix=path_prefix,
+            ),
         )
-        pkgset_global.save_file_cache(
-            compose.paths.work.pkgset_file_cache(pkgset_global.name)
+        scheduler.add(
+            "file-cache",
+            functools.partial(
+                pkgset_global.save_file_cache,
+                compose.paths.work.pkgset_file_cache(pkgset_global.name),
+            ),
         )
-
+        repo_deps = []
         if getattr(pkgset_global, "reuse", None) is None:
             cmd = get_create_global_repo_cmd(
                 compose, path_prefix, repo_dir_global, pkgset_global
@@ -227,59 +383,111 @@ class MaterializedPackageSet(object):
             logfile = compose.paths.log.log_file(
                 "global", "arch_repo.%s" % pkgset_global.name
             )
-            t = threading.Thread(
-                target=run_create_global_repo, args=(compose, cmd, logfile)
+            scheduler.add(
+                "global-repo",
+                functools.partial(run_create_global_repo, compose, cmd, logfile),
+                deps=["global-file-list"],
             )
-            t.start()
+            repo_deps.append("global-repo")
 
-        package_sets = populate_arch_pkgsets(compose, path_prefix, pkgset_global)
-        package_sets["global"] = pkgset_global
+        def _populate():
+            package_sets.update(populate_arch_pkgsets(compose, pkgset_global))
 
-        if getattr(pkgset_global, "reuse", None) is None:
-            t.join()
+        def _save_file_list(arch):
+            compose.log_info("Saving package list for arch: %s", arch)
+            package_sets[arch].save_file_list(
+                compose.paths.work.package_list(arch=arch, pkgset=pkgset_global),
+                remove_path_prefix=path_prefix,
+            )
+
+        scheduler.add("subsets", _populate)
+        for arch in compose.get_arches():
+            scheduler.add(
+                "file-list-%s" % arch,
+                functools.partial(_save_file_list, arch),
+                deps=["subsets"],
+            )
+            scheduler.add(
+                "repo-%s" % arch,
+                functools.partial(
+                    create_arch_repo,
+                    compose,
+                    arch,
+                    path_prefix,
+                    paths,
+                    pkgset_global,
+                    mmd.get(arch) if mmd else None,
+                ),
+                deps=["file-list-%s" % arch] + repo_deps,
+            )
 
-        create_arch_repos(compose, path_prefix, paths, pkgset_global, mmd)
+        # One extra thread so that the global repo does not take a slot of
+        # the arch repos.
+        scheduler.run(threads=compose.conf["createrepo_num_threads"] + 1)
+        for line in scheduler.get_report():
+            compose.log_info("Package set %s: %s", pkgset_global.name, line)
 
+        package_sets["global"] = pkgset_global
         return klass(package_sets, paths)
 
     @classmethod
     def create_many(klass, create_partials):
         """
-        Creates multiple MaterializedPackageSet in threads.
+        Creates multiple MaterializedPackageSet in threads. Package sets are
+        started from the biggest one, as long as the estimated resources needed
+        by all running ones fit into the configured CPU and memory budget.
 
         :param list of functools.partial create_partials: List of Partial objects
             created using functools.partial(MaterializedPackageSet.create, compose,
             pkgset_global, path_prefix, mmd=mmd).
         :return: List of MaterializedPackageSet objects.
         """
-        # Create two pools - small pool for small package sets and big pool for
-        # big package sets. This ensure there will not be too many createrepo
-        # tasks which would need lot of CPU or memory at the same time.
-        big_pool = PartialFuncThreadPool()
-        big_pool.add(PartialFuncWorkerThread(big_pool))
-        small_pool = PartialFuncThreadPool()
-        for i in range(10):
-            small_pool.add(PartialFuncWorkerThread(small_pool))
-
-        # Divide the package sets into big_pool/small_pool based on their size.
+        if not create_partials:
+            return []
+        compose = create_partials[0].args[0]
+        cpu_budget = compose.conf["createrepo_cpu_budget"]
+        memory_budget = compose.conf["createrepo_memory_budget"]
+        compose.log_info(
+            "Creating %d package sets with budget of %d CPUs and %d MiB",
+            len(create_partials),
+            cpu_budget,
+            memory_budget,
+        )
+        scheduler = BudgetScheduler(cpu_budget, memory_budget, log=compose.log_info)
         for partial in create_partials:
             pkgset = partial.args[1]
-            if len(pkgset) < 500:
-                small_pool.queue_put(partial)
-            else:
-                big_pool.queue_put(partial)
-
-        small_pool.start()
-        big_pool.start()
-        try:
-            small_pool.stop()
-        except Exception:
-            big_pool.kill()
-            raise
-        finally:
-            big_pool.stop()
-
-        return small_pool.results + big_pool.results
+            cpus, memory = estimate_createrepo_cost(compose, pkgset)
+            scheduler.add(
+                pkgset.name,
+                partial,
+                min(cpus, cpu_budget),
+                min(memory, memory_budget),
+            )
+        return scheduler.run()
+
+
+def estimate_createrepo_cost(compose, pkgset):
+    """Estimate resources needed to create repos for a package set. Memory is
+    driven by the amount of metadata, i.e. the number of packages, while CPU
+    time mostly goes to checksumming the files.
+
+    :returns: tuple with number of CPUs and memory in MiB
+    """
+    size = sum(pkgset[path].size for path in pkgset)
+    cpus = max(1, -(-size // CREATEREPO_BYTES_PER_CPU))
+    # There is no point in reserving CPUs createrepo will not use.
+    max_cpus = compose.conf["createrepo_num_workers"] * (len(compose.get_arches()) + 1)
+    memory = CREATEREPO_BASE_MEMORY + len(pkgset) * CREATEREPO_MEMORY_PER_PACKAGE
+    return min(cpus, max_cpus), int(memory)
+
+
+def get_header_cache(compose):
+    """Open the persistent RPM header cache if it's configured."""
+    path = compose.conf.get("pkgset_header_cache")
+    if not path:
+        return None
+    compose.log_info("Using RPM header cache: %s", path)
+    return HeaderCache(path)
 
 
 def get_all_arches(compose):
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Persistent cache of RPM header data shared across composes.
+
+The data is stored in an SQLite database keyed by path to the RPM. A record is
+only used if size and modification time of the file still match, so a package
+that was re-signed in place is read again.
+"""
+
+import json
+import sqlite3
+import threading
+
+from pungi.phases.pkgset.store import get_fields
+
+
+class HeaderCache(object):
+    # Bump this when the set of stored fields changes. Records with different
+    # version are ignored and eventually overwritten.
+    VERSION = 1
+    # How many new records to keep in memory before writing them to disk.
+    FLUSH_SIZE = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        # The connection is shared by reader threads, access is serialized by
+        # the lock. The timeout allows concurrent composes to use the cache.
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                "version INTEGER, fields TEXT)"
+            )
+
+    def get(self, path, stat):
+        """Return dict with header fields of RPM at given path, or None if it's
+        not cached or the file has changed since.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, version, fields FROM headers WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if (
+                row is None
+                or row[0] != stat.st_size
+                or row[1] != stat.st_mtime
+                or row[2] != self.VERSION
+            ):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[3])
+
+    def put(self, pkg):
+        """Store header data of a package object (PackageRecord or
+        ExtendedRpmWrapper). The data is written to disk in batches.
+        """
+        record = (
+            pkg.file_path,
+            pkg.stat.st_size,
+            pkg.stat.st_mtime,
+            self.VERSION,
+            json.dumps(get_fields(pkg)),
+        )
+        with self._lock:
+            self._pending.append(record)
+            if len(self._pending) >= self.FLUSH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def flush(self):
+        """Write all pending records to disk."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Binary file format for saving package set data for reuse in later composes.
+
+Layout of the file:
+
+    header      magic, format version, offsets and lengths of the other parts
+    metadata    pickled dict with arbitrary small data (optional)
+    records     one JSON encoded list per package
+    index       JSON encoded list of (path, name, arch, offset, length)
+
+Records are written one by one, so the whole package set never needs to be
+serialized in memory. When reading, only the header and the index are loaded
+and the file is memory-mapped. A record is decoded when the package is first
+accessed. The header is checked before anything else, so a file written by an
+incompatible version is rejected immediately.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from six.moves import cPickle as pickle
+
+from pungi.phases.pkgset.store import (
+    DEP_FIELDS,
+    LIST_FIELDS,
+    SCALAR_FIELDS,
+    PackageStat,
+    PackageStore,
+    get_fields,
+)
+
+
+MAGIC = b"PUNGIPKG"
+# Bump this when layout of the file or of the records changes.
+VERSION = 1
+# magic, version, metadata offset, metadata length, index offset, index length
+HEADER = struct.Struct("<8sIQQQQ")
+
+RECORD_FIELDS = (
+    SCALAR_FIELDS + LIST_FIELDS + DEP_FIELDS + ("is_source", "is_system_release")
+)
+
+
+class PackageFileError(ValueError):
+    """The file is not a package file or has unsupported version."""
+
+
+def write_package_file(file_path, packages, metadata=None):
+    """Write packages to a file in the format readable by PackageFile.
+
+    :param str file_path: path to the file to write
+    :param packages: iterable of package objects (PackageRecord or
+        ExtendedRpmWrapper)
+    :param dict metadata: optional extra data stored in the file
+    """
+    index = []
+    with open(file_path, "wb") as f:
+        # Write a placeholder header, the real one is written at the end when
+        # the offsets are known.
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0))
+
+        meta_offset = f.tell()
+        if metadata is not None:
+            f.write(pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL))
+        meta_length = f.tell() - meta_offset
+
+        for pkg in packages:
+            fields = get_fields(pkg)
+            stat = pkg.stat
+            record = [
+                pkg.file_path,
+                stat.st_dev,
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime,
+            ] + [fields[field] for field in RECORD_FIELDS]
+            data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            index.append((pkg.file_path, pkg.name, pkg.arch, f.tell(), len(data)))
+            f.write(data)
+
+        index_offset = f.tell()
+        f.write(json.dumps(index, separators=(",", ":")).encode("utf-8"))
+        index_length = f.tell() - index_offset
+
+        f.seek(0)
+        f.write(
+            HEADER.pack(
+                MAGIC, VERSION, meta_offset, meta_length, index_offset, index_length
+            )
+        )
+
+
+class PackageFile(object):
+    """Read-only view of a file written by write_package_file.
+
+    The object can be used in place of ``kobo.pkgset.FileCache``: it maps
+    absolute paths to package objects. The packages are PackageRecord objects
+    in a store private to this file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._open()
+
+    def _open(self):
+        self._lock = threading.Lock()
+        with open(self.file_path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size or header[: len(MAGIC)] != MAGIC:
+                raise PackageFileError("%s is not a package file" % self.file_path)
+            (
+                magic,
+                version,
+                meta_offset,
+                meta_length,
+                index_offset,
+                index_length,
+            ) = HEADER.unpack(header)
+            if version != VERSION:
+                raise PackageFileError(
+                    "%s has unsupported version %d (expected %d)"
+                    % (self.file_path, version, VERSION)
+                )
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.metadata = None
+        if meta_length:
+            self.metadata = pickle.loads(
+                self._map[meta_offset : meta_offset + meta_length]
+            )
+
+        index = json.loads(
+            self._map[index_offset : index_offset + index_length].decode("utf-8")
+        )
+        # path -> (offset, length) of the record
+        self._by_path = {}
+        # (name, arch) -> list of paths
+        self._by_name_arch = {}
+        self._order = []
+        for path, name, arch, offset, length in index:
+            self._by_path[path] = (offset, length)
+            self._by_name_arch.setdefault((name, arch), []).append(path)
+            self._order.append(path)
+
+        self._store = PackageStore()
+        # Already decoded records, so that each package is decoded only once
+        # and repeated lookups return the same object.
+        self._records = {}
+
+    def __getstate__(self):
+        return {"file_path": self.file_path}
+
+    def __setstate__(self, data):
+        self.__dict__.update(data)
+        self._open()
+
+    def close(self):
+        self._map.close()
+
+    def _decode(self, path):
+        offset, length = self._by_path[path]
+        record = json.loads(self._map[offset : offset + length].decode("utf-8"))
+        file_path, stat, values = record[0], PackageStat(*record[1:5]), record[5:]
+        return self._store.add(file_path, stat, dict(zip(RECORD_FIELDS, values)))
+
+    def __getitem__(self, name):
+        path = os.path.abspath(name)
+        try:
+            return self._records[path]
+        except KeyError:
+            pass
+        with self._lock:
+            if path not in self._records:
+                self._records[path] = self._decode(path)
+            return self._records[path]
+
+    def __contains__(self, item):
+        return item in self._by_path
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._order)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def iteritems(self):
+        for path in self._order:
+            yield path, self[path]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def get_by_name_arch(self, name, arch):
+        """Return list of packages with given name and arch."""
+        return [self[path] for path in self._by_name_arch.get((name, arch), [])]
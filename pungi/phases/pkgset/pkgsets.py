@@ -21,9 +21,10 @@ It automatically finds a signed copies according to *sigkey_ordering*.
 
 import itertools
 import json
+import multiprocessing
+import multiprocessing.pool
 import os
 import time
-from six.moves import cPickle as pickle
 
 import kobo.log
 import kobo.pkgset
@@ -34,6 +35,13 @@ from kobo.threads import WorkerThread, ThreadPool
 from pungi.util import pkg_is_srpm, copy_all
 from pungi.arch import get_valid_arches, is_excluded
 from pungi.errors import UnsignedPackagesError
+from pungi.phases.pkgset.package_file import PackageFile, write_package_file
+from pungi.phases.pkgset.store import PackageRecord, PackageStat, PackageStore
+
+# Maximum number of RPMs whose headers are read by a worker process at once.
+READER_BATCH_SIZE = 200
+# Number of threads listing directories with signed RPMs.
+PATH_RESOLVER_THREADS = 10
 
 
 class ExtendedRpmWrapper(kobo.pkgset.SimpleRpmWrapper):
@@ -49,10 +57,82 @@ class ExtendedRpmWrapper(kobo.pkgset.SimpleRpmWrapper):
         self.provides = set(kobo.rpmlib.get_header_field(header, "provides"))
 
 
+def read_rpm_header_fields(file_path, ts=None):
+    """
+    Read RPM header and return a dict with the fields stored in PackageStore.
+    The header is read only once.
+    """
+    header = kobo.rpmlib.get_rpm_header(file_path, ts=ts)
+    signature = kobo.rpmlib.get_keys_from_header(header)
+    return {
+        "name": kobo.rpmlib.get_header_field(header, "name"),
+        "version": kobo.rpmlib.get_header_field(header, "version"),
+        "release": kobo.rpmlib.get_header_field(header, "release"),
+        "epoch": kobo.rpmlib.get_header_field(header, "epoch"),
+        "arch": kobo.rpmlib.get_header_field(header, "arch"),
+        "sourcerpm": kobo.rpmlib.get_header_field(header, "sourcerpm"),
+        "signature": signature.upper() if signature is not None else None,
+        "checksum_type": kobo.rpmlib.get_digest_algo_from_header(header).lower(),
+        "excludearch": kobo.rpmlib.get_header_field(header, "excludearch"),
+        "exclusivearch": kobo.rpmlib.get_header_field(header, "exclusivearch"),
+        "requires": kobo.rpmlib.get_header_field(header, "requires"),
+        "provides": kobo.rpmlib.get_header_field(header, "provides"),
+        "is_source": bool(kobo.rpmlib.get_header_field(header, "sourcepackage")),
+        "is_system_release": "system-release"
+        in kobo.rpmlib.get_header_field(header, "providename"),
+    }
+
+
+class PathResolver(object):
+    """Checks existence of RPM files using cached directory listings.
+
+    Each directory is listed only once, so checking all candidate paths of all
+    packages does not need a stat call for each of them. Paths in directories
+    that were not listed are checked on the filesystem.
+    """
+
+    def __init__(self):
+        self.listings = {}
+        # Number of checks answered from the listings.
+        self.lookups = 0
+
+    def _list_dir(self, path):
+        try:
+            return path, frozenset(os.listdir(path))
+        except OSError:
+            # Missing directory means none of the files exist.
+            return path, frozenset()
+
+    def scan(self, dirs, threads=PATH_RESOLVER_THREADS):
+        """List given directories in parallel. Already listed directories are
+        listed again.
+        """
+        if not dirs:
+            return
+        pool = multiprocessing.pool.ThreadPool(threads)
+        try:
+            self.listings.update(pool.imap_unordered(self._list_dir, dirs))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def is_listed(self, path):
+        dirname, basename = os.path.split(path)
+        return basename in self.listings.get(dirname, ())
+
+    def isfile(self, path):
+        if os.path.dirname(path) not in self.listings:
+            return os.path.isfile(path)
+        self.lookups += 1
+        return self.is_listed(path)
+
+
 class ReaderPool(ThreadPool):
     def __init__(self, package_set, logger=None):
         ThreadPool.__init__(self, logger)
         self.package_set = package_set
+        # Paths of RPMs whose headers should be read in worker processes.
+        self.unread_paths = []
 
 
 class ReaderThread(WorkerThread):
@@ -61,13 +141,14 @@ class ReaderThread(WorkerThread):
 
         if (num % 100 == 0) or (num == self.pool.queue_total):
             self.pool.package_set.log_debug(
-                "Processed %s out of %s packages" % (num, self.pool.queue_total)
+                "Processed %s out of %s packages", num, self.pool.queue_total
             )
 
         rpm_path = self.pool.package_set.get_package_path(item)
         if rpm_path is None:
             return
 
+        rpm_obj = None
         # In case we have old file cache data, try to reuse it.
         if self.pool.package_set.old_file_cache:
             # Try to find the RPM in old_file_cache and reuse it instead of
@@ -79,24 +160,39 @@ class ReaderThread(WorkerThread):
 
             # Also reload rpm_obj if it's not ExtendedRpmWrapper object
             # to get the requires/provides data into the cache.
-            if rpm_obj and isinstance(rpm_obj, ExtendedRpmWrapper):
+            if rpm_obj and isinstance(rpm_obj, (ExtendedRpmWrapper, PackageRecord)):
+                if self.pool.package_set.store is not None:
+                    # Copy the data into our own store so that the old cache
+                    # can be freed.
+                    rpm_obj = self.pool.package_set.store.copy(rpm_obj)
                 self.pool.package_set.file_cache[rpm_path] = rpm_obj
             else:
-                rpm_obj = self.pool.package_set.file_cache.add(rpm_path)
-        else:
+                rpm_obj = None
+
+        if rpm_obj is None and self.pool.package_set.header_cache is not None:
+            rpm_obj = self.pool.package_set.get_from_header_cache(rpm_path)
+
+        if rpm_obj is None:
+            if self.pool.package_set.reader_processes:
+                # The header will be read later in a worker process.
+                self.pool.unread_paths.append(rpm_path)
+                return
             rpm_obj = self.pool.package_set.file_cache.add(rpm_path)
-        self.pool.package_set.rpms_by_arch.setdefault(rpm_obj.arch, []).append(rpm_obj)
+            if self.pool.package_set.header_cache is not None:
+                self.pool.package_set.header_cache.put(rpm_obj)
+        self.pool.package_set.add_to_arch_lists(rpm_obj)
 
-        if pkg_is_srpm(rpm_obj):
-            self.pool.package_set.srpms_by_name[rpm_obj.file_name] = rpm_obj
-        elif rpm_obj.arch == "noarch":
-            srpm = self.pool.package_set.srpms_by_name.get(rpm_obj.sourcerpm, None)
-            if srpm:
-                # HACK: copy {EXCLUDE,EXCLUSIVE}ARCH from SRPM to noarch RPMs
-                rpm_obj.excludearch = srpm.excludearch
-                rpm_obj.exclusivearch = srpm.exclusivearch
-            else:
-                self.pool.log_warning("Can't find a SRPM for %s" % rpm_obj.file_name)
+
+def _read_rpm_headers(paths):
+    """Read headers of given RPMs. This runs in a worker process, so only
+    plain data is returned to the parent.
+    """
+    result = []
+    for path in paths:
+        st = os.stat(path)
+        stat = PackageStat(st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        result.append((path, stat, read_rpm_header_fields(path)))
+    return result
 
 
 class PackageSetBase(kobo.log.LoggingBase):
@@ -107,10 +203,31 @@ class PackageSetBase(kobo.log.LoggingBase):
         arches=None,
         logger=None,
         allow_invalid_sigkeys=False,
+        compact_store=False,
+        reader_processes=0,
+        header_cache=None,
+        detail_log=None,
     ):
         super(PackageSetBase, self).__init__(logger=logger)
         self.name = name
-        self.file_cache = kobo.pkgset.FileCache(ExtendedRpmWrapper)
+        # DetailLog to record skipped and excluded packages in instead of
+        # logging each of them.
+        self.detail_log = detail_log
+        # Number of worker processes reading RPM headers. If not set, headers
+        # are read in threads.
+        self.reader_processes = reader_processes
+        # Persistent HeaderCache shared across composes.
+        self.header_cache = header_cache
+        # With compact store the header data is kept in columnar PackageStore
+        # and the file cache contains only lightweight views into it. Worker
+        # processes and the header cache return plain records, so they always
+        # use the store.
+        self.store = None
+        if compact_store or reader_processes or header_cache is not None:
+            self.store = PackageStore(read_rpm_header_fields)
+        self.file_cache = kobo.pkgset.FileCache(
+            ExtendedRpmWrapper if self.store is None else self.store
+        )
         self.old_file_cache = None
         self.sigkey_ordering = tuple(sigkey_ordering or [None])
         self.arches = arches
@@ -137,6 +254,8 @@ class PackageSetBase(kobo.log.LoggingBase):
     def __getstate__(self):
         result = self.__dict__.copy()
         del result["_logger"]
+        result["header_cache"] = None
+        result["detail_log"] = None
         return result
 
     def __setstate__(self, data):
@@ -171,6 +290,61 @@ class PackageSetBase(kobo.log.LoggingBase):
             "\n".join(get_error(k, v) for k, v in rpminfos.items())
         )
 
+    def add_to_arch_lists(self, rpm_obj):
+        """Add a package already in file cache to per-arch lists."""
+        self.rpms_by_arch.setdefault(rpm_obj.arch, []).append(rpm_obj)
+
+        if pkg_is_srpm(rpm_obj):
+            self.srpms_by_name[rpm_obj.file_name] = rpm_obj
+        elif rpm_obj.arch == "noarch":
+            srpm = self.srpms_by_name.get(rpm_obj.sourcerpm, None)
+            if srpm:
+                # HACK: copy {EXCLUDE,EXCLUSIVE}ARCH from SRPM to noarch RPMs
+                rpm_obj.excludearch = srpm.excludearch
+                rpm_obj.exclusivearch = srpm.exclusivearch
+            else:
+                self.log_warning("Can't find a SRPM for %s" % rpm_obj.file_name)
+
+    def get_from_header_cache(self, rpm_path):
+        """Add package to file cache using data from the persistent header
+        cache. Returns None if the package is not cached.
+        """
+        stat = os.stat(rpm_path)
+        fields = self.header_cache.get(rpm_path, stat)
+        if fields is None:
+            return None
+        rpm_obj = self.store.add(rpm_path, stat, fields)
+        self.file_cache[rpm_path] = rpm_obj
+        return rpm_obj
+
+    def read_headers_in_processes(self, paths):
+        """Read headers of RPMs in a pool of worker processes and add them to
+        the package set. Paths are split into batches so that each worker
+        processes several packages per round trip.
+        """
+        if not paths:
+            return
+        batch_size = max(
+            1, min(READER_BATCH_SIZE, len(paths) // (self.reader_processes * 4))
+        )
+        batches = [paths[i : i + batch_size] for i in range(0, len(paths), batch_size)]
+        self.log_debug(
+            "Package set: reading %s headers in %s worker processes"
+            % (len(paths), self.reader_processes)
+        )
+        pool = multiprocessing.Pool(self.reader_processes)
+        try:
+            for records in pool.imap_unordered(_read_rpm_headers, batches):
+                for file_path, stat, fields in records:
+                    rpm_obj = self.store.add(file_path, stat, fields)
+                    self.file_cache[file_path] = rpm_obj
+                    if self.header_cache is not None:
+                        self.header_cache.put(rpm_obj)
+                    self.add_to_arch_lists(rpm_obj)
+        finally:
+            pool.terminate()
+            pool.join()
+
     def read_packages(self, rpms, srpms):
         srpm_pool = ReaderPool(self, self._logger)
         rpm_pool = ReaderPool(self, self._logger)
@@ -191,13 +365,30 @@ class PackageSetBase(kobo.log.LoggingBase):
         self.log_debug("Package set: spawning %s worker threads (SRPMs)" % thread_count)
         srpm_pool.start()
         srpm_pool.stop()
+        if self.reader_processes:
+            self.read_headers_in_processes(srpm_pool.unread_paths)
         self.log_debug("Package set: worker threads stopped (SRPMs)")
 
         self.log_debug("Package set: spawning %s worker threads (RPMs)" % thread_count)
         rpm_pool.start()
         rpm_pool.stop()
+        if self.reader_processes:
+            self.read_headers_in_processes(rpm_pool.unread_paths)
         self.log_debug("Package set: worker threads stopped (RPMs)")
 
+        if self.store is not None:
+            self.log_debug(
+                "Package set: %s packages in compact store using %s bytes"
+                % (len(self.store), self.store.memory_usage())
+            )
+
+        if self.header_cache is not None:
+            self.header_cache.flush()
+            self.log_debug(
+                "Package set: header cache %s hits, %s misses"
+                % (self.header_cache.hits, self.header_cache.misses)
+            )
+
         if not self._allow_invalid_sigkeys and self._invalid_sigkey_rpms:
             self.raise_invalid_sigkeys_exception(self._invalid_sigkey_rpms)
 
@@ -206,11 +397,148 @@ class PackageSetBase(kobo.log.LoggingBase):
     def subset(self, primary_arch, arch_list, exclusive_noarch=True):
         """Create a subset of this package set that only includes
         packages compatible with"""
-        pkgset = PackageSetBase(
-            self.name, self.sigkey_ordering, logger=self._logger, arches=arch_list
+        return self.subsets(
+            {primary_arch: arch_list}, exclusive_noarch=exclusive_noarch
+        )[primary_arch]
+
+    def subsets(self, arch_lists, exclusive_noarch=True):
+        """Create subsets of this package set for multiple tree arches at once.
+
+        The result is the same as calling ``subset`` for each tree arch, but
+        all packages are processed in a single pass: for each package a bit
+        mask of subsets it belongs to is computed, and source names and
+        ExcludeArch/ExclusiveArch checks are computed only once.
+
+        :param dict arch_lists: mapping of primary arch to list of arches that
+            should be included in the subset for it
+        :return: dict mapping primary arch to its subset
+        """
+        primary_arches = list(arch_lists)
+        msg = "Creating package subsets for %s" % ", ".join(
+            str(arch) for arch in primary_arches
+        )
+        self.log_debug("[BEGIN] %s" % msg)
+
+        result = {}
+        # package arch -> mask of subsets that should include it
+        arch_masks = {}
+        # Arches to check ExcludeArch/ExclusiveArch of noarch packages against,
+        # one set for each subset.
+        exclusive_sets = []
+        for bit, primary_arch in enumerate(primary_arches):
+            arch_list = arch_lists[primary_arch]
+            _prepare_arch_list(arch_list)
+            pkgset = PackageSetBase(
+                self.name, self.sigkey_ordering, logger=self._logger, arches=arch_list
+            )
+            for arch in arch_list:
+                pkgset.rpms_by_arch.setdefault(arch, [])
+                arch_masks[arch] = arch_masks.get(arch, 0) | 1 << bit
+            result[primary_arch] = pkgset
+            exclusivearch_list = _get_exclusivearch_list(primary_arch, exclusive_noarch)
+            exclusive_sets.append(set(exclusivearch_list or []))
+
+        # make sure sources are processed last
+        source_arches = [arch for arch in ("nosrc", "src") if arch in arch_masks]
+        all_arches = [arch for arch in arch_masks if arch not in source_arches]
+
+        # mask of subsets -> list of the package sets
+        targets_by_mask = {}
+        # (excludearch, exclusivearch) -> mask of subsets excluding the package
+        excluded_by_arches = {}
+        # source package name -> mask of subsets with some binary package
+        seen_sourcerpms = {}
+        # sourcerpm -> source package name
+        source_names = {}
+        excluded_count = 0
+        for arch in all_arches + source_arches:
+            arch_mask = arch_masks[arch]
+            for i in self.rpms_by_arch.get(arch, []):
+                mask = arch_mask
+                if arch == "noarch":
+                    key = (tuple(i.excludearch or ()), tuple(i.exclusivearch or ()))
+                    if key not in excluded_by_arches:
+                        excluded_by_arches[key] = _get_excluded_mask(
+                            key, exclusive_sets
+                        )
+                    excluded = excluded_by_arches[key] & mask
+                    if excluded:
+                        self._log_excluded(i, key, excluded, primary_arches)
+                        excluded_count += 1
+                        mask &= ~excluded
+
+                if arch in ("nosrc", "src"):
+                    # include only sources having binary packages
+                    mask &= seen_sourcerpms.get(i.name, 0)
+                elif mask:
+                    sourcerpm = i.sourcerpm
+                    if sourcerpm not in source_names:
+                        source_names[sourcerpm] = kobo.rpmlib.parse_nvra(sourcerpm)[
+                            "name"
+                        ]
+                    sourcerpm_name = source_names[sourcerpm]
+                    seen_sourcerpms[sourcerpm_name] = (
+                        seen_sourcerpms.get(sourcerpm_name, 0) | mask
+                    )
+
+                if not mask:
+                    continue
+                if mask not in targets_by_mask:
+                    targets_by_mask[mask] = [
+                        result[primary_arches[bit]]
+                        for bit in range(len(primary_arches))
+                        if mask & 1 << bit
+                    ]
+                # The subsets are new, so unlike in merge there can't be any
+                # duplicates.
+                file_path = i.file_path
+                for pkgset in targets_by_mask[mask]:
+                    pkgset.file_cache.file_cache[file_path] = i
+                    pkgset.rpms_by_arch[arch].append(i)
+
+        if self.detail_log is not None:
+            self.detail_log.flush()
+            self.log_info(
+                "%s: excluded %d noarch packages by EXCLUDEARCH/EXCLUSIVEARCH "
+                "from some subsets, details in %s",
+                msg,
+                excluded_count,
+                self.detail_log.path,
+            )
+        self.log_debug("[DONE ] %s" % msg)
+        return result
+
+    def _log_excluded(self, rpm_obj, arches, excluded, primary_arches):
+        """Log exclusion of a noarch package from subsets given by the mask
+        of excluded arches. The logger is called directly, so that the
+        compose can tell these messages apart by the function name.
+        """
+        excludearch = sorted(set(arches[0]))
+        exclusivearch = sorted(set(arches[1]))
+        subsets = [
+            str(primary_arches[bit])
+            for bit in range(len(primary_arches))
+            if excluded & 1 << bit
+        ]
+        if self.detail_log is not None:
+            self.detail_log.record(
+                "exclude",
+                pkgset=self.name,
+                file_name=rpm_obj.file_name,
+                excludearch=excludearch,
+                exclusivearch=exclusivearch,
+                subsets=subsets,
+            )
+            return
+        if not self._logger:
+            return
+        self._logger.debug(
+            "Excluding (EXCLUDEARCH: %s, EXCLUSIVEARCH: %s): %s from %s",
+            excludearch,
+            exclusivearch,
+            rpm_obj.file_name,
+            ", ".join(subsets),
         )
-        pkgset.merge(self, primary_arch, arch_list, exclusive_noarch=exclusive_noarch)
-        return pkgset
 
     def merge(self, other, primary_arch, arch_list, exclusive_noarch=True):
         """
@@ -219,32 +547,10 @@ class PackageSetBase(kobo.log.LoggingBase):
         msg = "Merging package sets for %s: %s" % (primary_arch, arch_list)
         self.log_debug("[BEGIN] %s" % msg)
 
-        # if "src" is present, make sure "nosrc" is included too
-        if "src" in arch_list and "nosrc" not in arch_list:
-            arch_list.append("nosrc")
-
-        # make sure sources are processed last
-        for i in ("nosrc", "src"):
-            if i in arch_list:
-                arch_list.remove(i)
-                arch_list.append(i)
+        _prepare_arch_list(arch_list)
 
         seen_sourcerpms = set()
-        # {Exclude,Exclusive}Arch must match *tree* arch + compatible native
-        # arches (excluding multilib arches)
-        if primary_arch:
-            exclusivearch_list = get_valid_arches(
-                primary_arch, multilib=False, add_noarch=False, add_src=False
-            )
-            # We don't want to consider noarch: if a package is true noarch
-            # build (not just a subpackage), it has to have noarch in
-            # ExclusiveArch otherwise rpm will refuse to build it.
-            # This should eventually become a default, but it could have a big
-            # impact and thus it's hidden behind an option.
-            if not exclusive_noarch and "noarch" in exclusivearch_list:
-                exclusivearch_list.remove("noarch")
-        else:
-            exclusivearch_list = None
+        exclusivearch_list = _get_exclusivearch_list(primary_arch, exclusive_noarch)
         for arch in arch_list:
             self.rpms_by_arch.setdefault(arch, [])
             for i in other.rpms_by_arch.get(arch, []):
@@ -280,10 +586,10 @@ class PackageSetBase(kobo.log.LoggingBase):
     @staticmethod
     def load_old_file_cache(file_path):
         """
-        Loads the cached FileCache stored in pickle format in `file_path`.
+        Loads the cached FileCache stored in `file_path`. The packages are
+        read lazily when accessed.
         """
-        with open(file_path, "rb") as f:
-            return pickle.load(f)
+        return PackageFile(file_path)
 
     def set_old_file_cache(self, old_file_cache):
         """Set cache of old files."""
@@ -291,10 +597,11 @@ class PackageSetBase(kobo.log.LoggingBase):
 
     def save_file_cache(self, file_path):
         """
-        Saves the current FileCache using the pickle module to `file_path`.
+        Saves the current FileCache to `file_path`.
         """
-        with open(file_path, "wb") as f:
-            pickle.dump(self.file_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        write_package_file(
+            file_path, (self.file_cache[path] for path in self.file_cache)
+        )
 
 
 class FilelistPackageSet(PackageSetBase):
@@ -334,6 +641,10 @@ class KojiPackageSet(PackageSetBase):
         extra_tasks=None,
         signed_packages_retries=0,
         signed_packages_wait=30,
+        compact_store=False,
+        reader_processes=0,
+        header_cache=None,
+        detail_log=None,
     ):
         """
         Creates new KojiPackageSet.
@@ -369,6 +680,14 @@ class KojiPackageSet(PackageSetBase):
         :param int signed_packages_retries: How many times should a search for
             signed package be repeated.
         :param int signed_packages_wait: How long to wait between search attemts.
+        :param bool compact_store: When True, RPM header data is stored in
+            a columnar PackageStore instead of one object per RPM.
+        :param int reader_processes: Number of worker processes to read RPM
+            headers in. When 0, headers are read in threads.
+        :param HeaderCache header_cache: Persistent cache of header data to
+            consult before reading any RPM.
+        :param DetailLog detail_log: If set, skipped and excluded packages are
+            recorded in it and only their numbers are logged.
         """
         super(KojiPackageSet, self).__init__(
             name,
@@ -376,6 +695,10 @@ class KojiPackageSet(PackageSetBase):
             arches=arches,
             logger=logger,
             allow_invalid_sigkeys=allow_invalid_sigkeys,
+            compact_store=compact_store,
+            reader_processes=reader_processes,
+            header_cache=header_cache,
+            detail_log=detail_log,
         )
         self.koji_wrapper = koji_wrapper
         # Names of packages to look for in the Koji tag.
@@ -385,13 +708,22 @@ class KojiPackageSet(PackageSetBase):
         self.extra_builds = extra_builds or []
         self.extra_tasks = extra_tasks or []
         self.reuse = None
+        # Reuse data of old compose and set of names of packages changed in
+        # the tag since then. When set, populate only updates these packages.
+        self.incremental_reuse = None
         self.signed_packages_retries = signed_packages_retries
         self.signed_packages_wait = signed_packages_wait
+        # Resolver with listings of directories of the RPMs being read.
+        self.path_resolver = None
 
     def __getstate__(self):
         result = self.__dict__.copy()
         del result["koji_wrapper"]
         del result["_logger"]
+        result["header_cache"] = None
+        result["detail_log"] = None
+        result["incremental_reuse"] = None
+        result["path_resolver"] = None
         if "cache_region" in result:
             del result["cache_region"]
         return result
@@ -411,13 +743,11 @@ class KojiPackageSet(PackageSetBase):
         rpms = []
         builds = []
 
-        builds = self.koji_wrapper.retrying_multicall_map(
-            self.koji_proxy, self.koji_proxy.getBuild, list_of_args=self.extra_builds
+        builds = self.koji_wrapper.chunked_multicall_map(
+            "getBuild", list_of_args=self.extra_builds
         )
-        rpms_in_builds = self.koji_wrapper.retrying_multicall_map(
-            self.koji_proxy,
-            self.koji_proxy.listBuildRPMs,
-            list_of_args=self.extra_builds,
+        rpms_in_builds = self.koji_wrapper.chunked_multicall_map(
+            "listBuildRPMs", list_of_args=self.extra_builds
         )
 
         rpms = []
@@ -441,20 +771,16 @@ class KojiPackageSet(PackageSetBase):
 
         # Get the IDs of children tasks - these are the tasks containing
         # the resulting RPMs.
-        children_tasks = self.koji_wrapper.retrying_multicall_map(
-            self.koji_proxy,
-            self.koji_proxy.getTaskChildren,
-            list_of_args=self.extra_tasks,
+        children_tasks = self.koji_wrapper.chunked_multicall_map(
+            "getTaskChildren", list_of_args=self.extra_tasks
         )
         children_task_ids = []
         for tasks in children_tasks:
             children_task_ids += [t["id"] for t in tasks]
 
         # Get the results of these children tasks.
-        results = self.koji_wrapper.retrying_multicall_map(
-            self.koji_proxy,
-            self.koji_proxy.getTaskResult,
-            list_of_args=children_task_ids,
+        results = self.koji_wrapper.chunked_multicall_map(
+            "getTaskResult", list_of_args=children_task_ids
         )
         rpms = []
         for result in results:
@@ -500,6 +826,75 @@ class KojiPackageSet(PackageSetBase):
 
         return response
 
+    def _get_signed_paths(self, rpm_info, build_info):
+        """Return paths to signed copies of the RPM in order of preference."""
+        pathinfo = self.koji_wrapper.koji_module.pathinfo
+        paths = []
+        for sigkey in self.sigkey_ordering:
+            if not sigkey:
+                # we're looking for *signed* copies here
+                continue
+            rpm_path = os.path.join(
+                pathinfo.build(build_info), pathinfo.signed(rpm_info, sigkey.lower())
+            )
+            if rpm_path not in paths:
+                paths.append(rpm_path)
+        return paths
+
+    def resolve_package_paths(self, queue_items):
+        """List all directories where the given RPMs can be found, so that
+        get_package_path does not need to stat each candidate file.
+
+        If signed copies of some RPMs are missing, wait for them here for all
+        RPMs at once and list only their directories again.
+        """
+        pathinfo = self.koji_wrapper.koji_module.pathinfo
+        use_unsigned = (
+            None in self.sigkey_ordering
+            or "" in self.sigkey_ordering
+            or self._allow_invalid_sigkeys
+        )
+        self.path_resolver = PathResolver()
+        signed_paths = []
+        dirs = set()
+        for rpm_info, build_info in queue_items:
+            if "path_from_task" in rpm_info:
+                continue
+            paths = self._get_signed_paths(rpm_info, build_info)
+            if paths:
+                signed_paths.append(paths)
+            dirs.update(os.path.dirname(path) for path in paths)
+            if use_unsigned:
+                dirs.add(
+                    os.path.dirname(
+                        os.path.join(pathinfo.build(build_info), pathinfo.rpm(rpm_info))
+                    )
+                )
+        self.path_resolver.scan(dirs)
+        listed = len(dirs)
+
+        attempts_left = self.signed_packages_retries
+        while attempts_left > 0:
+            signed_paths = [
+                paths
+                for paths in signed_paths
+                if not any(self.path_resolver.is_listed(path) for path in paths)
+            ]
+            if not signed_paths:
+                break
+            self.log_debug(
+                "Waiting for signed copies of %d packages to appear" % len(signed_paths)
+            )
+            time.sleep(self.signed_packages_wait)
+            attempts_left -= 1
+            dirs = set(
+                os.path.dirname(path) for paths in signed_paths for path in paths
+            )
+            self.path_resolver.scan(dirs)
+            listed += len(dirs)
+
+        return listed
+
     def get_package_path(self, queue_item):
         rpm_info, build_info = queue_item
 
@@ -510,20 +905,19 @@ class KojiPackageSet(PackageSetBase):
 
         pathinfo = self.koji_wrapper.koji_module.pathinfo
         paths = []
+        isfile = os.path.isfile
 
         attempts_left = self.signed_packages_retries + 1
+        if self.path_resolver is not None:
+            # Waiting for signed copies was already done for all packages at
+            # once in resolve_package_paths.
+            isfile = self.path_resolver.isfile
+            attempts_left = 1
         while attempts_left > 0:
-            for sigkey in self.sigkey_ordering:
-                if not sigkey:
-                    # we're looking for *signed* copies here
-                    continue
-                sigkey = sigkey.lower()
-                rpm_path = os.path.join(
-                    pathinfo.build(build_info), pathinfo.signed(rpm_info, sigkey)
-                )
+            for rpm_path in self._get_signed_paths(rpm_info, build_info):
                 if rpm_path not in paths:
                     paths.append(rpm_path)
-                if os.path.isfile(rpm_path):
+                if isfile(rpm_path):
                     return rpm_path
 
             # No signed copy was found, wait a little and try again.
@@ -537,14 +931,14 @@ class KojiPackageSet(PackageSetBase):
             # use an unsigned copy (if allowed)
             rpm_path = os.path.join(pathinfo.build(build_info), pathinfo.rpm(rpm_info))
             paths.append(rpm_path)
-            if os.path.isfile(rpm_path):
+            if isfile(rpm_path):
                 return rpm_path
 
         if self._allow_invalid_sigkeys and rpm_info["name"] not in self.packages:
             # use an unsigned copy (if allowed)
             rpm_path = os.path.join(pathinfo.build(build_info), pathinfo.rpm(rpm_info))
             paths.append(rpm_path)
-            if os.path.isfile(rpm_path):
+            if isfile(rpm_path):
                 self._invalid_sigkey_rpms.append(rpm_info)
                 return rpm_path
 
@@ -563,13 +957,12 @@ class KojiPackageSet(PackageSetBase):
         :param include_packages: an iterable of tuples (package name, arch) that should
                                  be included, all others are skipped.
         """
-        result_rpms = []
-        result_srpms = []
-        include_packages = set(include_packages or [])
-
         if type(event) is dict:
             event = event["id"]
 
+        if self.incremental_reuse:
+            return self.populate_incrementally(tag, event, inherit, include_packages)
+
         msg = "Getting latest RPMs (tag: %s, event: %s, inherit: %s)" % (
             tag,
             event,
@@ -581,6 +974,22 @@ class KojiPackageSet(PackageSetBase):
         rpms += extra_rpms
         builds += extra_builds
 
+        # Get extra RPMs from tasks.
+        rpms += self.get_extra_rpms_from_tasks()
+
+        result = self._read_tagged_rpms(rpms, builds, extra_builds, include_packages)
+
+        self.log_info("[DONE ] %s" % msg)
+        return result
+
+    def _read_tagged_rpms(self, rpms, builds, extra_builds, include_packages):
+        """Filter RPMs returned by Koji and read the selected ones into the
+        package set.
+        """
+        result_rpms = []
+        result_srpms = []
+        include_packages = set(include_packages or [])
+
         extra_builds_by_name = {}
         for build_info in extra_builds:
             extra_builds_by_name[build_info["name"]] = build_info["build_id"]
@@ -597,11 +1006,9 @@ class KojiPackageSet(PackageSetBase):
             else:
                 builds_by_id.setdefault(build_id, build_info)
 
-        # Get extra RPMs from tasks.
-        rpms += self.get_extra_rpms_from_tasks()
-
         skipped_arches = []
         skipped_packages_count = 0
+        skipped_included_count = 0
         # We need to process binary packages first, and then source packages.
         # If we have a list of packages to use, we need to put all source rpms
         # names into it. Otherwise if the SRPM name does not occur on the list,
@@ -626,9 +1033,17 @@ class KojiPackageSet(PackageSetBase):
                 and (rpm_info["name"], rpm_info["arch"]) not in include_packages
                 and rpm_info["arch"] != "src"
             ):
-                self.log_debug(
-                    "Skipping %(name)s-%(version)s-%(release)s.%(arch)s" % rpm_info
-                )
+                if self.detail_log is not None:
+                    self.detail_log.record(
+                        "skip",
+                        pkgset=self.name,
+                        nvra="%(name)s-%(version)s-%(release)s.%(arch)s" % rpm_info,
+                    )
+                    skipped_included_count += 1
+                else:
+                    self.log_debug(
+                        "Skipping %(name)s-%(version)s-%(release)s.%(arch)s", rpm_info
+                    )
                 continue
 
             if (
@@ -659,8 +1074,24 @@ class KojiPackageSet(PackageSetBase):
                 "Skipped %d packages, not marked as to be "
                 "included in a compose." % skipped_packages_count
             )
+        if skipped_included_count:
+            self.detail_log.flush()
+            self.log_info(
+                "Skipped %d packages not in the list of included packages, "
+                "details in %s",
+                skipped_included_count,
+                self.detail_log.path,
+            )
 
-        result = self.read_packages(result_rpms, result_srpms)
+        listed = self.resolve_package_paths(result_srpms + result_rpms)
+        try:
+            result = self.read_packages(result_rpms, result_srpms)
+            self.log_debug(
+                "Package set: %d directory listings replaced %d stat calls"
+                % (listed, self.path_resolver.lookups)
+            )
+        finally:
+            self.path_resolver = None
 
         # Check that after reading the packages, every package that is
         # included in a compose has the right sigkey.
@@ -671,6 +1102,58 @@ class KojiPackageSet(PackageSetBase):
             if invalid_sigkey_rpms:
                 self.raise_invalid_sigkeys_exception(invalid_sigkey_rpms)
 
+        return result
+
+    def populate_incrementally(self, tag, event, inherit, include_packages):
+        """Populate the package set from data reused from old compose. RPMs of
+        packages changed in the tag since then are replaced with RPMs of the
+        latest builds of these packages. Only headers of the new RPMs are read.
+        """
+        reuse_data, changed_packages = self.incremental_reuse
+        self.incremental_reuse = None
+
+        msg = "Updating %d changed packages (tag: %s, event: %s, inherit: %s)" % (
+            len(changed_packages),
+            tag,
+            event,
+            inherit,
+        )
+        self.log_info("[BEGIN] %s" % msg)
+
+        dropped = 0
+        for arch, rpms in reuse_data["rpms_by_arch"].items():
+            self.rpms_by_arch.setdefault(arch, [])
+            for rpm_obj in rpms:
+                if _get_package_name(rpm_obj) in changed_packages:
+                    dropped += 1
+                    continue
+                self.file_cache[rpm_obj.file_path] = rpm_obj
+                self.rpms_by_arch[arch].append(rpm_obj)
+        for file_name, rpm_obj in reuse_data["srpms_by_name"].items():
+            if rpm_obj.name not in changed_packages:
+                self.srpms_by_name[file_name] = rpm_obj
+
+        changed_packages = sorted(changed_packages)
+        responses = self.koji_wrapper.chunked_multicall_map(
+            "listTaggedRPMS",
+            list_of_args=[tag] * len(changed_packages),
+            list_of_kwargs=[
+                {"event": event, "inherit": inherit, "latest": True, "package": name}
+                for name in changed_packages
+            ],
+        )
+        rpms = []
+        builds = []
+        for package_rpms, package_builds in responses or []:
+            rpms += package_rpms
+            builds += package_builds
+        self.log_debug(
+            "Dropped %d reused RPMs, found %d RPMs in latest builds of changed "
+            "packages" % (dropped, len(rpms))
+        )
+
+        result = self._read_tagged_rpms(rpms, builds, [], include_packages)
+
         self.log_info("[DONE ] %s" % msg)
         return result
 
@@ -684,26 +1167,47 @@ class KojiPackageSet(PackageSetBase):
         reuse_file = compose.paths.work.pkgset_reuse_file(self.name)
         self.log_info("Writing pkgset reuse file: %s" % reuse_file)
         try:
-            with open(reuse_file, "wb") as f:
-                pickle.dump(
-                    {
-                        "name": self.name,
-                        "allow_invalid_sigkeys": self._allow_invalid_sigkeys,
-                        "arches": self.arches,
-                        "sigkeys": self.sigkey_ordering,
-                        "packages": self.packages,
-                        "populate_only_packages": self.populate_only_packages,
-                        "rpms_by_arch": self.rpms_by_arch,
-                        "srpms_by_name": self.srpms_by_name,
-                        "extra_builds": self.extra_builds,
-                        "include_packages": include_packages,
-                    },
-                    f,
-                    protocol=pickle.HIGHEST_PROTOCOL,
-                )
+            write_package_file(
+                reuse_file,
+                (
+                    rpm_obj
+                    for arch in sorted(self.rpms_by_arch)
+                    for rpm_obj in self.rpms_by_arch[arch]
+                ),
+                metadata={
+                    "name": self.name,
+                    "allow_invalid_sigkeys": self._allow_invalid_sigkeys,
+                    "arches": self.arches,
+                    "sigkeys": self.sigkey_ordering,
+                    "packages": self.packages,
+                    "populate_only_packages": self.populate_only_packages,
+                    "rpm_arches": sorted(self.rpms_by_arch),
+                    "extra_builds": self.extra_builds,
+                    "include_packages": include_packages,
+                },
+            )
         except Exception as e:
             self.log_warning("Writing pkgset reuse file failed: %s" % str(e))
 
+    @staticmethod
+    def load_reuse_file(file_path):
+        """Load data written by `write_reuse_file`. Returns a dict with the
+        stored metadata and the per-arch package lists.
+        """
+        package_file = PackageFile(file_path)
+        reuse_data = dict(package_file.metadata)
+        reuse_data["rpms_by_arch"] = dict(
+            (arch, []) for arch in reuse_data.pop("rpm_arches")
+        )
+        reuse_data["srpms_by_name"] = {}
+        for path in package_file:
+            rpm_obj = package_file[path]
+            reuse_data["rpms_by_arch"][rpm_obj.arch].append(rpm_obj)
+            if pkg_is_srpm(rpm_obj):
+                reuse_data["srpms_by_name"][rpm_obj.file_name] = rpm_obj
+        package_file.close()
+        return reuse_data
+
     def _get_koji_event_from_file(self, event_file):
         with open(event_file, "r") as f:
             return json.load(f)["id"]
@@ -737,6 +1241,15 @@ class KojiPackageSet(PackageSetBase):
             self.log_debug("Can't read koji event from file: %s" % str(e))
             return False
 
+        # Packages with builds tagged or untagged since the old compose. They
+        # can be updated incrementally, other changes require full populate.
+        changed_packages = set()
+        incremental = (
+            compose.conf["pkgset_incremental_reuse"]
+            and not self.extra_builds
+            and not self.extra_tasks
+        )
+
         if koji_event != old_koji_event:
             self.log_debug(
                 "Koji event doesn't match, querying changes between event %d and %d"
@@ -749,8 +1262,10 @@ class KojiPackageSet(PackageSetBase):
                 beforeEvent=max(koji_event, old_koji_event) + 1,
             )
             if changed["tag_listing"]:
-                self.log_debug("Builds under tag %s changed. Can't reuse." % tag)
-                return False
+                if not incremental:
+                    self.log_debug("Builds under tag %s changed. Can't reuse." % tag)
+                    return False
+                changed_packages.update(i["name"] for i in changed["tag_listing"])
             if changed["tag_inheritance"]:
                 self.log_debug("Tag inheritance %s changed. Can't reuse." % tag)
                 return False
@@ -765,11 +1280,15 @@ class KojiPackageSet(PackageSetBase):
                         beforeEvent=max(koji_event, old_koji_event) + 1,
                     )
                     if changed["tag_listing"]:
-                        self.log_debug(
-                            "Builds under inherited tag %s changed. Can't reuse."
-                            % t["name"]
+                        if not incremental:
+                            self.log_debug(
+                                "Builds under inherited tag %s changed. Can't reuse."
+                                % t["name"]
+                            )
+                            return False
+                        changed_packages.update(
+                            i["name"] for i in changed["tag_listing"]
                         )
-                        return False
                     if changed["tag_inheritance"]:
                         self.log_debug("Tag inheritance %s changed. Can't reuse." % tag)
                         return False
@@ -786,7 +1305,7 @@ class KojiPackageSet(PackageSetBase):
 
         try:
             self.log_debug("Loading reuse file: %s" % old_reuse_file)
-            reuse_data = self.load_old_file_cache(old_reuse_file)
+            reuse_data = self.load_reuse_file(old_reuse_file)
         except Exception as e:
             self.log_debug("Failed to load reuse file: %s" % str(e))
             return False
@@ -799,6 +1318,15 @@ class KojiPackageSet(PackageSetBase):
             and reuse_data["sigkeys"] == self.sigkey_ordering
             and reuse_data["include_packages"] == include_packages
         ):
+            if changed_packages:
+                # The repodata will be created again, with createrepo reusing
+                # metadata of unchanged packages from the old compose.
+                self.log_info(
+                    "Reusing pkgset data, %d packages changed: %s"
+                    % (len(changed_packages), " ".join(sorted(changed_packages)))
+                )
+                self.incremental_reuse = (reuse_data, changed_packages)
+                return False
             self.log_info("Copying repo data for reuse: %s" % old_repo_dir)
             copy_all(old_repo_dir, repo_dir)
             self.reuse = old_repo_dir
@@ -812,6 +1340,66 @@ class KojiPackageSet(PackageSetBase):
             return False
 
 
+def _prepare_arch_list(arch_list):
+    """Modify list of arches for merging a package set in place: make sure
+    nosrc is included together with src and the sources are last.
+    """
+    # if "src" is present, make sure "nosrc" is included too
+    if "src" in arch_list and "nosrc" not in arch_list:
+        arch_list.append("nosrc")
+
+    # make sure sources are processed last
+    for i in ("nosrc", "src"):
+        if i in arch_list:
+            arch_list.remove(i)
+            arch_list.append(i)
+
+
+def _get_exclusivearch_list(primary_arch, exclusive_noarch):
+    """Get list of arches to check {Exclude,Exclusive}Arch of noarch packages
+    against when creating a subset for given tree arch.
+    """
+    # {Exclude,Exclusive}Arch must match *tree* arch + compatible native
+    # arches (excluding multilib arches)
+    if not primary_arch:
+        return None
+    exclusivearch_list = get_valid_arches(
+        primary_arch, multilib=False, add_noarch=False, add_src=False
+    )
+    # We don't want to consider noarch: if a package is true noarch
+    # build (not just a subpackage), it has to have noarch in
+    # ExclusiveArch otherwise rpm will refuse to build it.
+    # This should eventually become a default, but it could have a big
+    # impact and thus it's hidden behind an option.
+    if not exclusive_noarch and "noarch" in exclusivearch_list:
+        exclusivearch_list.remove("noarch")
+    return exclusivearch_list
+
+
+def _get_excluded_mask(arches, exclusive_sets):
+    """Get mask of subsets a noarch package with given (ExcludeArch,
+    ExclusiveArch) is excluded from. This matches ``pungi.arch.is_excluded``.
+    """
+    excludearch = set(arches[0])
+    exclusivearch = set(arches[1])
+    mask = 0
+    for bit, exclusive_set in enumerate(exclusive_sets):
+        if not exclusive_set:
+            continue
+        if (excludearch & exclusive_set) or (
+            exclusivearch and not (exclusivearch & exclusive_set)
+        ):
+            mask |= 1 << bit
+    return mask
+
+
+def _get_package_name(rpm_obj):
+    """Get name of Koji package the RPM was built from."""
+    if pkg_is_srpm(rpm_obj):
+        return rpm_obj.name
+    return kobo.rpmlib.parse_nvra(rpm_obj.sourcerpm)["name"]
+
+
 def _is_src(rpm_info):
     """Check if rpm info object returned by Koji refers to source packages."""
     return rpm_info["arch"] in ("src", "nosrc")
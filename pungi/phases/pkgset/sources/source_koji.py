@@ -28,11 +28,16 @@ import pungi.wrappers.kojiwrapper
 from pungi.wrappers.comps import CompsWrapper
 from pungi.wrappers.mbs import MBSWrapper
 import pungi.phases.pkgset.pkgsets
+from pungi.detail_log import get_detail_log
 from pungi.arch import getBaseArch
 from pungi.util import retry, get_arch_variant_data, get_variant_data
 from pungi.module_util import Modulemd
 
-from pungi.phases.pkgset.common import MaterializedPackageSet, get_all_arches
+from pungi.phases.pkgset.common import (
+    MaterializedPackageSet,
+    get_all_arches,
+    get_header_cache,
+)
 from pungi.phases.gather import get_packages_to_gather
 
 import pungi.phases.pkgset.source
@@ -127,11 +132,12 @@ def get_koji_modules(compose, koji_wrapper, event, module_info_str):
     query_str = query_str.replace("*.*", "*")
 
     koji_builds = koji_proxy.search(query_str, "build", "glob")
+    build_infos = koji_wrapper.chunked_multicall_map(
+        "getBuild", list_of_args=[build["id"] for build in koji_builds]
+    )
 
     modules = []
-    for build in koji_builds:
-        md = koji_proxy.getBuild(build["id"])
-
+    for build, md in zip(koji_builds, build_infos):
         if md["completion_ts"] > event["ts"]:
             # The build finished after the event at which we are limited to,
             # ignore it.
@@ -609,12 +615,14 @@ def _get_modules_from_koji_tags(
                 latest_builds += list(nsv_builds)
                 break
 
+        # Get the Builds from Koji to get modulemd and module_tag.
+        builds = koji_wrapper.chunked_multicall_map(
+            "getBuild", list_of_args=[build["build_id"] for build in latest_builds]
+        )
+
         # For each latest modular Koji build, add it to variant and
         # variant_tags.
-        for build in latest_builds:
-            # Get the Build from Koji to get modulemd and module_tag.
-            build = koji_proxy.getBuild(build["build_id"])
-
+        for build in builds:
             nsvc = _add_module_to_variant(
                 koji_wrapper,
                 variant,
@@ -785,105 +793,122 @@ def populate_global_pkgset(compose, koji_wrapper, path_prefix, event):
     inherit_modules = compose.conf["pkgset_koji_inherit_modules"]
 
     pkgsets = []
-
-    # Get package set for each compose tag and merge it to global package
-    # list. Also prepare per-variant pkgset, because we do not have list
-    # of binary RPMs in module definition - there is just list of SRPMs.
-    for compose_tag in compose_tags:
-        compose.log_info("Loading package set for tag %s", compose_tag)
-        if compose_tag in pkgset_koji_tags:
-            extra_builds = force_list(compose.conf.get("pkgset_koji_builds", []))
-            extra_tasks = force_list(compose.conf.get("pkgset_koji_scratch_tasks", []))
-        else:
-            extra_builds = []
-            extra_tasks = []
-
-        pkgset = pungi.phases.pkgset.pkgsets.KojiPackageSet(
-            compose_tag,
-            koji_wrapper,
-            compose.conf["sigkeys"],
-            logger=compose._logger,
-            arches=all_arches,
-            packages=packages_to_gather,
-            allow_invalid_sigkeys=allow_invalid_sigkeys,
-            populate_only_packages=populate_only_packages_to_gather,
-            cache_region=compose.cache_region,
-            extra_builds=extra_builds,
-            extra_tasks=extra_tasks,
-            signed_packages_retries=compose.conf["signed_packages_retries"],
-            signed_packages_wait=compose.conf["signed_packages_wait"],
-        )
-
-        # Check if we have cache for this tag from previous compose. If so, use
-        # it.
-        old_cache_path = compose.paths.old_compose_path(
-            compose.paths.work.pkgset_file_cache(compose_tag)
-        )
-        if old_cache_path:
-            pkgset.set_old_file_cache(
-                pungi.phases.pkgset.pkgsets.KojiPackageSet.load_old_file_cache(
-                    old_cache_path
+    header_cache = get_header_cache(compose)
+
+    try:
+        # Get package set for each compose tag and merge it to global package
+        # list. Also prepare per-variant pkgset, because we do not have list
+        # of binary RPMs in module definition - there is just list of SRPMs.
+        for compose_tag in compose_tags:
+            compose.log_info("Loading package set for tag %s", compose_tag)
+            if compose_tag in pkgset_koji_tags:
+                extra_builds = force_list(compose.conf.get("pkgset_koji_builds", []))
+                extra_tasks = force_list(
+                    compose.conf.get("pkgset_koji_scratch_tasks", [])
                 )
+            else:
+                extra_builds = []
+                extra_tasks = []
+
+            pkgset = pungi.phases.pkgset.pkgsets.KojiPackageSet(
+                compose_tag,
+                koji_wrapper,
+                compose.conf["sigkeys"],
+                logger=compose._logger,
+                arches=all_arches,
+                packages=packages_to_gather,
+                allow_invalid_sigkeys=allow_invalid_sigkeys,
+                populate_only_packages=populate_only_packages_to_gather,
+                cache_region=compose.cache_region,
+                extra_builds=extra_builds,
+                extra_tasks=extra_tasks,
+                signed_packages_retries=compose.conf["signed_packages_retries"],
+                signed_packages_wait=compose.conf["signed_packages_wait"],
+                compact_store=compose.conf["pkgset_compact_store"],
+                reader_processes=compose.conf["pkgset_reader_processes"],
+                header_cache=header_cache,
+                detail_log=get_detail_log(compose, "pkgset"),
             )
 
-        is_traditional = compose_tag in compose.conf.get("pkgset_koji_tag", [])
-        should_inherit = inherit if is_traditional else inherit_modules
-
-        # If we're processing a modular tag, we have an exact list of
-        # packages that will be used. This is basically a workaround for
-        # tagging working on build level, not rpm level. A module tag may
-        # build a package but not want it included. This should include
-        # only packages that are actually in modules. It's possible two
-        # module builds will use the same tag, particularly a -devel module
-        # is sharing a tag with its regular version.
-        # The ultimate goal of the mapping is to avoid a package built in modular
-        # tag to be used as a dependency of some non-modular package.
-        modular_packages = set()
-        for variant in compose.all_variants.values():
-            for nsvc, modular_tag in variant.module_uid_to_koji_tag.items():
-                if modular_tag != compose_tag:
-                    # Not current tag, skip it
-                    continue
-                for arch_modules in variant.arch_mmds.values():
-                    try:
-                        module = arch_modules[nsvc]
-                    except KeyError:
-                        # The module was filtered out
+            # Check if we have cache for this tag from previous compose. If so, use
+            # it.
+            old_cache_path = compose.paths.old_compose_path(
+                compose.paths.work.pkgset_file_cache(compose_tag)
+            )
+            if old_cache_path:
+                try:
+                    pkgset.set_old_file_cache(
+                        pungi.phases.pkgset.pkgsets.KojiPackageSet.load_old_file_cache(
+                            old_cache_path
+                        )
+                    )
+                except Exception as e:
+                    compose.log_debug(
+                        "Failed to load old file cache %s: %s" % (old_cache_path, e)
+                    )
+
+            is_traditional = compose_tag in compose.conf.get("pkgset_koji_tag", [])
+            should_inherit = inherit if is_traditional else inherit_modules
+
+            # If we're processing a modular tag, we have an exact list of
+            # packages that will be used. This is basically a workaround for
+            # tagging working on build level, not rpm level. A module tag may
+            # build a package but not want it included. This should include
+            # only packages that are actually in modules. It's possible two
+            # module builds will use the same tag, particularly a -devel module
+            # is sharing a tag with its regular version.
+            # The ultimate goal of the mapping is to avoid a package built in modular
+            # tag to be used as a dependency of some non-modular package.
+            modular_packages = set()
+            for variant in compose.all_variants.values():
+                for nsvc, modular_tag in variant.module_uid_to_koji_tag.items():
+                    if modular_tag != compose_tag:
+                        # Not current tag, skip it
                         continue
-                    for rpm_nevra in module.get_rpm_artifacts():
-                        nevra = parse_nvra(rpm_nevra)
-                        modular_packages.add((nevra["name"], nevra["arch"]))
-
-        pkgset.try_to_reuse(
-            compose,
-            compose_tag,
-            inherit=should_inherit,
-            include_packages=modular_packages,
-        )
-
-        if pkgset.reuse is None:
-            pkgset.populate(
+                    for arch_modules in variant.arch_mmds.values():
+                        try:
+                            module = arch_modules[nsvc]
+                        except KeyError:
+                            # The module was filtered out
+                            continue
+                        for rpm_nevra in module.get_rpm_artifacts():
+                            nevra = parse_nvra(rpm_nevra)
+                            modular_packages.add((nevra["name"], nevra["arch"]))
+
+            pkgset.try_to_reuse(
+                compose,
                 compose_tag,
-                event,
                 inherit=should_inherit,
                 include_packages=modular_packages,
             )
-        for variant in compose.all_variants.values():
-            if compose_tag in variant_tags[variant]:
-
-                # If it's a modular tag, store the package set for the module.
-                for nsvc, koji_tag in variant.module_uid_to_koji_tag.items():
-                    if compose_tag == koji_tag:
-                        # TODO check if this is still needed
-                        # It should not be needed, we can get package sets by name.
-                        variant.nsvc_to_pkgset[nsvc] = pkgset
-
-                # Optimization for case where we have just single compose
-                # tag - we do not have to merge in this case...
-                variant.pkgsets.add(compose_tag)
-
-        pkgset.write_reuse_file(compose, include_packages=modular_packages)
-        pkgsets.append(pkgset)
+
+            if pkgset.reuse is None:
+                pkgset.populate(
+                    compose_tag,
+                    event,
+                    inherit=should_inherit,
+                    include_packages=modular_packages,
+                )
+            for variant in compose.all_variants.values():
+                if compose_tag in variant_tags[variant]:
+
+                    # If it's a modular tag, store the package set for the module.
+                    for nsvc, koji_tag in variant.module_uid_to_koji_tag.items():
+                        if compose_tag == koji_tag:
+                            # TODO check if this is still needed
+                            # It should not be needed, we can get package sets by name.
+                            variant.nsvc_to_pkgset[nsvc] = pkgset
+
+                    # Optimization for case where we have just single compose
+                    # tag - we do not have to merge in this case...
+                    variant.pkgsets.add(compose_tag)
+
+            pkgset.write_reuse_file(compose, include_packages=modular_packages)
+            pkgsets.append(pkgset)
+    finally:
+        # Store the headers read so far also when populating fails.
+        if header_cache:
+            header_cache.close()
 
     # Create MaterializedPackageSets.
     partials = []
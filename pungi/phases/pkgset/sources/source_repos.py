@@ -20,12 +20,17 @@ import shutil
 from kobo.shortcuts import run
 
 import pungi.phases.pkgset.pkgsets
+from pungi.detail_log import get_detail_log
 from pungi.util import makedirs
 from pungi.wrappers.pungi import PungiWrapper
 
-from pungi.phases.pkgset.common import MaterializedPackageSet, get_all_arches
+from pungi.phases.pkgset.common import (
+    MaterializedPackageSet,
+    get_all_arches,
+    get_header_cache,
+)
 from pungi.phases.gather import get_prepopulate_packages, get_packages_to_gather
-from pungi.linker import LinkerPool
+from pungi.linker import get_link_service
 
 
 import pungi.phases.pkgset.source
@@ -44,7 +49,7 @@ def get_pkgset_from_repos(compose):
 
     profiler = compose.conf["gather_profiler"]
 
-    pool = LinkerPool.with_workers(10, "hardlink-or-copy", logger=compose._logger)
+    files = []
 
     path_prefix = (
         os.path.join(compose.paths.work.topdir(arch="global"), "download") + "/"
@@ -109,7 +114,7 @@ def get_pkgset_from_repos(compose):
                 src = os.path.join(root, fn)
                 dst = os.path.join(path_prefix, os.path.basename(src))
                 flist.append(dst)
-                pool.queue_put((src, dst))
+                files.append((src, dst))
 
         # Clean up tmp dir
         # Workaround for rpm not honoring sgid bit which only appears when yum is used.
@@ -124,9 +129,9 @@ def get_pkgset_from_repos(compose):
 
     msg = "Linking downloaded pkgset packages"
     compose.log_info("[BEGIN] %s" % msg)
-    pool.start()
-    pool.stop()
-    compose.log_info("[DONE ] %s" % msg)
+    get_link_service(compose).submit(
+        files, "hardlink-or-copy", phase="pkgset", msg=msg
+    ).wait()
 
     flist = sorted(set(flist))
     pkgset_global = populate_global_pkgset(compose, flist, path_prefix)
@@ -140,10 +145,23 @@ def populate_global_pkgset(compose, file_list, path_prefix):
     ALL_ARCHES = get_all_arches(compose)
 
     compose.log_info("Populating the global package set from a file list")
+    header_cache = get_header_cache(compose)
     pkgset = pungi.phases.pkgset.pkgsets.FilelistPackageSet(
-        "repos", compose.conf["sigkeys"], logger=compose._logger, arches=ALL_ARCHES
+        "repos",
+        compose.conf["sigkeys"],
+        logger=compose._logger,
+        arches=ALL_ARCHES,
+        compact_store=compose.conf["pkgset_compact_store"],
+        reader_processes=compose.conf["pkgset_reader_processes"],
+        header_cache=header_cache,
+        detail_log=get_detail_log(compose, "pkgset"),
     )
-    pkgset.populate(file_list)
+    try:
+        pkgset.populate(file_list)
+    finally:
+        # Store the headers read so far also when populating fails.
+        if header_cache:
+            header_cache.close()
 
     return pkgset
 
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Compact storage of RPM header data for package sets.
+
+A package set for a big Koji tag holds data for 100k+ RPMs. Keeping a Python
+object with its own strings and sets of requires/provides for each of them
+costs several GB of memory. The PackageStore keeps the same data in columns:
+every string is interned once and packages only hold integer IDs pointing into
+the string table. Requires and provides of all packages share one array of
+string IDs addressed by per-package offsets.
+
+Package sets work with PackageRecord objects, which are lightweight views into
+the store exposing the same attributes as ExtendedRpmWrapper.
+"""
+
+import collections
+import os
+import threading
+from array import array
+
+
+# Fields read from RPM headers which are stored as interned values.
+SCALAR_FIELDS = (
+    "name",
+    "version",
+    "release",
+    "epoch",
+    "arch",
+    "sourcerpm",
+    "signature",
+    "checksum_type",
+)
+# Fields holding a list of arches.
+LIST_FIELDS = ("excludearch", "exclusivearch")
+# Fields holding dependency strings.
+DEP_FIELDS = ("requires", "provides")
+
+PackageStat = collections.namedtuple(
+    "PackageStat", ["st_dev", "st_ino", "st_size", "st_mtime"]
+)
+
+
+def get_fields(pkg):
+    """Return dict with header fields of a package object (PackageRecord or
+    ExtendedRpmWrapper) as plain values that can be serialized to JSON.
+    """
+    fields = dict((field, getattr(pkg, field)) for field in SCALAR_FIELDS)
+    for field in LIST_FIELDS:
+        fields[field] = list(getattr(pkg, field) or [])
+    for field in DEP_FIELDS:
+        fields[field] = sorted(getattr(pkg, field))
+    fields["is_source"] = pkg.is_source
+    fields["is_system_release"] = pkg.is_system_release
+    return fields
+
+
+class PackageStore(object):
+    """Columnar storage for RPM header data.
+
+    :param reader: function accepting a path to RPM file and returning a dict
+        with header fields (see ``SCALAR_FIELDS``, ``LIST_FIELDS`` and
+        ``DEP_FIELDS`` plus ``is_source`` and ``is_system_release``). It must
+        be picklable, as the store is saved with the package set.
+    """
+
+    def __init__(self, reader=None):
+        self.reader = reader
+        self._lock = threading.Lock()
+        # Table of interned values. None is always stored with ID 0.
+        self._values = [None]
+        self._value_ids = {None: 0}
+        # Table of interned arch lists. Empty list is always stored with ID 0.
+        self._lists = [()]
+        self._list_ids = {(): 0}
+        self._columns = dict((field, array("i")) for field in SCALAR_FIELDS)
+        self._columns["file_path"] = array("i")
+        for field in LIST_FIELDS:
+            self._columns[field] = array("i")
+        self._flags = array("b")
+        self._dev = array("l")
+        self._ino = array("l")
+        self._size = array("l")
+        self._mtime = array("d")
+        self._deps = dict((field, array("i")) for field in DEP_FIELDS)
+        self._dep_offsets = dict((field, array("l", [0])) for field in DEP_FIELDS)
+
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        del result["_lock"]
+        return result
+
+    def __setstate__(self, data):
+        self.__dict__.update(data)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flags)
+
+    def __call__(self, file_path, stat=None, **kwargs):
+        """Read header of given RPM and add it to the store.
+
+        This makes the store usable as a wrapper class for
+        ``kobo.pkgset.FileCache``.
+        """
+        file_path = os.path.abspath(file_path)
+        fields = self.reader(file_path, **kwargs)
+        return self.add(file_path, stat or os.stat(file_path), fields)
+
+    def _intern(self, value):
+        try:
+            return self._value_ids[value]
+        except KeyError:
+            self._value_ids[value] = len(self._values)
+            self._values.append(value)
+            return self._value_ids[value]
+
+    def _intern_list(self, values):
+        values = tuple(values or ())
+        try:
+            return self._list_ids[values]
+        except KeyError:
+            self._list_ids[values] = len(self._lists)
+            self._lists.append(values)
+            return self._list_ids[values]
+
+    def add(self, file_path, stat, fields):
+        """Add a package to the store and return a view to it.
+
+        :param str file_path: absolute path to the RPM file
+        :param stat: result of ``os.stat`` call on the file
+        :param dict fields: header fields as returned by the reader
+        """
+        with self._lock:
+            idx = len(self._flags)
+            self._columns["file_path"].append(self._intern(file_path))
+            for field in SCALAR_FIELDS:
+                self._columns[field].append(self._intern(fields[field]))
+            for field in LIST_FIELDS:
+                self._columns[field].append(self._intern_list(fields[field]))
+            for field in DEP_FIELDS:
+                deps = self._deps[field]
+                deps.extend(self._intern(dep) for dep in sorted(set(fields[field])))
+                self._dep_offsets[field].append(len(deps))
+            self._flags.append(
+                bool(fields["is_source"]) | bool(fields["is_system_release"]) << 1
+            )
+            self._dev.append(stat.st_dev)
+            self._ino.append(stat.st_ino)
+            self._size.append(stat.st_size)
+            self._mtime.append(stat.st_mtime)
+        return PackageRecord(self, idx)
+
+    def copy(self, pkg):
+        """Add a package described by a different object (for example an
+        ExtendedRpmWrapper or a record from another store) and return a view to
+        it.
+        """
+        return self.add(pkg.file_path, pkg.stat, get_fields(pkg))
+
+    def get_value(self, field, idx):
+        return self._values[self._columns[field][idx]]
+
+    def get_list(self, field, idx):
+        return list(self._lists[self._columns[field][idx]])
+
+    def set_list(self, field, idx, values):
+        with self._lock:
+            self._columns[field][idx] = self._intern_list(values)
+
+    def get_deps(self, field, idx):
+        offsets = self._dep_offsets[field]
+        return set(
+            self._values[i] for i in self._deps[field][offsets[idx] : offsets[idx + 1]]
+        )
+
+    def get_flag(self, idx, bit):
+        return bool(self._flags[idx] & (1 << bit))
+
+    def get_stat(self, idx):
+        return PackageStat(
+            self._dev[idx], self._ino[idx], self._size[idx], self._mtime[idx]
+        )
+
+    def memory_usage(self):
+        """Return approximate number of bytes used by the store arrays."""
+        arrays = (
+            list(self._columns.values())
+            + list(self._deps.values())
+            + list(self._dep_offsets.values())
+            + [self._flags, self._dev, self._ino, self._size, self._mtime]
+        )
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+class _ValueField(object):
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj._store.get_value(self.field, obj._idx)
+
+
+class _ListField(object):
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj._store.get_list(self.field, obj._idx)
+
+    def __set__(self, obj, value):
+        obj._store.set_list(self.field, obj._idx, value)
+
+
+class _DepsField(object):
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj._store.get_deps(self.field, obj._idx)
+
+
+class _FlagField(object):
+    def __init__(self, bit):
+        self.bit = bit
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj._store.get_flag(obj._idx, self.bit)
+
+
+class PackageRecord(object):
+    """A view into PackageStore for a single package. It provides the same
+    attributes as ExtendedRpmWrapper.
+    """
+
+    __slots__ = ("_store", "_idx")
+
+    file_path = _ValueField("file_path")
+    name = _ValueField("name")
+    version = _ValueField("version")
+    release = _ValueField("release")
+    epoch = _ValueField("epoch")
+    arch = _ValueField("arch")
+    sourcerpm = _ValueField("sourcerpm")
+    signature = _ValueField("signature")
+    checksum_type = _ValueField("checksum_type")
+    excludearch = _ListField("excludearch")
+    exclusivearch = _ListField("exclusivearch")
+    requires = _DepsField("requires")
+    provides = _DepsField("provides")
+    is_source = _FlagField(0)
+    is_system_release = _FlagField(1)
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._idx = idx
+
+    def __getstate__(self):
+        return (self._store, self._idx)
+
+    def __setstate__(self, state):
+        self._store, self._idx = state
+
+    def __str__(self):
+        return "%s-%s-%s.%s.rpm" % (self.name, self.version, self.release, self.arch)
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def stat(self):
+        return self._store.get_stat(self._idx)
+
+    @property
+    def file_name(self):
+        return os.path.basename(self.file_path)
+
+    @property
+    def size(self):
+        return self._store.get_stat(self._idx).st_size
+
+    @property
+    def mtime(self):
+        return self._store.get_stat(self._idx).st_mtime
+
+    @property
+    def vr(self):
+        return "%s-%s" % (self.version, self.release)
+
+    @property
+    def nvr(self):
+        return "%s-%s-%s" % (self.name, self.version, self.release)
+
+    @property
+    def nvra(self):
+        return "%s-%s-%s.%s" % (self.name, self.version, self.release, self.arch)
+
+    @property
+    def nevra(self):
+        epoch = self.epoch
+        if epoch is None:
+            epoch = 0
+        return "%s-%s:%s-%s.%s" % (
+            self.name,
+            epoch,
+            self.version,
+            self.release,
+            self.arch,
+        )
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Helpers for running tasks in parallel threads.
+
+Scheduler runs tasks with dependencies between them. A task is started as soon
+as all tasks it depends on are finished, so independent chains of tasks
+overlap. Start and end time of each task is recorded, which allows finding the
+chain of tasks that determined the total run time.
+
+BudgetScheduler runs independent jobs, keeping their total CPU and memory
+requirements under a limit.
+"""
+
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+
+
+class Scheduler(object):
+    """
+    Example:
+
+        scheduler = Scheduler()
+        scheduler.add("download", download)
+        scheduler.add("unpack", unpack, deps=["download"])
+        scheduler.run(threads=4)
+    """
+
+    def __init__(self):
+        # name -> (callable, list of names of dependencies)
+        self.tasks = {}
+        # Names in the order they were added. Ready tasks are started in this
+        # order.
+        self.order = []
+        # name -> (start time, end time)
+        self.timings = {}
+
+    def add(self, name, func, deps=None):
+        """Add a task. Dependencies must be added before the task."""
+        if name in self.tasks:
+            raise ValueError("Task %s already exists" % name)
+        deps = list(deps or [])
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError("Task %s depends on unknown task %s" % (name, dep))
+        self.tasks[name] = (func, deps)
+        self.order.append(name)
+
+    def run(self, threads):
+        """Run all tasks and wait for them to finish. If any task fails, no
+        new tasks are started and the first exception is raised again once
+        the running tasks finish.
+        """
+        # Configuration options with number type can be floats.
+        threads = int(threads)
+        lock = threading.Lock()
+        ready = queue.Queue()
+        waiting = dict((name, set(self.tasks[name][1])) for name in self.order)
+        dependants = dict((name, []) for name in self.order)
+        for name in self.order:
+            for dep in self.tasks[name][1]:
+                dependants[dep].append(name)
+        state = {"remaining": len(self.order), "error": None}
+
+        def finish(name, exc_info):
+            with lock:
+                state["remaining"] -= 1
+                if exc_info and not state["error"]:
+                    state["error"] = exc_info
+                if state["error"]:
+                    done = state["remaining"] == 0 or not self._any_running()
+                else:
+                    for dependant in dependants[name]:
+                        waiting[dependant].discard(name)
+                        if not waiting[dependant]:
+                            ready.put(dependant)
+                    done = state["remaining"] == 0
+                if done:
+                    for _ in range(threads):
+                        ready.put(None)
+
+        def worker():
+            while True:
+                name = ready.get()
+                if name is None:
+                    return
+                start = time.time()
+                with lock:
+                    if state["error"]:
+                        # Something failed already, don't start anything new.
+                        continue
+                    self.timings[name] = (start, None)
+                exc_info = None
+                try:
+                    self.tasks[name][0]()
+                except Exception:
+                    exc_info = sys.exc_info()
+                with lock:
+                    self.timings[name] = (start, time.time())
+                finish(name, exc_info)
+
+        if not self.order:
+            return
+        for name in self.order:
+            if not waiting[name]:
+                ready.put(name)
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        for t in workers:
+            t.join()
+
+        if state["error"]:
+            six.reraise(*state["error"])
+
+    def _any_running(self):
+        return any(end is None for _, end in self.timings.values())
+
+    def get_duration(self, name):
+        start, end = self.timings[name]
+        return end - start
+
+    def get_critical_path(self):
+        """Return list of names of tasks forming the chain that finished last.
+        Each task in the list is the dependency of the next one that finished
+        last.
+        """
+        finished = [name for name in self.order if name in self.timings]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self.tasks[path[0]][1] if dep in self.timings]
+            if not deps:
+                break
+            path.insert(0, max(deps, key=lambda name: self.timings[name][1]))
+        return path
+
+    def get_report(self):
+        """Return lines describing duration of each task and the critical
+        path.
+        """
+        lines = []
+        for name in self.order:
+            if name in self.timings and self.timings[name][1] is not None:
+                lines.append("%s: %.2f s" % (name, self.get_duration(name)))
+        path = self.get_critical_path()
+        if path:
+            total = self.timings[path[-1]][1] - self.timings[path[0]][0]
+            lines.append("Critical path (%.2f s): %s" % (total, " -> ".join(path)))
+        return lines
+
+
+class BudgetScheduler(object):
+    """
+    Run jobs in parallel so that the resources they need in total do not go
+    over a given budget. Each job declares how many CPUs and how much memory
+    it needs. Jobs are started from the most expensive one. When the most
+    expensive waiting job does not fit into the remaining budget, smaller jobs
+    that fit are started instead. A job needing more than the whole budget is
+    started only when nothing else is running.
+
+    Each decision is passed to the ``log`` callable and kept in ``decisions``.
+
+    Example:
+
+        scheduler = BudgetScheduler(cpus=8, memory=16384)
+        scheduler.add("big", big_job, cpus=6, memory=8000)
+        scheduler.add("small", small_job, cpus=1, memory=500)
+        results = scheduler.run()
+    """
+
+    def __init__(self, cpus, memory, log=None):
+        self.cpus = cpus
+        self.memory = memory
+        self.log = log
+        # List of (name, callable, cpus, memory) in the order they were added.
+        self.jobs = []
+        self.decisions = []
+
+    def add(self, name, func, cpus, memory):
+        self.jobs.append((name, func, cpus, memory))
+
+    def _log(self, msg, *args):
+        self.decisions.append(msg % args)
+        if self.log:
+            self.log(msg, *args)
+
+    def run(self):
+        """Run all jobs and return list of their results in the order the
+        jobs were added. If a job fails, no new jobs are started and the
+        first exception is raised again when the running jobs finish.
+        """
+        cond = threading.Condition()
+        waiting = sorted(
+            range(len(self.jobs)),
+            key=lambda idx: (self.jobs[idx][2], self.jobs[idx][3]),
+            reverse=True,
+        )
+        results = [None] * len(self.jobs)
+        state = {"cpus": self.cpus, "memory": self.memory, "running": 0}
+        errors = []
+
+        def worker(idx):
+            name, func, cpus, memory = self.jobs[idx]
+            try:
+                results[idx] = func()
+            except Exception:
+                errors.append(sys.exc_info())
+            with cond:
+                state["cpus"] += cpus
+                state["memory"] += memory
+                state["running"] -= 1
+                self._log(
+                    "Finished %s, free: %d CPUs, %d MiB", name, *self._free(state)
+                )
+                cond.notify()
+
+        def pick():
+            for pos, idx in enumerate(waiting):
+                _, _, cpus, memory = self.jobs[idx]
+                fits = cpus <= state["cpus"] and memory <= state["memory"]
+                if fits or not state["running"]:
+                    return waiting.pop(pos)
+            return None
+
+        with cond:
+            while waiting or state["running"]:
+                idx = None if errors else pick()
+                if idx is None:
+                    if not state["running"]:
+                        break
+                    cond.wait()
+                    continue
+                name, func, cpus, memory = self.jobs[idx]
+                state["cpus"] -= cpus
+                state["memory"] -= memory
+                state["running"] += 1
+                self._log(
+                    "Starting %s (%d CPUs, %d MiB), free: %d CPUs, %d MiB",
+                    name,
+                    cpus,
+                    memory,
+                    *self._free(state)
+                )
+                t = threading.Thread(target=worker, args=(idx,))
+                t.daemon = True
+                t.start()
+
+        if errors:
+            six.reraise(*errors[0])
+        return results
+
+    def _free(self, state):
+        return max(state["cpus"], 0), max(state["memory"], 0)
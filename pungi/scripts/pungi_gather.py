@@ -5,14 +5,21 @@ from __future__ import print_function
 
 import argparse
 from collections import defaultdict
+import hashlib
+import json
+import logging
 import os
 import sys
+import traceback
+
+import createrepo_c as cr
+import dnf.comps
 
 import pungi.ks
 from pungi.dnf_wrapper import DnfWrapper, Conf
-from pungi.gather_dnf import Gather, GatherOptions
+from pungi.gather_dnf import DepsCache, Gather, GatherOptions, get_query_partitions
 from pungi.profiler import Profiler
-from pungi.util import temp_dir
+from pungi.util import as_local_file, temp_dir
 
 
 def get_parser():
@@ -23,14 +30,17 @@ def get_parser():
     )
     parser.add_argument(
         "--arch",
-        required=True,
     )
     parser.add_argument(
         "--config",
         metavar="PATH",
-        required=True,
         help="path to kickstart config file",
     )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="read requests from stdin and reuse loaded repos between them",
+    )
     parser.add_argument(
         "--download-to",
         metavar="PATH",
@@ -44,6 +54,17 @@ def get_parser():
         metavar="[REPOID]",
         help="lookaside repositories",
     )
+    group.add_argument(
+        "--deps-cache",
+        metavar="PATH",
+        help="SQLite database with providers of requirements reused by other runs",
+    )
+    group.add_argument(
+        "--comps-repo",
+        action="append",
+        metavar="[REPOID]",
+        help="repositories only providing comps (used in server mode)",
+    )
 
     group = parser.add_argument_group("Gather options")
     group.add_argument(
@@ -93,12 +114,7 @@ def get_parser():
     return parser
 
 
-def main(ns, persistdir, cachedir):
-    dnf_conf = Conf(ns.arch)
-    dnf_conf.persistdir = persistdir
-    dnf_conf.cachedir = cachedir
-    dnf_obj = DnfWrapper(dnf_conf)
-
+def get_gather_options(ns):
     gather_opts = GatherOptions()
 
     if ns.greedy:
@@ -125,13 +141,22 @@ def main(ns, persistdir, cachedir):
     if ns.exclude_debug:
         gather_opts.exclude_debug = True
 
-    ksparser = pungi.ks.get_ksparser(ns.config)
+    return gather_opts
+
 
+def get_dnf(arch, persistdir, cachedir):
+    dnf_conf = Conf(arch)
+    dnf_conf.persistdir = persistdir
+    dnf_conf.cachedir = cachedir
+    return DnfWrapper(dnf_conf)
+
+
+def add_repos(dnf_obj, ksparser, lookaside_repos, skip=()):
     # read repos from ks
     for ks_repo in ksparser.handler.repo.repoList:
         # HACK: lookaside repos first; this is workaround for no repo priority
         # handling in hawkey
-        if ks_repo.name not in gather_opts.lookaside_repos:
+        if ks_repo.name not in lookaside_repos:
             continue
 
         if getattr(ks_repo, "metalink", False):
@@ -152,7 +177,7 @@ def main(ns, persistdir, cachedir):
             dnf_obj.add_repo(ks_repo.name, ks_repo.baseurl, enablegroups=False)
 
     for ks_repo in ksparser.handler.repo.repoList:
-        if ks_repo.name in gather_opts.lookaside_repos:
+        if ks_repo.name in lookaside_repos or ks_repo.name in skip:
             continue
         if getattr(ks_repo, "metalink", False):
             dnf_obj.add_repo(ks_repo.name, ks_repo.baseurl, metalink=ks_repo.metalink)
@@ -163,17 +188,47 @@ def main(ns, persistdir, cachedir):
         else:
             dnf_obj.add_repo(ks_repo.name, ks_repo.baseurl)
 
-    with Profiler("DnfWrapper.fill_sack()"):
-        dnf_obj.fill_sack(load_system_repo=False, load_available_repos=True)
-        dnf_obj.read_comps()
 
+def get_repo_state(arch, ksparser, skip=()):
+    """Return a checksum identifying content of all repos in the kickstart
+    except the skipped ones. If some repo can't be identified (it uses a
+    metalink or mirrorlist), None is returned.
+    """
+    repos = []
+    for ks_repo in ksparser.handler.repo.repoList:
+        if ks_repo.name in skip:
+            continue
+        if getattr(ks_repo, "metalink", False) or getattr(ks_repo, "mirrorlist", False):
+            return None
+        url = os.path.join(ks_repo.baseurl, "repodata/repomd.xml")
+        with as_local_file(url) as url_:
+            repomd = cr.Repomd(url_)
+        checksums = sorted(
+            (rec.type, rec.checksum)
+            for rec in repomd.records
+            if rec.type in ("primary", "filelists")
+        )
+        repos.append((ks_repo.name, checksums))
+    data = json.dumps([arch, sorted(repos)])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def gather(
+    dnf_obj, gather_opts, ksparser, logger=None, partitions=None, deps_cache=None
+):
     gather_opts.langpacks = dnf_obj.comps_wrapper.get_langpacks()
     gather_opts.multilib_blacklist = ksparser.handler.multilib_blacklist
     gather_opts.multilib_whitelist = ksparser.handler.multilib_whitelist
     gather_opts.prepopulate = ksparser.handler.prepopulate
     gather_opts.fulltree_excludes = ksparser.handler.fulltree_excludes
 
-    g = Gather(dnf_obj, gather_opts)
+    g = Gather(
+        dnf_obj,
+        gather_opts,
+        logger=logger,
+        partitions=partitions,
+        deps_cache=deps_cache,
+    )
 
     packages, conditional_packages = ksparser.get_packages(dnf_obj)
     excluded = ksparser.get_excluded_packages(dnf_obj)
@@ -182,6 +237,24 @@ def main(ns, persistdir, cachedir):
         packages.add("-%s" % i)
 
     g.gather(packages, conditional_packages)
+    return g
+
+
+def main(ns, persistdir, cachedir):
+    dnf_obj = get_dnf(ns.arch, persistdir, cachedir)
+    gather_opts = get_gather_options(ns)
+    ksparser = pungi.ks.get_ksparser(ns.config)
+    add_repos(dnf_obj, ksparser, gather_opts.lookaside_repos)
+
+    with Profiler("DnfWrapper.fill_sack()"):
+        dnf_obj.fill_sack(load_system_repo=False, load_available_repos=True)
+        dnf_obj.read_comps()
+
+    deps_cache = None
+    if ns.deps_cache:
+        deps_cache = DepsCache(get_repo_state(ns.arch, ksparser), ns.deps_cache)
+
+    g = gather(dnf_obj, gather_opts, ksparser, deps_cache=deps_cache)
 
     if ns.download_to:
         g.download(ns.download_to)
@@ -191,6 +264,132 @@ def main(ns, persistdir, cachedir):
         Profiler.print_results(stream=sys.stderr)
 
 
+class GatherSession(object):
+    """Repos loaded into a sack, together with queries splitting the packages
+    by type and arch. Requests with the same arch and repos can reuse it.
+    """
+
+    def __init__(self, key, dnf_obj, deps_cache):
+        self.key = key
+        self.dnf = dnf_obj
+        self.partitions = get_query_partitions(dnf_obj)
+        self.deps_cache = deps_cache
+
+
+def get_session_key(ns, ksparser, comps_repos):
+    repos = []
+    for ks_repo in ksparser.handler.repo.repoList:
+        if ks_repo.name in comps_repos:
+            continue
+        repos.append(
+            (
+                ks_repo.name,
+                ks_repo.baseurl,
+                getattr(ks_repo, "metalink", None),
+                getattr(ks_repo, "mirrorlist", None),
+            )
+        )
+    return (ns.arch, tuple(repos), tuple(ns.lookaside or []))
+
+
+def load_comps(ksparser, comps_repos):
+    """Read comps directly from given repos. Unlike DnfWrapper.read_comps(),
+    this does not need the repos to be loaded into the sack.
+    """
+    comps = dnf.comps.Comps()
+    for ks_repo in ksparser.handler.repo.repoList:
+        if ks_repo.name not in comps_repos:
+            continue
+        path = ks_repo.baseurl
+        if path.startswith("file://"):
+            path = path[len("file://") :]
+        repomd = cr.Repomd(os.path.join(path, "repodata/repomd.xml"))
+        for rec in repomd.records:
+            if rec.type == "group":
+                comps._add_from_xml_filename(os.path.join(path, rec.location_href))
+    return comps
+
+
+def get_request_logger(stream):
+    logger = logging.getLogger("pungi_gather.request")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s [%(levelname)-8s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+        )
+    )
+    logger.addHandler(handler)
+    return logger
+
+
+def run_request(ns, session, persistdir, cachedir, output):
+    """Process one request in server mode. Returns the session that should be
+    used for the next request.
+    """
+    gather_opts = get_gather_options(ns)
+    ksparser = pungi.ks.get_ksparser(ns.config)
+    comps_repos = set(ns.comps_repo or [])
+    key = get_session_key(ns, ksparser, comps_repos)
+
+    if session and session.key == key:
+        output.write("Reusing loaded repos\n")
+        # Excludes from the previous request must not apply to this one.
+        session.dnf._sack.reset_excludes()
+    else:
+        # Release the old sack before loading a new one.
+        session = None
+        dnf_obj = get_dnf(ns.arch, persistdir, cachedir)
+        add_repos(dnf_obj, ksparser, gather_opts.lookaside_repos, skip=comps_repos)
+        dnf_obj.fill_sack(load_system_repo=False, load_available_repos=True)
+        # Requests using the same sack share providers of requirements even
+        # without a persistent database.
+        repo_state = None
+        if ns.deps_cache:
+            repo_state = get_repo_state(ns.arch, ksparser, skip=comps_repos)
+        session = GatherSession(key, dnf_obj, DepsCache(repo_state, ns.deps_cache))
+
+    session.dnf._comps = load_comps(ksparser, comps_repos)
+    g = gather(
+        session.dnf,
+        gather_opts,
+        ksparser,
+        logger=get_request_logger(output),
+        partitions=session.partitions,
+        deps_cache=session.deps_cache,
+    )
+    print_rpms(g, stream=output)
+    if ns.profiler:
+        # The results are cumulative for all requests processed so far.
+        Profiler.print_results(stream=output)
+    return session
+
+
+def serve(persistdir, cachedir, requests=sys.stdin, replies=sys.stdout):
+    """Process requests read line by line as JSON. Each request contains
+    command line arguments of a single run and a path to a file where the
+    output should be written. A reply is written for each request once it's
+    finished.
+    """
+    parser = get_parser()
+    session = None
+    for line in iter(requests.readline, ""):
+        request = json.loads(line)
+        with open(request["output"], "w") as output:
+            try:
+                ns = parser.parse_args(request["args"])
+                session = run_request(ns, session, persistdir, cachedir, output)
+                reply = {"status": "ok"}
+            except (Exception, SystemExit) as exc:
+                traceback.print_exc(file=output)
+                reply = {"status": "error", "error": str(exc)}
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+
 def _get_url(pkg):
     if pkg.baseurl:
         result = os.path.join(pkg.baseurl, pkg.location)
@@ -215,21 +414,26 @@ def deduplicate(gather_obj, items):
     return result.items()
 
 
-def print_rpms(gather_obj):
+def print_rpms(gather_obj, stream=None):
     for url, flags in deduplicate(gather_obj, gather_obj.result_binary_packages):
-        print("RPM%s: %s" % (_fmt_flags(flags), url))
+        print("RPM%s: %s" % (_fmt_flags(flags), url), file=stream)
 
     for url, flags in deduplicate(gather_obj, gather_obj.result_debug_packages):
-        print("DEBUGINFO%s: %s" % (_fmt_flags(flags), url))
+        print("DEBUGINFO%s: %s" % (_fmt_flags(flags), url), file=stream)
 
     for url, flags in deduplicate(gather_obj, gather_obj.result_source_packages):
-        print("SRPM%s: %s" % (_fmt_flags(flags), url))
+        print("SRPM%s: %s" % (_fmt_flags(flags), url), file=stream)
 
 
 def cli_main():
     parser = get_parser()
     ns = parser.parse_args()
+    if not ns.server and not (ns.arch and ns.config):
+        parser.error("--arch and --config are required")
 
     with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_") as persistdir:
         with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_cache_") as cachedir:
-            main(ns, persistdir, cachedir)
+            if ns.server:
+                serve(persistdir, cachedir)
+            else:
+                main(ns, persistdir, cachedir)
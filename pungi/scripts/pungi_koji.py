@@ -264,6 +264,8 @@ def main():
 
     # check if all requirements are met
     import pungi.checks
+    import pungi.detail_log
+    import pungi.linker
 
     if not pungi.checks.check(conf):
         sys.exit(1)
@@ -344,11 +346,19 @@ def main():
         for fp in glob.glob(compose.paths.work.pkgset_reuse_file("*")):
             os.unlink(fp)
         raise
+    finally:
+        # Stop linking threads and write buffered per-file events, which are
+        # most useful when the compose fails. This is a no-op if run_compose
+        # closed both already.
+        pungi.linker.close_link_service(compose)
+        pungi.detail_log.close_detail_logs(compose)
 
 
 def run_compose(
     compose, create_latest_link=True, latest_link_status=None, latest_link_components=-1
 ):
+    import pungi.detail_log
+    import pungi.linker
     import pungi.phases
     import pungi.metadata
     import pungi.util
@@ -484,6 +494,9 @@ def run_compose(
     pkgset_phase.start()
     pkgset_phase.stop()
 
+    # Worker processes must be forked before the parallel phases start.
+    gather_phase.start_processes()
+
     # WEAVER phase - launches other phases which can safely run in parallel
     essentials_schema = (
         buildinstall_phase,
@@ -549,6 +562,9 @@ def run_compose(
     test_phase.start()
     test_phase.stop()
 
+    pungi.linker.close_link_service(compose)
+    pungi.detail_log.close_detail_logs(compose)
+
     compose.write_status("FINISHED")
     osbs_phase.request_push()
     latest_link = False
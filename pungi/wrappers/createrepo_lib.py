@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+"""
+Creating repodata with createrepo_c Python bindings as an alternative to
+running the createrepo_c command.
+
+The command reads metadata of the package set repository given by
+``--update-md-path`` again for each variant repo created from it. Here the
+metadata of each package set repository is loaded only once and shared by all
+variant repos. Only packages missing from it are read from the RPM files.
+Primary, filelists and other metadata are written and compressed in parallel.
+
+Alternatively the repodata can be sliced from the package set repository.
+Its metadata files are streamed and records of packages in the new repo are
+copied with a new location. No RPM is read and the whole metadata is never
+held in memory.
+
+Delta RPMs and extra arguments for createrepo are not supported, the command
+has to be used for them.
+"""
+
+import gzip
+import multiprocessing.pool
+import os
+import re
+import shutil
+import threading
+import time
+import xml.sax.saxutils
+
+import createrepo_c as cr
+
+# Same as the default of createrepo_c.
+CHANGELOG_LIMIT = 10
+# Version of the SQLite databases, yum ignores databases with other versions.
+DB_VERSION = 10
+
+# (metadata type, XML file class, SQLite database class, parser)
+METADATA_TYPES = (
+    ("primary", cr.PrimaryXmlFile, cr.PrimarySqlite, cr.xml_parse_primary),
+    ("filelists", cr.FilelistsXmlFile, cr.FilelistsSqlite, cr.xml_parse_filelists),
+    ("other", cr.OtherXmlFile, cr.OtherSqlite, cr.xml_parse_other),
+)
+
+
+class MetadataCache(object):
+    """Metadata of packages in existing repositories, looked up by file name
+    of the package. Each repository is loaded on first use and kept until
+    the cache is dropped.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._repos = {}  # {path: cr.Metadata}
+        self._locks = {}  # {path: threading.Lock}
+        self._lock = threading.Lock()
+
+    def get_repo(self, path):
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+        # Different repositories can be loaded in parallel.
+        with lock:
+            if path not in self._repos:
+                md = cr.Metadata(key=cr.HT_KEY_FILENAME)
+                md.locate_and_load_xml(path)
+                self._repos[path] = md
+            return self._repos[path]
+
+    def get_package(self, path, file_name, checksum):
+        """Return a copy of metadata of the package from the repository at
+        given path, or None if it's not there or uses different checksum type.
+        """
+        pkg = self.get_repo(path).get(file_name)
+        with self._lock:
+            if pkg is None or pkg.checksum_type != checksum:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pkg.copy()
+
+
+class MetadataWriter(object):
+    """XML file and optionally SQLite database of one metadata type."""
+
+    def __init__(self, repodata, md_type, xml_cls, db_cls, num_of_pkgs, db_comp):
+        self.md_type = md_type
+        self.db_comp = db_comp
+        self.xml_path = os.path.join(repodata, "%s.xml.gz" % md_type)
+        self.db_path = os.path.join(repodata, "%s.sqlite" % md_type)
+        self.xml = xml_cls(self.xml_path)
+        self.xml.set_num_of_pkgs(num_of_pkgs)
+        self.db = db_cls(self.db_path) if db_comp is not None else None
+
+    def add_pkg(self, pkg):
+        self.xml.add_pkg(pkg)
+        if self.db:
+            self.db.add_pkg(pkg)
+
+    def close(self, checksum):
+        """Finish the files and return list of repomd records for them."""
+        self.xml.close()
+        record = cr.RepomdRecord(self.md_type, self.xml_path)
+        record.fill(checksum)
+        records = [record]
+        if self.db:
+            self.db.dbinfo_update(record.checksum)
+            self.db.close()
+            db_record = cr.RepomdRecord("%s_db" % self.md_type, self.db_path)
+            db_record = db_record.compress_and_fill(checksum, self.db_comp)
+            db_record.db_ver = DB_VERSION
+            records.append(db_record)
+            os.remove(self.db_path)
+        return records
+
+
+def _write_metadata(repodata, md_type, xml_cls, db_cls, packages, checksum, db_comp):
+    """Write XML and optionally SQLite database of one metadata type. Returns
+    list of repomd records.
+    """
+    writer = MetadataWriter(repodata, md_type, xml_cls, db_cls, len(packages), db_comp)
+    for pkg in packages:
+        writer.add_pkg(pkg)
+    return writer.close(checksum)
+
+
+def _run_in_threads(func, jobs):
+    """Call func for each job in parallel and return list of results."""
+    pool = multiprocessing.pool.ThreadPool(len(jobs))
+    try:
+        return pool.map(func, jobs)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _prepare_repodata(repo_dir):
+    """Create an empty directory for new repodata."""
+    tmp_repodata = os.path.join(repo_dir, ".repodata")
+    if os.path.exists(tmp_repodata):
+        shutil.rmtree(tmp_repodata)
+    os.makedirs(tmp_repodata)
+    return tmp_repodata
+
+
+def _finish_repodata(repo_dir, tmp_repodata, records, checksum, groupfile):
+    """Write repomd.xml and replace current repodata of the repo."""
+    if groupfile:
+        records.extend(_write_group(tmp_repodata, groupfile, checksum))
+
+    repomd = cr.Repomd()
+    repomd.set_revision(str(int(time.time())))
+    for record in records:
+        record.rename_file()
+        repomd.set_record(record)
+    repomd.sort_records()
+    with open(os.path.join(tmp_repodata, "repomd.xml"), "w") as f:
+        f.write(repomd.xml_dump())
+
+    repodata = os.path.join(repo_dir, "repodata")
+    if os.path.exists(repodata):
+        shutil.rmtree(repodata)
+    os.rename(tmp_repodata, repodata)
+
+
+def _get_db_compression(database, use_xz):
+    if not database:
+        return None
+    return cr.XZ if use_xz else cr.BZ2
+
+
+def _write_group(repodata, groupfile, checksum):
+    path = os.path.join(repodata, "comps.xml")
+    shutil.copy2(groupfile, path)
+    record = cr.RepomdRecord("group", path)
+    record.fill(checksum)
+    compressed = record.compress_and_fill(checksum, cr.GZ)
+    compressed.type = "group_gz"
+    return [record, compressed]
+
+
+def create_repo(
+    repo_dir,
+    pkglist,
+    checksum="sha256",
+    database=True,
+    groupfile=None,
+    use_xz=False,
+    update_md_path=None,
+    cache=None,
+):
+    """Create repodata for packages in the given directory, similar to
+    ``createrepo_c --update --skip-stat --pkglist ... --update-md-path ...``.
+
+    :param str repo_dir: directory of the repository, the repodata
+        directory is replaced
+    :param list pkglist: paths of the packages relative to ``repo_dir``
+    :param str update_md_path: path to a repository with existing metadata
+        for the packages
+    :param MetadataCache cache: cache to look up the existing metadata in
+    :return: tuple (number of reused packages, number of read RPMs)
+    """
+    checksum_type = cr.checksum_type(checksum)
+    if update_md_path and cache is None:
+        cache = MetadataCache()
+
+    reused = 0
+    packages = []
+    for rel_path in pkglist:
+        pkg = None
+        if update_md_path:
+            pkg = cache.get_package(
+                update_md_path, os.path.basename(rel_path), checksum
+            )
+        if pkg is None:
+            pkg = cr.package_from_rpm(
+                os.path.join(repo_dir, rel_path),
+                checksum_type,
+                rel_path,
+                None,
+                CHANGELOG_LIMIT,
+            )
+        else:
+            reused += 1
+        pkg.location_href = rel_path
+        pkg.location_base = None
+        packages.append(pkg)
+
+    tmp_repodata = _prepare_repodata(repo_dir)
+    db_comp = _get_db_compression(database, use_xz)
+
+    def write(args):
+        return _write_metadata(tmp_repodata, *args)
+
+    jobs = [
+        (md_type, xml_cls, db_cls, packages, checksum_type, db_comp)
+        for md_type, xml_cls, db_cls, _ in METADATA_TYPES
+    ]
+    records = [record for result in _run_in_threads(write, jobs) for record in result]
+    _finish_repodata(repo_dir, tmp_repodata, records, checksum_type, groupfile)
+    return reused, len(packages) - reused
+
+
+def _get_metadata_paths(repo_path):
+    """Return dict mapping metadata type to path of the file."""
+    repomd = cr.Repomd(os.path.join(repo_path, "repodata", "repomd.xml"))
+    return dict(
+        (rec.type, os.path.join(repo_path, rec.location_href)) for rec in repomd.records
+    )
+
+
+def _read_missing(repo_dir, locations, checksum_type):
+    return [
+        cr.package_from_rpm(
+            os.path.join(repo_dir, location),
+            checksum_type,
+            location,
+            None,
+            CHANGELOG_LIMIT,
+        )
+        for location in sorted(locations.values())
+    ]
+
+
+def slice_repo(
+    repo_dir,
+    pkglist,
+    source_repo,
+    checksum="sha256",
+    database=True,
+    groupfile=None,
+    use_xz=False,
+):
+    """Create repodata for packages in the given directory by copying their
+    records from the metadata of the source repository. Packages are matched
+    by file name. Packages missing in the source repository are read from the
+    RPM files.
+
+    Without databases the XML of the packages is copied as text. SQLite
+    databases need parsed packages, so the records are parsed when databases
+    are requested.
+
+    :param str repo_dir: directory of the repository, the repodata
+        directory is replaced
+    :param list pkglist: paths of the packages relative to ``repo_dir``
+    :param str source_repo: path to the repository to copy metadata from
+    :return: tuple (number of copied packages, number of read RPMs)
+    """
+    checksum_type = cr.checksum_type(checksum)
+    # file name -> location in the new repo
+    locations = dict((os.path.basename(path), path) for path in pkglist)
+    paths = _get_metadata_paths(source_repo)
+    tmp_repodata = _prepare_repodata(repo_dir)
+
+    if database or not all(paths[t].endswith(".gz") for t, _, _, _ in METADATA_TYPES):
+        records, copied, read = _slice_packages(
+            repo_dir,
+            tmp_repodata,
+            paths,
+            locations,
+            checksum,
+            _get_db_compression(database, use_xz),
+        )
+    else:
+        records, copied, read = _slice_xml(
+            repo_dir, tmp_repodata, paths, locations, checksum
+        )
+    _finish_repodata(repo_dir, tmp_repodata, records, checksum_type, groupfile)
+    return copied, read
+
+
+def _slice_packages(repo_dir, tmp_repodata, paths, locations, checksum, db_comp):
+    """Slice the metadata by parsing it into packages."""
+    checksum_type = cr.checksum_type(checksum)
+    # Primary metadata is read first, other types of metadata don't contain
+    # file names, so the packages are found there by their checksums. Only
+    # records of matching packages are kept.
+    packages = []
+    pkg_ids = set()
+
+    def select(pkg):
+        file_name = os.path.basename(pkg.location_href)
+        if (
+            file_name in locations
+            and pkg.pkgId not in pkg_ids
+            and pkg.checksum_type == checksum
+        ):
+            pkg.location_href = locations.pop(file_name)
+            pkg.location_base = None
+            packages.append(pkg)
+            pkg_ids.add(pkg.pkgId)
+        return True
+
+    cr.xml_parse_primary(paths["primary"], None, select, None, True)
+    missing = _read_missing(repo_dir, locations, checksum_type)
+    num_of_pkgs = len(packages) + len(missing)
+
+    def write(args):
+        md_type, xml_cls, db_cls, parser = args
+        writer = MetadataWriter(
+            tmp_repodata, md_type, xml_cls, db_cls, num_of_pkgs, db_comp
+        )
+        if md_type == "primary":
+            for pkg in packages:
+                writer.add_pkg(pkg)
+        else:
+            written = set()
+
+            def newpkgcb(pkg_id, name, arch):
+                # Returning None makes the parser skip the package.
+                if pkg_id in pkg_ids and pkg_id not in written:
+                    written.add(pkg_id)
+                    return cr.Package()
+                return None
+
+            def pkgcb(pkg):
+                writer.add_pkg(pkg)
+                return True
+
+            parser(paths[md_type], newpkgcb, pkgcb, None)
+        for pkg in missing:
+            writer.add_pkg(pkg)
+        return writer.close(checksum_type)
+
+    records = [
+        record for result in _run_in_threads(write, METADATA_TYPES) for record in result
+    ]
+    return records, len(packages), len(missing)
+
+
+# Size of blocks the XML is read in.
+XML_BLOCK_SIZE = 1024 * 1024
+_PACKAGE_START = b"<package"
+_PACKAGE_END = b"</package>"
+_PACKAGES_COUNT_RE = re.compile(b'packages="[0-9]+"')
+_LOCATION_RE = re.compile(b"<location [^>]*/>")
+_HREF_RE = re.compile(b'href="([^"]*)"')
+_PRIMARY_PKGID_RE = re.compile(b'<checksum type="([^"]*)" pkgid="YES">([^<]*)<')
+_PKGID_RE = re.compile(b'<package pkgid="([^"]*)"')
+# Functions creating XML of a package for each metadata type.
+XML_DUMPERS = {
+    "primary": cr.xml_dump_primary,
+    "filelists": cr.xml_dump_filelists,
+    "other": cr.xml_dump_other,
+}
+
+
+def _iter_xml_packages(path):
+    """Read gzip compressed XML metadata and yield its header, text of each
+    package element and the rest after the last package.
+    """
+    with gzip.open(path, "rb") as f:
+        buf = b""
+        header = None
+        while True:
+            data = f.read(XML_BLOCK_SIZE)
+            buf += data
+            pos = 0
+            if header is None:
+                pos = buf.find(_PACKAGE_START)
+                if pos < 0:
+                    if data:
+                        continue
+                    # No packages at all, the rest is the closing tag.
+                    pos = buf.rfind(b"</")
+                    pos = len(buf) if pos < 0 else pos
+                header = buf[:pos]
+                yield header
+            while True:
+                end = buf.find(_PACKAGE_END, pos)
+                if end < 0:
+                    break
+                end += len(_PACKAGE_END)
+                yield buf[pos:end].strip()
+                pos = end
+            buf = buf[pos:]
+            if not data:
+                break
+        yield buf.strip()
+
+
+def _slice_xml(repo_dir, tmp_repodata, paths, locations, checksum):
+    """Slice the metadata by copying the XML of the packages as text."""
+    checksum_type = cr.checksum_type(checksum)
+    primary = _iter_xml_packages(paths["primary"])
+    primary_header = next(primary)
+    packages = []
+    pkg_ids = set()
+    footer = b""
+    for elem in primary:
+        if not elem.startswith(_PACKAGE_START):
+            footer = elem
+            break
+        location = _LOCATION_RE.search(elem)
+        match = _PRIMARY_PKGID_RE.search(elem)
+        if not location or not match:
+            continue
+        href = xml.sax.saxutils.unescape(
+            _HREF_RE.search(location.group(0)).group(1).decode("utf-8")
+        )
+        file_name = os.path.basename(href)
+        pkg_id = match.group(2)
+        if (
+            file_name in locations
+            and pkg_id not in pkg_ids
+            and match.group(1).decode("utf-8") == checksum
+        ):
+            new_location = b'<location href="%s"/>' % xml.sax.saxutils.escape(
+                locations.pop(file_name), {'"': "&quot;"}
+            ).encode("utf-8")
+            packages.append(
+                elem[: location.start()] + new_location + elem[location.end() :]
+            )
+            pkg_ids.add(pkg_id)
+    missing = _read_missing(repo_dir, locations, checksum_type)
+    count = b'packages="%d"' % (len(packages) + len(missing))
+
+    def write(args):
+        md_type = args[0]
+        path = os.path.join(tmp_repodata, "%s.xml.gz" % md_type)
+        f = cr.CrFile(path, cr.MODE_WRITE, cr.GZ)
+        end = b""
+        try:
+            if md_type == "primary":
+                f.write(_PACKAGES_COUNT_RE.sub(count, primary_header, 1))
+                for elem in packages:
+                    f.write(elem + b"\n")
+                end = footer
+            else:
+                written = set()
+                elems = _iter_xml_packages(paths[md_type])
+                f.write(_PACKAGES_COUNT_RE.sub(count, next(elems), 1))
+                for elem in elems:
+                    if not elem.startswith(_PACKAGE_START):
+                        end = elem
+                        break
+                    match = _PKGID_RE.match(elem)
+                    if match and match.group(1) in pkg_ids:
+                        if match.group(1) not in written:
+                            written.add(match.group(1))
+                            f.write(elem + b"\n")
+            for pkg in missing:
+                f.write(XML_DUMPERS[md_type](pkg).encode("utf-8"))
+            f.write(end + b"\n")
+        finally:
+            f.close()
+        record = cr.RepomdRecord(md_type, path)
+        record.fill(checksum_type)
+        return record
+
+    records = _run_in_threads(write, METADATA_TYPES)
+    return records, len(packages), len(missing)
@@ -16,6 +16,7 @@
 
 import os
 import re
+import sys
 import time
 import threading
 import contextlib
@@ -23,7 +24,7 @@ import contextlib
 import koji
 from kobo.shortcuts import run, force_list
 import six
-from six.moves import configparser, shlex_quote
+from six.moves import configparser, queue, shlex_quote
 import six.moves.xmlrpc_client as xmlrpclib
 
 from .. import util
@@ -61,6 +62,7 @@ class KojiWrapper(object):
                 value = getattr(self.koji_module.config, key, None)
                 if value is not None:
                     session_opts[key] = value
+            self.session_opts = session_opts
             self.koji_proxy = koji.ClientSession(
                 self.koji_module.config.server, session_opts
             )
@@ -848,6 +850,110 @@ class KojiWrapper(object):
         """
         return self.multicall_map(*args, **kwargs)
 
+    def _new_session(self):
+        return koji.ClientSession(self.koji_module.config.server, self.session_opts)
+
+    def _close_session(self, session):
+        session.logout()
+        # Anonymous sessions are not logged in, so logout() does not close
+        # the underlying connection.
+        rsession = getattr(session, "rsession", None)
+        if rsession is not None:
+            rsession.close()
+
+    def iter_multicall_map(self, method, list_of_args=None, list_of_kwargs=None):
+        """
+        Chunked version of retrying_multicall_map. The calls are split into
+        chunks of ``koji_multicall_chunk_size`` calls, and up to
+        ``koji_multicall_threads`` chunks are sent at the same time, each
+        using a separate anonymous session. A failed chunk is retried on its
+        own.
+
+        Yields tuples (index, result) as the chunks finish, where index is
+        the position of the call in the input lists. If any chunk fails even
+        after retrying, no more chunks are started and the error is raised.
+
+        :param str method: Name of the KojiSession method to call.
+        :param list list_of_args: List of args which are passed to each call.
+        :param list list_of_kwargs: List of kwargs which are passed to each
+            call.
+        """
+        if list_of_args is None and list_of_kwargs is None:
+            raise ValueError("One of list_of_args or list_of_kwargs must be set.")
+        count = len(list_of_args if list_of_args is not None else list_of_kwargs)
+        chunk_size = int(self.compose.conf.get("koji_multicall_chunk_size", 1000))
+        num_threads = int(self.compose.conf.get("koji_multicall_threads", 4))
+
+        def _slice(items, start):
+            return items[start : start + chunk_size] if items is not None else None
+
+        chunks = queue.Queue()
+        for start in range(0, count, chunk_size):
+            chunks.put(
+                (start, _slice(list_of_args, start), _slice(list_of_kwargs, start))
+            )
+        num_chunks = chunks.qsize()
+        finished = queue.Queue()
+        failed = threading.Event()
+
+        def worker():
+            session = None
+            try:
+                session = self._new_session()
+                while not failed.is_set():
+                    try:
+                        start, args, kwargs = chunks.get_nowait()
+                    except queue.Empty:
+                        return
+                    results = self.retrying_multicall_map(
+                        session,
+                        getattr(session, method),
+                        list_of_args=args,
+                        list_of_kwargs=kwargs,
+                    )
+                    if results is None:
+                        raise ValueError(
+                            "Empty response returned for multicall of method %r"
+                            % method
+                        )
+                    finished.put((start, results, None))
+            except Exception:
+                failed.set()
+                finished.put((None, None, sys.exc_info()))
+            finally:
+                if session is not None:
+                    self._close_session(session)
+
+        for _ in range(min(num_threads, num_chunks)):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        try:
+            for _ in range(num_chunks):
+                start, results, exc_info = finished.get()
+                if exc_info:
+                    six.reraise(*exc_info)
+                for idx, result in enumerate(results):
+                    yield start + idx, result
+        finally:
+            # Stop the workers also when the caller does not consume all
+            # results.
+            failed.set()
+
+    def chunked_multicall_map(self, method, list_of_args=None, list_of_kwargs=None):
+        """
+        Same as iter_multicall_map, but waits for all chunks and returns list
+        of results sorted the same way as the input args/kwargs.
+        """
+        results = {}
+        for idx, result in self.iter_multicall_map(
+            method, list_of_args=list_of_args, list_of_kwargs=list_of_kwargs
+        ):
+            results[idx] = result
+        count = len(list_of_args if list_of_args is not None else list_of_kwargs)
+        return [results.get(idx) for idx in range(count)]
+
     def save_task_id(self, task_id):
         """Save task id by creating a file using task_id as file name
 
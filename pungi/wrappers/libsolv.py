@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+"""
+Depsolving with libsolv Python bindings as an alternative to running fus.
+
+Running fus means loading all repositories from disk again for each iteration
+of the hybrid gather method. A session here loads the repositories into a
+libsolv pool once and keeps it. Sessions are shared by all variants using the
+same repositories on the same arch.
+
+Modules are not supported, the hybrid method has to use fus for modular
+content.
+"""
+
+import os
+import threading
+
+import createrepo_c as cr
+
+from pungi.util import as_local_file
+from pungi.wrappers.fus import _prep_path
+
+try:
+    import solv
+except ImportError:
+    solv = None
+
+
+class SolverSession(object):
+    """Pool with repositories loaded for one arch. Use get_session to obtain
+    an instance. Repositories are loaded on first use. Only one thread can use
+    the session at a time.
+    """
+
+    def __init__(self, arch, repos, lookasides):
+        self.arch = arch
+        self.repos = repos
+        self.lookasides = lookasides
+        self.lock = threading.Lock()
+        self.pool = None
+        # Names of libsolv repos created for lookasides.
+        self.lookaside_names = set()
+        # Set to True if any repo contains module metadata.
+        self.modular = False
+
+    def load(self):
+        with self.lock:
+            if self.pool is not None:
+                return
+            if solv is None:
+                raise RuntimeError("libsolv Python bindings are not available")
+            pool = solv.Pool()
+            pool.setarch(self.arch)
+            # Same as with fus, if a package is in both a lookaside and a
+            # regular repo, the lookaside one wins.
+            for idx, path in enumerate(self.lookasides):
+                name = "lookaside-%s" % idx
+                self._load_repo(pool, name, path).priority = 1
+                self.lookaside_names.add(name)
+            for idx, path in enumerate(self.repos):
+                self._load_repo(pool, "repo-%s" % idx, path)
+            pool.addfileprovides()
+            pool.createwhatprovides()
+            self.pool = pool
+
+    def _load_repo(self, pool, name, path):
+        path = _prep_path(path)
+        repo = pool.add_repo(name)
+        with as_local_file(os.path.join(path, "repodata/repomd.xml")) as url_:
+            records = dict(
+                (rec.type, rec.location_href) for rec in cr.Repomd(url_).records
+            )
+        if "modules" in records:
+            self.modular = True
+        for md_type, flags in [
+            ("primary", 0),
+            ("filelists", solv.Repo.REPO_EXTEND_SOLVABLES),
+        ]:
+            with as_local_file(os.path.join(path, records[md_type])) as url_:
+                f = solv.xfopen(url_)
+                try:
+                    repo.add_rpmmd(f, None, flags)
+                finally:
+                    f.close()
+        return repo
+
+    def solve(self, packages, filter_packages=None):
+        """Find packages needed to install the given ones. Packages are
+        specified as names, names with arch or NEVRAs. Filtered packages are
+        name globs optionally with arch, matching packages from lookasides are
+        not filtered.
+
+        Returns a set of tuples (NVR, arch, flags) like fus.parse_output,
+        packages from lookaside repos are not included. Second returned value
+        is a list of messages describing inputs that could not be installed.
+        """
+        with self.lock:
+            jobs = []
+            for pattern in filter_packages or []:
+                sel = self._select(pattern, solv.Selection.SELECTION_GLOB)
+                for s in sel.solvables():
+                    if s.repo.name not in self.lookaside_names:
+                        jobs.append(
+                            self.pool.Job(
+                                solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, s.id
+                            )
+                        )
+
+            problems = []
+            for pkg in packages:
+                sel = self._select(pkg, solv.Selection.SELECTION_CANON)
+                if sel.isempty():
+                    problems.append("No match for %s" % pkg)
+                    continue
+                # Weak jobs are dropped when they can't be satisfied, the rest
+                # is still resolved.
+                jobs += sel.jobs(solv.Job.SOLVER_INSTALL | solv.Job.SOLVER_WEAK)
+
+            solver = self.pool.Solver()
+            problems.extend(str(problem) for problem in solver.solve(jobs))
+
+            result = set()
+            for s in solver.transaction().newsolvables():
+                if s.repo.name in self.lookaside_names:
+                    continue
+                result.add(("%s-%s" % (s.name, s.evr), s.arch, frozenset()))
+            return result, problems
+
+    def _select(self, pattern, flags):
+        return self.pool.select(
+            pattern,
+            solv.Selection.SELECTION_NAME | solv.Selection.SELECTION_DOTARCH | flags,
+        )
+
+
+# (arch, repos, lookasides) -> SolverSession
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(arch, repos, lookasides):
+    """Return a session with the given repos loaded. The same session is
+    returned for the same arguments until close_sessions is called.
+    """
+    key = (arch, tuple(repos), tuple(lookasides))
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = SolverSession(arch, list(repos), list(lookasides))
+        session = _sessions[key]
+    # Loading happens outside of the global lock, so that sessions for
+    # different arches can be loaded in parallel.
+    session.load()
+    return session
+
+
+def close_sessions():
+    """Drop all sessions and return how many there were."""
+    with _sessions_lock:
+        count = len(_sessions)
+        _sessions.clear()
+        return count
@@ -14,8 +14,11 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import json
 import os
 import re
+import subprocess
+import threading
 
 from .. import util
 
@@ -336,3 +339,67 @@ class PungiWrapper(object):
                     if flags_str:
                         flags_str = "(%s)" % flags_str
                     f.write("SRPM%s: %s\n" % (flags_str, line["path"]))
+
+
+class GatherServer(object):
+    """A pungi-gather process in server mode. Requests are processed one at a
+    time. The process keeps repos loaded between requests, so it's only
+    useful if the requests use the same repos.
+    """
+
+    def __init__(self, tempdir, logfile):
+        self.log = open(logfile, "a")
+        self.proc = subprocess.Popen(
+            ["pungi-gather", "--server", "--tempdir=%s" % tempdir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.log,
+            universal_newlines=True,
+        )
+        self.lock = threading.Lock()
+
+    def run(self, args, output):
+        """Run pungi-gather with given arguments (without the executable
+        name). The output is written to given file, same as with a separate
+        process.
+        """
+        request = json.dumps({"args": args, "output": output})
+        with self.lock:
+            self.proc.stdin.write(request + "\n")
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError("pungi-gather server exited with %s" % self.proc.poll())
+        reply = json.loads(line)
+        if reply["status"] != "ok":
+            raise RuntimeError(
+                "pungi-gather failed: %s (see %s)" % (reply["error"], output)
+            )
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.log.close()
+
+
+# arch -> GatherServer
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_gather_server(arch, tempdir, logfile):
+    """Return a server for the given arch, starting it if needed."""
+    with _servers_lock:
+        if arch not in _servers:
+            _servers[arch] = GatherServer(tempdir, logfile)
+        return _servers[arch]
+
+
+def close_gather_servers():
+    """Stop all running servers and return how many there were."""
+    with _servers_lock:
+        servers = list(_servers.values())
+        _servers.clear()
+    for server in servers:
+        server.close()
+    return len(servers)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import mock
+
+from pungi.cache_db import CacheDatabase
+from tests import helpers
+
+
+class TestCacheDatabase(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestCacheDatabase, self).setUp()
+        self.db = CacheDatabase(os.path.join(self.topdir, "cache.db"))
+        self.db.execute("CREATE TABLE items (key TEXT PRIMARY KEY, value TEXT)")
+
+    def tearDown(self):
+        self.db.close()
+        super(TestCacheDatabase, self).tearDown()
+
+    def test_queries(self):
+        self.db.execute("INSERT INTO items VALUES (?, ?)", ("a", "1"))
+        self.db.executemany("INSERT INTO items VALUES (?, ?)", [("b", "2"), ("c", "3")])
+
+        self.assertEqual(
+            self.db.execute("SELECT value FROM items WHERE key = ?", ("b",)), ("2",)
+        )
+        self.assertIsNone(self.db.execute("SELECT value FROM items WHERE key = 'x'"))
+        self.assertEqual(
+            sorted(self.db.fetchall("SELECT key, value FROM items")),
+            [("a", "1"), ("b", "2"), ("c", "3")],
+        )
+
+    def test_connection_is_reused(self):
+        conn = self.db._get_connection()
+        self.db.execute("SELECT * FROM items")
+
+        self.assertIs(self.db._get_connection(), conn)
+
+    def test_new_connection_after_fork(self):
+        conn = self.db._get_connection()
+
+        with mock.patch("os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(self.db._get_connection(), conn)
+            self.assertEqual(self.db.fetchall("SELECT * FROM items"), [])
@@ -14,6 +14,8 @@ import shutil
 import json
 
 from pungi.compose import Compose
+from pungi.phases.pkgset.common import populate_arch_pkgsets
+from pungi.phases.pkgset.pkgsets import PackageSetBase
 
 
 class ConfigWrapper(dict):
@@ -79,6 +81,43 @@ class ComposeTestCase(unittest.TestCase):
         with open(exclude_arch_log) as f:
             self.assertTrue(msg in f.read())
 
+    @mock.patch("pungi.compose.ComposeInfo")
+    def test_excluding_arch_log(self, ci):
+        conf = {
+            "pkgset_exclusive_arch_considers_noarch": True,
+            "multilib": [],
+        }
+        logger = logging.getLogger("test_excluding_arch_log")
+        logger.setLevel(logging.DEBUG)
+        compose = Compose(conf, self.tmp_dir, logger=logger)
+        pungi_log = logger.handlers[0].stream.name
+        exclude_arch_log = logger.handlers[1].stream.name
+
+        pkgset = PackageSetBase("global", [None], logger=logger)
+        pkgset.rpms_by_arch["noarch"] = [
+            mock.Mock(
+                file_path="/rpms/grub2-2.06-1.fc35.noarch.rpm",
+                file_name="grub2-2.06-1.fc35.noarch.rpm",
+                sourcerpm="grub2-2.06-1.fc35.src.rpm",
+                excludearch=[],
+                exclusivearch=["x86_64"],
+            )
+        ]
+        with mock.patch.object(compose, "get_arches", return_value=["i386"]):
+            populate_arch_pkgsets(compose, pkgset)
+
+        with open(exclude_arch_log) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("Populating package set for arch: i386", lines[0])
+        self.assertIn(
+            "Excluding (EXCLUDEARCH: [], EXCLUSIVEARCH: ['x86_64']): "
+            "grub2-2.06-1.fc35.noarch.rpm from i386",
+            lines[1],
+        )
+        with open(pungi_log) as f:
+            self.assertNotIn("Excluding", f.read())
+
     @mock.patch("pungi.compose.ComposeInfo")
     def test_can_fail(self, ci):
         conf = {
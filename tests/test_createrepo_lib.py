@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import createrepo_c as cr
+import mock
+
+from pungi.wrappers import createrepo_lib
+from tests import helpers
+
+
+def make_package(path, checksum_type, location_href, location_base, limit):
+    pkg = cr.Package()
+    pkg.name = os.path.basename(path).split("-")[0]
+    pkg.epoch = "0"
+    pkg.version = "1.0"
+    pkg.release = "1"
+    pkg.arch = "x86_64"
+    pkg.pkgId = "checksum-%s" % pkg.name
+    pkg.checksum_type = "sha256"
+    pkg.location_href = location_href
+    pkg.summary = pkg.description = pkg.name
+    pkg.files = [("", "/usr/bin/", pkg.name)]
+    pkg.changelogs = [("Author <author@example.com>", 1, "- Change")]
+    return pkg
+
+
+def load_repo(path):
+    md = cr.Metadata(key=cr.HT_KEY_FILENAME)
+    md.locate_and_load_xml(path)
+    return dict((key, md.get(key)) for key in md.keys())
+
+
+def get_record_types(path):
+    repomd = cr.Repomd(os.path.join(path, "repodata/repomd.xml"))
+    return dict((rec.type, rec) for rec in repomd.records)
+
+
+@mock.patch("createrepo_c.package_from_rpm", new=make_package)
+class TestCreateRepo(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestCreateRepo, self).setUp()
+        self.pkgset_repo = os.path.join(self.topdir, "pkgset")
+        self.repo = os.path.join(self.topdir, "repo")
+        os.makedirs(self.repo)
+
+    def test_create_repo_from_rpms(self):
+        result = createrepo_lib.create_repo(
+            self.pkgset_repo, ["Packages/bash-1.0-1.x86_64.rpm"]
+        )
+
+        self.assertEqual(result, (0, 1))
+        packages = load_repo(self.pkgset_repo)
+        self.assertEqual(list(packages), ["bash-1.0-1.x86_64.rpm"])
+        pkg = packages["bash-1.0-1.x86_64.rpm"]
+        self.assertEqual(pkg.location_href, "Packages/bash-1.0-1.x86_64.rpm")
+        self.assertEqual(pkg.files, [(None, "/usr/bin/", "bash")])
+        records = get_record_types(self.pkgset_repo)
+        self.assertEqual(
+            sorted(records),
+            [
+                "filelists",
+                "filelists_db",
+                "other",
+                "other_db",
+                "primary",
+                "primary_db",
+            ],
+        )
+        self.assertTrue(records["primary_db"].location_href.endswith(".sqlite.bz2"))
+        self.assertEqual(records["primary_db"].db_ver, createrepo_lib.DB_VERSION)
+        self.assertFalse(os.path.exists(os.path.join(self.pkgset_repo, ".repodata")))
+
+    def test_reuse_existing_metadata(self):
+        createrepo_lib.create_repo(
+            self.pkgset_repo,
+            ["Packages/bash-1.0-1.x86_64.rpm", "Packages/vim-1.0-1.x86_64.rpm"],
+        )
+        cache = createrepo_lib.MetadataCache()
+
+        with mock.patch("createrepo_c.package_from_rpm") as package_from_rpm:
+            package_from_rpm.side_effect = make_package
+            result = createrepo_lib.create_repo(
+                self.repo,
+                ["../Packages/bash-1.0-1.x86_64.rpm", "Packages/zsh-1.0-1.x86_64.rpm"],
+                database=False,
+                update_md_path=self.pkgset_repo,
+                cache=cache,
+            )
+
+        self.assertEqual(result, (1, 1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(package_from_rpm.call_args_list), 1)
+        packages = load_repo(self.repo)
+        self.assertEqual(
+            sorted((pkg.location_href, pkg.pkgId) for pkg in packages.values()),
+            [
+                ("../Packages/bash-1.0-1.x86_64.rpm", "checksum-bash"),
+                ("Packages/zsh-1.0-1.x86_64.rpm", "checksum-zsh"),
+            ],
+        )
+        self.assertEqual(
+            packages["bash-1.0-1.x86_64.rpm"].changelogs,
+            [("Author <author@example.com>", 1, "- Change")],
+        )
+        self.assertEqual(
+            sorted(get_record_types(self.repo)), ["filelists", "other", "primary"]
+        )
+
+    def test_replace_repodata_with_groupfile(self):
+        createrepo_lib.create_repo(self.repo, ["Packages/bash-1.0-1.x86_64.rpm"])
+        groupfile = os.path.join(self.topdir, "comps.xml")
+        helpers.touch(groupfile, "<comps/>\n")
+
+        createrepo_lib.create_repo(
+            self.repo,
+            ["Packages/bash-1.0-1.x86_64.rpm"],
+            groupfile=groupfile,
+            use_xz=True,
+        )
+
+        records = get_record_types(self.repo)
+        self.assertIn("group", records)
+        self.assertTrue(records["group"].location_href.endswith("-comps.xml"))
+        self.assertTrue(records["group_gz"].location_href.endswith("-comps.xml.gz"))
+        self.assertTrue(records["primary_db"].location_href.endswith(".sqlite.xz"))
+        # Files of the previous repodata are removed.
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.repo, "repodata"))), len(records) + 1
+        )
+
+
+class TestSliceRepo(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestSliceRepo, self).setUp()
+        patcher = mock.patch("createrepo_c.package_from_rpm", new=make_package)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pkgset_repo = os.path.join(self.topdir, "pkgset")
+        self.repo = os.path.join(self.topdir, "repo")
+        os.makedirs(self.repo)
+        createrepo_lib.create_repo(
+            self.pkgset_repo,
+            [
+                "Packages/bash-1.0-1.x86_64.rpm",
+                "Packages/vim-1.0-1.x86_64.rpm",
+                "Packages/zsh-1.0-1.x86_64.rpm",
+            ],
+        )
+
+    def test_slice_repo(self):
+        with mock.patch("createrepo_c.package_from_rpm") as package_from_rpm:
+            result = createrepo_lib.slice_repo(
+                self.repo,
+                [
+                    "../pkgset/Packages/bash-1.0-1.x86_64.rpm",
+                    "Packages/zsh-1.0-1.x86_64.rpm",
+                ],
+                self.pkgset_repo,
+            )
+
+        self.assertEqual(result, (2, 0))
+        self.assertEqual(package_from_rpm.call_args_list, [])
+        packages = load_repo(self.repo)
+        self.assertEqual(
+            sorted((pkg.location_href, pkg.pkgId) for pkg in packages.values()),
+            [
+                ("../pkgset/Packages/bash-1.0-1.x86_64.rpm", "checksum-bash"),
+                ("Packages/zsh-1.0-1.x86_64.rpm", "checksum-zsh"),
+            ],
+        )
+        for pkg in packages.values():
+            self.assertEqual(pkg.files, [(None, "/usr/bin/", pkg.name)])
+            self.assertEqual(
+                pkg.changelogs, [("Author <author@example.com>", 1, "- Change")]
+            )
+        self.assertEqual(
+            sorted(get_record_types(self.repo)),
+            [
+                "filelists",
+                "filelists_db",
+                "other",
+                "other_db",
+                "primary",
+                "primary_db",
+            ],
+        )
+
+    def test_slice_repo_with_missing_package(self):
+        result = createrepo_lib.slice_repo(
+            self.repo,
+            ["Packages/bash-1.0-1.x86_64.rpm", "Packages/tcsh-1.0-1.x86_64.rpm"],
+            self.pkgset_repo,
+            database=False,
+        )
+
+        self.assertEqual(result, (1, 1))
+        packages = load_repo(self.repo)
+        self.assertEqual(
+            sorted(packages), ["bash-1.0-1.x86_64.rpm", "tcsh-1.0-1.x86_64.rpm"]
+        )
+        self.assertEqual(packages["tcsh-1.0-1.x86_64.rpm"].files[0][2], "tcsh")
+        self.assertEqual(
+            sorted(get_record_types(self.repo)), ["filelists", "other", "primary"]
+        )
+
+    def test_slice_repo_without_database(self):
+        with mock.patch("createrepo_c.package_from_rpm") as package_from_rpm:
+            result = createrepo_lib.slice_repo(
+                self.repo,
+                ["../pkgset/Packages/vim-1.0-1.x86_64.rpm"],
+                self.pkgset_repo,
+                database=False,
+            )
+
+        self.assertEqual(result, (1, 0))
+        self.assertEqual(package_from_rpm.call_args_list, [])
+        packages = load_repo(self.repo)
+        self.assertEqual(list(packages), ["vim-1.0-1.x86_64.rpm"])
+        pkg = packages["vim-1.0-1.x86_64.rpm"]
+        self.assertEqual(pkg.location_href, "../pkgset/Packages/vim-1.0-1.x86_64.rpm")
+        self.assertEqual(pkg.pkgId, "checksum-vim")
+        self.assertEqual(pkg.files, [(None, "/usr/bin/", "vim")])
+        self.assertEqual(
+            pkg.changelogs, [("Author <author@example.com>", 1, "- Change")]
+        )
+        self.assertEqual(
+            sorted(get_record_types(self.repo)), ["filelists", "other", "primary"]
+        )
+
+    def test_slice_repo_without_database_with_missing_package(self):
+        createrepo_lib.slice_repo(
+            self.repo,
+            ["Packages/bash-1.0-1.x86_64.rpm", "Packages/tcsh-1.0-1.x86_64.rpm"],
+            self.pkgset_repo,
+            database=False,
+        )
+
+        packages = load_repo(self.repo)
+        self.assertEqual(
+            sorted(packages), ["bash-1.0-1.x86_64.rpm", "tcsh-1.0-1.x86_64.rpm"]
+        )
+        self.assertEqual(packages["tcsh-1.0-1.x86_64.rpm"].files[0][2], "tcsh")
+        self.assertEqual(packages["bash-1.0-1.x86_64.rpm"].files[0][2], "bash")
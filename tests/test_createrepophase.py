@@ -14,6 +14,7 @@ import six
 from pungi.phases.createrepo import (
     CreaterepoPhase,
     create_variant_repo,
+    get_rpms_index,
     get_productids_from_scm,
     ModulesMetadata,
 )
@@ -68,6 +69,8 @@ class TestCreaterepoPhase(PungiTestCase):
 
         pool = ThreadPoolCls.return_value
 
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
         phase = CreaterepoPhase(compose)
         phase.run()
 
@@ -104,6 +107,8 @@ class TestCreaterepoPhase(PungiTestCase):
 
         pool = ThreadPoolCls.return_value
 
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
         phase = CreaterepoPhase(compose)
         phase.run()
         self.maxDiff = None
@@ -136,6 +141,8 @@ class TestCreaterepoPhase(PungiTestCase):
             self.topdir, {"createrepo_extra_modulemd": {"Server": scm}}
         )
 
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
         phase = CreaterepoPhase(compose)
         phase.run()
 
@@ -144,6 +151,82 @@ class TestCreaterepoPhase(PungiTestCase):
             [mock.call(scm, os.path.join(compose.topdir, "work/global/tmp-Server"))],
         )
 
+    @mock.patch("pungi.checks.get_num_cpus")
+    @mock.patch("pungi.phases.createrepo.ThreadPool")
+    def test_shares_rpms_index(self, ThreadPoolCls, get_num_cpus):
+        get_num_cpus.return_value = 2
+        compose = DummyCompose(self.topdir, {})
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        pool = ThreadPoolCls.return_value
+
+        phase = CreaterepoPhase(compose)
+        phase.run()
+
+        threads = [call[1][0] for call in pool.add.mock_calls]
+        self.assertEqual(len(threads), 2)
+        for thread in threads:
+            self.assertIs(thread.rpms_index, phase.rpms_index)
+        self.assertEqual(
+            phase.rpms_index[("Server", "x86_64", "binary")],
+            set(["Server/x86_64/os/Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"]),
+        )
+
+
+class TestGetRpmsIndex(PungiTestCase):
+    def test_index(self):
+        compose = DummyCompose(self.topdir, {})
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        index = get_rpms_index(compose)
+
+        self.assertEqual(
+            index,
+            {
+                ("Server", "x86_64", "binary"): set(
+                    ["Server/x86_64/os/Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"]
+                ),
+                ("Server", "x86_64", "debug"): set(
+                    [
+                        "Server/x86_64/debug/tree/Packages/b/"
+                        "bash-debuginfo-4.3.30-2.fc21.x86_64.rpm"
+                    ]
+                ),
+                ("Server", "x86_64", "source"): set(
+                    ["Server/source/tree/Packages/b/bash-4.3.30-2.fc21.src.rpm"]
+                ),
+                ("Server", "amd64", "binary"): set(
+                    ["Server/amd64/os/Packages/b/bash-4.3.30-2.fc21.amd64.rpm"]
+                ),
+                ("Server", "amd64", "debug"): set(
+                    [
+                        "Server/amd64/debug/tree/Packages/b/"
+                        "bash-debuginfo-4.3.30-2.fc21.amd64.rpm"
+                    ]
+                ),
+                ("Server", "amd64", "source"): set(
+                    ["Server/source/tree/Packages/b/bash-4.3.30-2.fc21.src.rpm"]
+                ),
+                ("Server", None, "binary"): set(
+                    [
+                        "Server/x86_64/os/Packages/b/bash-4.3.30-2.fc21.x86_64.rpm",
+                        "Server/amd64/os/Packages/b/bash-4.3.30-2.fc21.amd64.rpm",
+                    ]
+                ),
+                ("Server", None, "debug"): set(
+                    [
+                        "Server/x86_64/debug/tree/Packages/b/"
+                        "bash-debuginfo-4.3.30-2.fc21.x86_64.rpm",
+                        "Server/amd64/debug/tree/Packages/b/"
+                        "bash-debuginfo-4.3.30-2.fc21.amd64.rpm",
+                    ]
+                ),
+                ("Server", None, "source"): set(
+                    ["Server/source/tree/Packages/b/bash-4.3.30-2.fc21.src.rpm"]
+                ),
+            },
+        )
+
 
 def make_mocked_modifyrepo_cmd(tc, module_artifacts):
     def mocked_modifyrepo_cmd(repodir, mmd_path, **kwargs):
@@ -216,6 +299,32 @@ class TestCreateVariantRepo(PungiTestCase):
         self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
 
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_rpms_with_index(self, CreaterepoWrapperCls, run):
+        compose = DummyCompose(self.topdir, {"createrepo_checksum": "sha256"})
+        compose.has_comps = False
+        rpms_index = {
+            ("Server", "x86_64", "binary"): set(
+                ["Server/x86_64/os/Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"]
+            ),
+        }
+
+        create_variant_repo(
+            compose,
+            "x86_64",
+            compose.variants["Server"],
+            "rpm",
+            self.pkgset,
+            rpms_index=rpms_index,
+        )
+
+        list_file = (
+            self.topdir + "/work/x86_64/repo_package_list/Server.x86_64.rpm.conf"
+        )
+        self.assertEqual(len(run.mock_calls), 1)
+        self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
+
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_rpms_without_database(self, CreaterepoWrapperCls, run):
@@ -487,6 +596,114 @@ class TestCreateVariantRepo(PungiTestCase):
         self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
 
+    @mock.patch("pungi.phases.createrepo.createrepo_lib.create_repo")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_rpms_python_backend(
+        self, CreaterepoWrapperCls, run, create_repo
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {"createrepo_checksum": "sha256", "createrepo_backend": "python"},
+        )
+        compose.has_comps = False
+        create_repo.return_value = (1, 0)
+        cache = mock.Mock()
+
+        repo = CreaterepoWrapperCls.return_value
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        create_variant_repo(
+            compose,
+            "x86_64",
+            compose.variants["Server"],
+            "rpm",
+            self.pkgset,
+            metadata_cache=cache,
+        )
+
+        self.assertEqual(
+            create_repo.mock_calls,
+            [
+                mock.call(
+                    self.topdir + "/compose/Server/x86_64/os",
+                    ["Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"],
+                    checksum="sha256",
+                    database=True,
+                    groupfile=None,
+                    use_xz=False,
+                    update_md_path="/repo/x86_64",
+                    cache=cache,
+                )
+            ],
+        )
+        self.assertEqual(repo.get_createrepo_cmd.mock_calls, [])
+        self.assertEqual(run.mock_calls, [])
+
+    @mock.patch("pungi.phases.createrepo.createrepo_lib.slice_repo")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_source_slice_backend(
+        self, CreaterepoWrapperCls, run, slice_repo
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {"createrepo_checksum": "sha256", "createrepo_backend": "slice"},
+        )
+        compose.has_comps = False
+        slice_repo.return_value = (1, 0)
+
+        repo = CreaterepoWrapperCls.return_value
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        create_variant_repo(
+            compose, None, compose.variants["Server"], "srpm", self.pkgset
+        )
+
+        self.assertEqual(
+            slice_repo.mock_calls,
+            [
+                mock.call(
+                    self.topdir + "/compose/Server/source/tree",
+                    ["Packages/b/bash-4.3.30-2.fc21.src.rpm"],
+                    "/repo/global",
+                    checksum="sha256",
+                    database=True,
+                    groupfile=None,
+                    use_xz=False,
+                )
+            ],
+        )
+        self.assertEqual(repo.get_createrepo_cmd.mock_calls, [])
+        self.assertEqual(run.mock_calls, [])
+
+    @mock.patch("pungi.phases.createrepo.createrepo_lib.create_repo")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_python_backend_with_extra_args(
+        self, CreaterepoWrapperCls, run, create_repo
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {
+                "createrepo_checksum": "sha256",
+                "createrepo_backend": "python",
+                "createrepo_extra_args": ["--distro=RHEL-6,NULL"],
+            },
+        )
+        compose.has_comps = False
+
+        repo = CreaterepoWrapperCls.return_value
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        create_variant_repo(
+            compose, "x86_64", compose.variants["Server"], "rpm", self.pkgset
+        )
+
+        self.assertEqual(create_repo.mock_calls, [])
+        self.assertEqual(len(repo.get_createrepo_cmd.mock_calls), 1)
+        self.assertEqual(len(run.mock_calls), 1)
+
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_rpms_with_deltas(self, CreaterepoWrapperCls, run):
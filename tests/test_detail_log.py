@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+
+from pungi import detail_log
+from tests import helpers
+
+
+def read_events(path):
+    with gzip.open(path, "rb") as f:
+        return [json.loads(line) for line in f.read().decode("utf-8").splitlines()]
+
+
+class TestDetailLog(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestDetailLog, self).setUp()
+        self.path = os.path.join(self.topdir, "details.jsonl.gz")
+
+    def test_events_are_buffered(self):
+        log = detail_log.DetailLog(self.path, buffer_size=2)
+
+        log.record("hardlink", src="/a", dst="/b")
+        self.assertFalse(os.path.exists(self.path))
+
+        log.record("copy", src="/c", dst="/d")
+        log.record("copy", src="/e", dst="/f")
+        log.flush()
+
+        events = read_events(self.path)
+        self.assertEqual(
+            [(e["event"], e["src"], e["dst"]) for e in events],
+            [("hardlink", "/a", "/b"), ("copy", "/c", "/d"), ("copy", "/e", "/f")],
+        )
+        self.assertTrue(all("time" in e for e in events))
+
+    def test_flush_without_events(self):
+        log = detail_log.DetailLog(self.path)
+        log.flush()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestGetDetailLog(helpers.PungiTestCase):
+    def test_text_format(self):
+        compose = helpers.DummyCompose(self.topdir, {})
+        self.assertIsNone(detail_log.get_detail_log(compose, "linker"))
+
+    def test_jsonl_format(self):
+        compose = helpers.DummyCompose(self.topdir, {"hot_path_log_format": "jsonl"})
+        log = detail_log.get_detail_log(compose, "linker")
+
+        self.assertIs(detail_log.get_detail_log(compose, "linker"), log)
+        self.assertEqual(
+            log.path, os.path.join(self.topdir, "logs/global/linker.global.jsonl.gz")
+        )
+
+        log.record("hardlink", src="/a", dst="/b")
+        detail_log.close_detail_logs(compose)
+
+        self.assertEqual(len(read_events(log.path)), 1)
+        self.assertIsNot(detail_log.get_detail_log(compose, "linker"), log)
+        detail_log.close_detail_logs(compose)
@@ -19,7 +19,7 @@ from pungi.wrappers.pungi import PungiWrapper
 
 try:
     from pungi.dnf_wrapper import DnfWrapper, Conf
-    from pungi.gather_dnf import Gather, GatherOptions, PkgFlag
+    from pungi.gather_dnf import DepsCache, Gather, GatherOptions, PkgFlag
 
     HAS_DNF = True
 except ImportError:
@@ -2225,6 +2225,7 @@ class DNFDepsolvingTestCase(DepsolvingBase, unittest.TestCase):
         super(DNFDepsolvingTestCase, self).setUp()
         self.cachedir = os.path.join(self.tmp_dir, "pungi_dnf_cache")
         self.get_langpacks = False
+        self.deps_cache = None
 
         logger = logging.getLogger("gather_dnf")
         if not logger.handlers:
@@ -2255,7 +2256,7 @@ class DNFDepsolvingTestCase(DepsolvingBase, unittest.TestCase):
         _, conditional_packages = self.dnf.comps_wrapper.get_comps_packages(
             groups, exclude_groups
         )
-        self.g = Gather(self.dnf, GatherOptions(**kwargs))
+        self.g = Gather(self.dnf, GatherOptions(**kwargs), deps_cache=self.deps_cache)
 
         self.g.logger.handlers = [
             h for h in self.g.logger.handlers if h.name != "capture-logs"
@@ -2624,3 +2625,65 @@ class DNFDepsolvingTestCase(DepsolvingBase, unittest.TestCase):
             pkg_map["debuginfo"],
             ["dummy-bash-debuginfo-4.2.37-6.x86_64.rpm"],
         )
+
+
+@unittest.skipUnless(HAS_DNF, "Dependencies are not available")
+class DNFDepsolvingWithDepsCacheTestCase(DNFDepsolvingTestCase):
+    """Run each test twice with a shared cache of providers. The second run
+    uses a new sack, so only the persistent database is reused.
+    """
+
+    def go(self, packages, groups, lookaside=None, **kwargs):
+        path = os.path.join(self.tmp_dir, "deps-cache.db")
+        self.deps_cache = DepsCache("repo-state", path)
+        first = super(DNFDepsolvingWithDepsCacheTestCase, self).go(
+            packages, groups, lookaside, **kwargs
+        )
+        self.deps_cache = DepsCache("repo-state", path)
+        second = super(DNFDepsolvingWithDepsCacheTestCase, self).go(
+            packages, groups, lookaside, **kwargs
+        )
+        self.assertEqual(first, second)
+        return second
+
+
+@unittest.skipUnless(HAS_DNF, "Dependencies are not available")
+class TestDepsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_deps_cache_")
+        self.path = os.path.join(self.tmp_dir, "deps-cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_memory_only(self):
+        cache = DepsCache()
+        self.assertIsNone(cache.get("queues", False, "foo"))
+
+        cache.put("queues", False, "foo", ["b@repo", "a@repo"])
+        cache.flush()
+
+        self.assertEqual(cache.get("queues", False, "foo"), ["a@repo", "b@repo"])
+        self.assertIsNone(cache.get("queues", True, "foo"))
+
+    def test_rows_are_written_on_flush(self):
+        cache = DepsCache("repo-state", self.path)
+        cache.put("queues", False, "foo", ["a@repo"])
+
+        self.assertIsNone(
+            DepsCache("repo-state", self.path).get("queues", False, "foo")
+        )
+
+        cache.flush()
+
+        other = DepsCache("repo-state", self.path)
+        self.assertEqual(other.get("queues", False, "foo"), ["a@repo"])
+        self.assertIsNone(other.get("queues", False, "bar"))
+
+    def test_different_repo_state(self):
+        cache = DepsCache("repo-state", self.path)
+        cache.put("queues", False, "foo", ["a@repo"])
+        cache.flush()
+
+        other = DepsCache("other-state", self.path)
+        self.assertIsNone(other.get("queues", False, "foo"))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+
+import mock
+
+from pungi.phases.gather import lookaside_cache
+
+from tests import helpers
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="sha256">%s</checksum>
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PRIMARY = """<metadata xmlns="http://linux.duke.edu/metadata/common"
+  xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">
+%s</metadata>
+"""
+
+PACKAGE = """<package type="rpm">
+  <name>%(name)s</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="1.0" rel="1"/>
+  <checksum type="sha256" pkgid="YES">%(name)s</checksum>
+  <location href="Packages/%(name)s-1.0-1.x86_64.rpm"/>
+</package>
+"""
+
+
+class TestLookasideCache(helpers.PungiTestCase):
+    def make_repo(self, name, checksum, packages):
+        path = os.path.join(self.topdir, name)
+        helpers.touch(os.path.join(path, "repodata/repomd.xml"), REPOMD % checksum)
+        primary = PRIMARY % (
+            len(packages),
+            "".join(PACKAGE % {"name": pkg} for pkg in packages),
+        )
+        with gzip.open(os.path.join(path, "repodata/primary.xml.gz"), "wb") as f:
+            f.write(primary.encode("utf-8"))
+        return path
+
+    def test_reads_packages(self):
+        repo = self.make_repo("repo", "abc", ["foo", "bar"])
+        cache = lookaside_cache.LookasideCache()
+
+        self.assertEqual(
+            cache.get(repo), set(["foo-1.0-1.x86_64.rpm", "bar-1.0-1.x86_64.rpm"])
+        )
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    @mock.patch("pungi.phases.gather.lookaside_cache.read_package_names")
+    def test_reuses_by_checksum(self, read_package_names):
+        read_package_names.return_value = set(["foo.rpm"])
+        first = self.make_repo("first", "abc", [])
+        second = self.make_repo("second", "abc", [])
+        changed = self.make_repo("changed", "def", [])
+        cache = lookaside_cache.LookasideCache()
+
+        for repo in [first, second, first, changed]:
+            self.assertEqual(cache.get(repo), set(["foo.rpm"]))
+
+        self.assertEqual(
+            [c[0][0] for c in read_package_names.call_args_list], [first, changed]
+        )
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_persistent(self):
+        repo = self.make_repo("repo", "abc", ["foo"])
+        db = os.path.join(self.topdir, "cache.db")
+        lookaside_cache.LookasideCache(db).get(repo)
+
+        cache = lookaside_cache.LookasideCache(db)
+        with mock.patch(
+            "pungi.phases.gather.lookaside_cache.read_package_names"
+        ) as read_package_names:
+            self.assertEqual(cache.get(repo), set(["foo-1.0-1.x86_64.rpm"]))
+
+        self.assertEqual(read_package_names.call_args_list, [])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_shared_by_compose(self):
+        compose = helpers.DummyCompose(self.topdir, {})
+        self.assertIs(
+            lookaside_cache.get_lookaside_cache(compose),
+            lookaside_cache.get_lookaside_cache(compose),
+        )
@@ -3,6 +3,7 @@
 import mock
 
 from pungi.phases.gather.methods import method_deps as deps
+from pungi.phases.pkgset.store import PackageStat, PackageStore
 from tests import helpers
 
 
@@ -94,6 +95,59 @@ class TestWritePungiConfig(helpers.PungiTestCase):
             fulltree_excludes=fulltree,
         )
 
+    @mock.patch("pungi.phases.gather.methods.method_deps.PungiWrapper")
+    def test_package_record(self, PungiWrapper):
+        # Package sets created with pkgset_compact_store contain records, and
+        # modules add them to the packages as objects.
+        store = PackageStore()
+        pkg = store.add(
+            "/mnt/koji/pkg1-1.0-1.x86_64.rpm",
+            PackageStat(1, 1, 1024, 1234.5),
+            {
+                "name": "pkg1",
+                "version": "1.0",
+                "release": "1",
+                "epoch": None,
+                "arch": "x86_64",
+                "sourcerpm": "pkg1-1.0-1.src.rpm",
+                "signature": None,
+                "checksum_type": "sha256",
+                "excludearch": [],
+                "exclusivearch": [],
+                "requires": [],
+                "provides": [],
+                "is_source": False,
+                "is_system_release": False,
+            },
+        )
+        deps.write_pungi_config(
+            self.compose,
+            "x86_64",
+            self.compose.variants["Server"],
+            [(pkg, None), ("pkg2", "x86_64")],
+            [],
+            [],
+            [],
+            [],
+            package_sets=self.package_sets,
+        )
+        self.assertWritten(
+            PungiWrapper,
+            packages=["pkg1", "pkg2.x86_64"],
+            ks_path=self.topdir + "/work/x86_64/pungi/Server.x86_64.conf",
+            lookaside_repos={},
+            multilib_whitelist=[],
+            multilib_blacklist=[],
+            groups=[],
+            prepopulate=None,
+            repos={
+                "pungi-repo-0": self.topdir + "/work/x86_64/repo/p1",
+                "comps-repo": self.topdir + "/work/x86_64/comps_repo_Server",
+            },
+            exclude_packages=[],
+            fulltree_excludes=None,
+        )
+
     @mock.patch("pungi.phases.gather.get_lookaside_repos")
     @mock.patch("pungi.phases.gather.methods.method_deps.PungiWrapper")
     def test_with_lookaside(self, PungiWrapper, glr):
@@ -193,3 +247,62 @@ class TestCheckDeps(helpers.PungiTestCase):
                 )
             ],
         )
+
+
+class TestResolveDeps(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestResolveDeps, self).setUp()
+        self.compose = helpers.DummyCompose(
+            self.topdir, {"gather_backend": "dnf", "gather_dnf_server": True}
+        )
+        self.compose.has_comps = True
+
+    @mock.patch("pungi.phases.gather.methods.method_deps.run")
+    @mock.patch("pungi.phases.gather.methods.method_deps.get_gather_server")
+    def test_with_server(self, get_gather_server, run):
+        variant = self.compose.variants["Server"]
+        pungi_log = self.compose.paths.work.pungi_log("x86_64", variant)
+
+        def server_run(args, output):
+            with open(output, "w") as f:
+                f.write("RPM(input): /pkg-1.0-1.x86_64.rpm\n")
+
+        get_gather_server.return_value.run.side_effect = server_run
+
+        packages, broken_deps = deps.resolve_deps(self.compose, "x86_64", variant)
+
+        self.assertEqual(
+            packages["rpm"], [{"path": "/pkg-1.0-1.x86_64.rpm", "flags": ["input"]}]
+        )
+        self.assertEqual(broken_deps, {})
+        self.assertEqual(run.call_args_list, [])
+        self.assertEqual(
+            get_gather_server.call_args_list,
+            [
+                mock.call(
+                    "x86_64",
+                    self.compose.paths.work.tmp_dir("x86_64"),
+                    self.compose.paths.log.log_file("x86_64", "pungi-gather-server"),
+                )
+            ],
+        )
+        args, output = get_gather_server.return_value.run.call_args[0]
+        self.assertEqual(output, pungi_log)
+        self.assertIn("--arch=x86_64", args)
+        self.assertEqual(args[-1], "--comps-repo=comps-repo")
+
+    @mock.patch("pungi.phases.gather.methods.method_deps.run")
+    @mock.patch("pungi.phases.gather.methods.method_deps.get_gather_server")
+    def test_with_deps_cache(self, get_gather_server, run):
+        self.compose.conf["gather_dnf_server"] = False
+        self.compose.conf["gather_dnf_deps_cache"] = "/cache/deps.db"
+        variant = self.compose.variants["Server"]
+        pungi_log = self.compose.paths.work.pungi_log("x86_64", variant)
+        helpers.touch(pungi_log)
+
+        deps.resolve_deps(self.compose, "x86_64", variant)
+
+        self.assertEqual(get_gather_server.call_args_list, [])
+        cmd = run.call_args[0][0]
+        self.assertEqual(cmd[0], "pungi-gather")
+        self.assertIn("--deps-cache=/cache/deps.db", cmd)
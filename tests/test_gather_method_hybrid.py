@@ -8,6 +8,7 @@ import os
 import six
 
 from pungi.phases.gather.methods import method_hybrid as hybrid
+from pungi.phases.gather.solver_cache import SolverCache
 from pungi.phases.pkgset.common import MaterializedPackageSet as PkgSet
 from tests import helpers
 
@@ -87,6 +88,7 @@ class TestMethodHybrid(helpers.PungiTestCase):
                     glr.return_value,
                     m.run_solver.return_value[0],
                     filter_packages=[],
+                    lookaside_cache=mock.ANY,
                 )
             ],
         )
@@ -432,7 +434,6 @@ class TestRunSolver(HelperMixin, helpers.PungiTestCase):
 
     def test_with_comps(self, run, gc, po, wc):
         self.phase.packages = {"pkg-1.0-1.x86_64": mock.Mock()}
-        self.phase.debuginfo = {"x86_64": {}}
         po.return_value = ([("pkg-1.0-1", "x86_64", frozenset())], [])
         res = self.phase.run_solver(
             self.compose.variants["Server"],
@@ -472,6 +473,114 @@ class TestRunSolver(HelperMixin, helpers.PungiTestCase):
             ],
         )
 
+    def test_with_solver_cache(self, run, gc, po, wc):
+        self.phase.packages = {"pkg-1.0-1.x86_64": mock.Mock()}
+        self.phase.solver_cache = SolverCache(os.path.join(self.topdir, "cache.db"))
+        po.return_value = (set([("pkg-1.0-1", "x86_64", frozenset())]), set())
+
+        with mock.patch.object(
+            self.phase.solver_cache, "get_repo_checksum", return_value="abc"
+        ):
+            for _ in range(2):
+                res = self.phase.run_solver(
+                    self.compose.variants["Server"],
+                    "x86_64",
+                    [("pkg", None)],
+                    platform=None,
+                    filter_packages=[],
+                    cache_dir="/cache",
+                )
+                self.assertEqual(res, (po.return_value[0], set()))
+
+        self.assertEqual(len(run.call_args_list), 1)
+        self.assertEqual(
+            (self.phase.solver_cache.hits, self.phase.solver_cache.misses), (1, 1)
+        )
+        logfile = self.compose.paths.log.log_file(
+            "x86_64", "hybrid-depsolver-Server-iter-1"
+        )
+        with open(logfile) as f:
+            self.assertTrue(f.read().startswith("Result taken from solver cache "))
+
+    @mock.patch("pungi.wrappers.libsolv.get_session")
+    def test_with_libsolv(self, get_session, run, gc, po, wc):
+        self.compose.conf["gather_hybrid_solver"] = "libsolv"
+        self.phase.packages = {"pkg-1.0-1.x86_64": mock.Mock()}
+        session = get_session.return_value
+        session.modular = False
+        session.solve.return_value = (
+            set([("pkg-1.0-1", "x86_64", frozenset())]),
+            ["No match for bar"],
+        )
+
+        res = self.phase.run_solver(
+            self.compose.variants["Server"],
+            "x86_64",
+            [("pkg", None), ("bar", None)],
+            platform=None,
+            filter_packages=["foo"],
+            cache_dir="/cache",
+        )
+
+        self.assertEqual(res, (session.solve.return_value[0], set()))
+        self.assertEqual(
+            get_session.call_args_list, [mock.call("x86_64", ["/path/for/p1"], [])]
+        )
+        self.assertEqual(
+            session.solve.call_args_list, [mock.call(["bar", "pkg"], ["foo"])]
+        )
+        self.assertEqual(run.call_args_list, [])
+        self.assertEqual(wc.call_args_list, [])
+        with open(self.logfile1) as f:
+            self.assertEqual(
+                f.read(),
+                "Input:\n  bar\n  pkg\nProblems:\n  No match for bar\n"
+                "Result:\n  pkg-1.0-1.x86_64\n",
+            )
+
+    @mock.patch("pungi.wrappers.libsolv.get_session")
+    def test_libsolv_with_modules_uses_fus(self, get_session, run, gc, po, wc):
+        self.compose.conf["gather_hybrid_solver"] = "libsolv"
+        self.compose.variants["Server"].arch_mmds["x86_64"] = {
+            "mod:master": mock.Mock(
+                get_module_name=mock.Mock(return_value="mod"),
+                get_stream_name=mock.Mock(return_value="master"),
+            )
+        }
+        po.return_value = ([], ["m1"])
+
+        res = self.phase.run_solver(
+            self.compose.variants["Server"],
+            "x86_64",
+            [],
+            platform="pl",
+            filter_packages=[],
+            cache_dir="/cache",
+        )
+
+        self.assertEqual(res, (set(), set(["m1"])))
+        self.assertEqual(get_session.call_args_list, [])
+        self.assertEqual(len(run.call_args_list), 1)
+
+    @mock.patch("pungi.wrappers.libsolv.get_session")
+    def test_libsolv_with_modular_repo_uses_fus(self, get_session, run, gc, po, wc):
+        self.compose.conf["gather_hybrid_solver"] = "libsolv"
+        get_session.return_value.modular = True
+        po.return_value = ([], [])
+
+        self.phase.run_solver(
+            self.compose.variants["Server"],
+            "x86_64",
+            [],
+            platform=None,
+            filter_packages=[],
+            cache_dir="/cache",
+        )
+
+        self.assertEqual(len(get_session.call_args_list), 1)
+        self.assertEqual(len(run.call_args_list), 1)
+        self.assertEqual(get_session.return_value.solve.call_args_list, [])
+
     def test_with_comps_with_debuginfo(self, run, gc, po, wc):
         dbg1 = NamedMock(name="pkg-debuginfo", arch="x86_64", sourcerpm="pkg.src.rpm")
         dbg2 = NamedMock(name="pkg-debuginfo", arch="x86_64", sourcerpm="x.src.rpm")
@@ -482,9 +591,12 @@ class TestRunSolver(HelperMixin, helpers.PungiTestCase):
             "pkg-debuginfo-1.0-1.x86_64": dbg1,
             "pkg-debuginfo-1.0-2.x86_64": dbg2,
         }
-        self.phase.debuginfo = {
-            "x86_64": {"pkg-debuginfo": [dbg1, dbg2]},
-        }
+        self.phase.package_sets = [
+            PkgSet(
+                {"x86_64": mock.Mock(rpms_by_arch={"x86_64": [dbg1, dbg2]})},
+                {"x86_64": "/path/for/p1"},
+            )
+        ]
         po.side_effect = [
             ([("pkg-1.0-1", "x86_64", frozenset())], []),
             ([("pkg-debuginfo-1.0-1", "x86_64", frozenset())], []),
@@ -634,7 +746,6 @@ class TestRunSolver(HelperMixin, helpers.PungiTestCase):
             }
         }
         self.phase.packages = self.phase.package_maps["x86_64"]
-        self.phase.debuginfo = {"x86_64": {}}
         po.side_effect = [
             (
                 [
@@ -752,7 +863,6 @@ class TestRunSolver(HelperMixin, helpers.PungiTestCase):
                 "foo-1.0-1.i686": mock.Mock(),
             }
         }
-        self.phase.debuginfo = {"x86_64": {}}
         po.side_effect = [
             (
                 [
@@ -6,6 +6,7 @@ import os
 import six
 
 from pungi.phases.gather.methods import method_nodeps as nodeps
+from pungi.phases.pkgset.store import PackageRecord, PackageStat, PackageStore
 from tests import helpers
 
 COMPS_FILE = os.path.join(helpers.FIXTURE_DIR, "comps.xml")
@@ -30,3 +31,182 @@ class TestWritePungiConfig(helpers.PungiTestCase):
                 ("dummy-tftp", "x86_64"),
             ],
         )
+
+
+class MockPkg(object):
+    def __init__(self, nvra, sourcerpm=None):
+        self.file_path = "/mnt/%s.rpm" % nvra
+        self.file_name = os.path.basename(self.file_path)
+        nvr, self.arch = nvra.rsplit(".", 1)
+        self.name, self.version, self.release = nvr.rsplit("-", 2)
+        self.epoch = None
+        self.nevra = "%s-0:%s-%s.%s" % (
+            self.name,
+            self.version,
+            self.release,
+            self.arch,
+        )
+        self.sourcerpm = sourcerpm
+
+    def __repr__(self):
+        return self.file_name
+
+
+class MockPkgset(dict):
+    def __init__(self, *pkgs):
+        super(MockPkgset, self).__init__((pkg.file_path, pkg) for pkg in pkgs)
+
+
+class TestNameMatcher(helpers.PungiTestCase):
+    def test_match(self):
+        matcher = nodeps.NameMatcher(
+            ["bash", "python3-*", "*-devel", "lib*x", "gcc+", "kernel-(core|modules)"]
+        )
+
+        self.assertEqual(matcher.match("bash"), ["bash"])
+        self.assertEqual(matcher.match("bash-completion"), [])
+        six.assertCountEqual(
+            self, matcher.match("python3-devel"), ["python3-*", "*-devel"]
+        )
+        self.assertEqual(matcher.match("libx"), ["lib*x"])
+        self.assertEqual(matcher.match("libfoox"), ["lib*x"])
+        self.assertEqual(matcher.match("libfoo"), [])
+        self.assertEqual(matcher.match("gcc+"), ["gcc+"])
+        self.assertEqual(matcher.match("gcc"), [])
+        self.assertEqual(matcher.match("kernel-modules"), ["kernel-(core|modules)"])
+        self.assertEqual(matcher.match("kernel"), [])
+
+    def test_dot_is_not_wildcard(self):
+        matcher = nodeps.NameMatcher(["foo.bar*"])
+
+        self.assertEqual(matcher.match("foo.bar-baz"), ["foo.bar*"])
+        self.assertEqual(matcher.match("fooxbar"), [])
+
+
+class TestWorker(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestWorker, self).setUp()
+        self.compose = helpers.DummyCompose(self.topdir, {})
+        self.bash = self._make_pkg("bash-1.0-1.x86_64", "bash-1.0-1.src.rpm")
+        self.bash_i686 = self._make_pkg("bash-1.0-1.i686", "bash-1.0-1.src.rpm")
+        self.bash_doc = self._make_pkg("bash-doc-1.0-1.noarch", "bash-1.0-1.src.rpm")
+        self.bash_src = self._make_pkg("bash-1.0-1.src")
+        self.bash_debug = self._make_pkg(
+            "bash-debuginfo-1.0-1.x86_64", "bash-1.0-1.src.rpm"
+        )
+        self.bash_debug_i686 = self._make_pkg(
+            "bash-debuginfo-1.0-1.i686", "bash-1.0-1.src.rpm"
+        )
+        self.foo = self._make_pkg("foo-1.0-1.x86_64", "foo-1.0-1.src.rpm")
+        self.foo_debug = self._make_pkg(
+            "foo-debuginfo-1.0-1.x86_64", "foo-1.0-1.src.rpm"
+        )
+        self.package_sets = [
+            {
+                "x86_64": MockPkgset(
+                    self.bash,
+                    self.bash_i686,
+                    self.bash_doc,
+                    self.bash_src,
+                    self.bash_debug,
+                    self.bash_debug_i686,
+                    self.foo,
+                    self.foo_debug,
+                )
+            }
+        ]
+
+    def _make_pkg(self, nvra, sourcerpm=None):
+        return MockPkg(nvra, sourcerpm)
+
+    def _run(self, pkgs):
+        log = six.StringIO()
+        result = nodeps.GatherMethodNodeps(self.compose).worker(
+            log,
+            "x86_64",
+            self.compose.variants["Server"],
+            pkgs,
+            [],
+            [],
+            [],
+            [],
+            self.package_sets,
+        )
+        return dict(
+            (key, sorted(item["path"] for item in value))
+            for key, value in result.items()
+        )
+
+    def test_gather(self):
+        result = self._run(set([("bash*", "x86_64")]))
+
+        self.assertEqual(
+            result,
+            {
+                "rpm": sorted([self.bash.file_path, self.bash_doc.file_path]),
+                "srpm": [self.bash_src.file_path],
+                "debuginfo": [self.bash_debug.file_path],
+            },
+        )
+
+    def test_gather_multilib(self):
+        result = self._run(set([("bash", None)]))
+
+        self.assertEqual(
+            result,
+            {
+                "rpm": sorted([self.bash.file_path, self.bash_i686.file_path]),
+                "srpm": [self.bash_src.file_path],
+                "debuginfo": sorted(
+                    [self.bash_debug.file_path, self.bash_debug_i686.file_path]
+                ),
+            },
+        )
+
+    def test_noarch_does_not_pull_debuginfo(self):
+        result = self._run(set([("bash-doc", "x86_64")]))
+
+        self.assertEqual(
+            result,
+            {
+                "rpm": [self.bash_doc.file_path],
+                "srpm": [self.bash_src.file_path],
+                "debuginfo": [],
+            },
+        )
+
+    def test_gather_package_object(self):
+        # Modules add their RPMs as package objects rather than names.
+        result = self._run(set([(self.bash, None)]))
+
+        self.assertEqual(
+            result,
+            {
+                "rpm": [self.bash.file_path],
+                "srpm": [self.bash_src.file_path],
+                "debuginfo": [self.bash_debug.file_path],
+            },
+        )
+
+
+class TestWorkerCompactStore(TestWorker):
+    """Package sets created with pkgset_compact_store contain PackageRecord
+    objects instead of RPM wrappers.
+    """
+
+    def setUp(self):
+        self.store = PackageStore()
+        super(TestWorkerCompactStore, self).setUp()
+
+    def _make_pkg(self, nvra, sourcerpm=None):
+        pkg = MockPkg(nvra, sourcerpm)
+        pkg.signature = None
+        pkg.checksum_type = "sha256"
+        pkg.excludearch = pkg.exclusivearch = []
+        pkg.requires = pkg.provides = set()
+        pkg.is_source = pkg.arch == "src"
+        pkg.is_system_release = False
+        pkg.stat = PackageStat(1, 1, 1024, 1234.5)
+        record = self.store.copy(pkg)
+        self.assertIsInstance(record, PackageRecord)
+        return record
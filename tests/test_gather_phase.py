@@ -4,6 +4,7 @@ import copy
 import json
 import mock
 import os
+import threading
 
 try:
     import unittest2 as unittest
@@ -455,6 +456,150 @@ def _make_materialized_pkgsets(pkgsets):
     return [MaterializedPackageSet(pkgsets, {})]
 
 
+class TestGatherVariants(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestGatherVariants, self).setUp()
+        self.compose = helpers.DummyCompose(self.topdir, {"gather_num_threads": 5})
+        self.lock = threading.Lock()
+        self.started = []
+
+    def _gather(self, compose, arch, variant, package_sets, **kwargs):
+        with self.lock:
+            self.started.append("%s.%s" % (variant.uid, arch))
+        return _mk_pkg_map()
+
+    @mock.patch("pungi.phases.gather.gather_packages")
+    def test_independent_variants_run_in_parallel(self, gather_packages):
+        client_started = threading.Event()
+
+        def gather_packages_(compose, arch, variant, package_sets, **kwargs):
+            if variant.uid == "Client":
+                client_started.set()
+            else:
+                self.assertTrue(client_started.wait(5))
+            return self._gather(compose, arch, variant, package_sets)
+
+        gather_packages.side_effect = gather_packages_
+        result = {}
+
+        gather._gather_variants(result, self.compose, [])
+
+        six.assertCountEqual(
+            self,
+            self.started,
+            [
+                "Client.amd64",
+                "Everything.amd64",
+                "Everything.x86_64",
+                "Server.amd64",
+                "Server.x86_64",
+            ],
+        )
+        self.assertEqual(sorted(result), ["amd64", "x86_64"])
+        self.assertEqual(sorted(result["amd64"]), ["Client", "Everything", "Server"])
+
+    @mock.patch("pungi.phases.gather._update_config")
+    @mock.patch("pungi.phases.gather._make_lookaside_repo")
+    @mock.patch("pungi.phases.gather.gather_packages")
+    def test_waits_for_lookaside(self, gather_packages, make_repo, update_config):
+        self.compose.conf["variant_as_lookaside"] = [
+            ("Server", "Everything"),
+            ("Client", "Everything"),
+        ]
+        gather_packages.side_effect = self._gather
+        result = {}
+
+        def make_lookaside_repo(compose, variant, arch, pkg_map, package_sets):
+            self.assertIn("%s.%s" % (variant.uid, arch), self.started)
+            self.assertIn(variant.uid, pkg_map[arch])
+            return "/repo/%s/%s" % (variant.uid, arch)
+
+        make_repo.side_effect = make_lookaside_repo
+
+        gather._gather_variants(result, self.compose, [])
+
+        for variant in ["Server", "Client"]:
+            for arch in self.compose.variants[variant].arches:
+                self.assertGreater(
+                    self.started.index("%s.%s" % (variant, arch)),
+                    self.started.index("Everything.%s" % arch),
+                )
+        six.assertCountEqual(
+            self,
+            update_config.call_args_list,
+            [
+                mock.call(self.compose, "Server", "x86_64", "/repo/Everything/x86_64"),
+                mock.call(self.compose, "Server", "amd64", "/repo/Everything/amd64"),
+                mock.call(self.compose, "Client", "amd64", "/repo/Everything/amd64"),
+            ],
+        )
+
+    @mock.patch("pungi.phases.gather.gather_packages")
+    def test_child_waits_for_parent(self, gather_packages):
+        self.compose.setup_addon()
+        gather_packages.side_effect = self._gather
+        result = {}
+
+        gather._gather_variants(result, self.compose, [])
+
+        self.assertGreater(
+            self.started.index("Server-HA.x86_64"), self.started.index("Server.x86_64")
+        )
+        gather_packages.assert_any_call(
+            self.compose,
+            "x86_64",
+            self.compose.all_variants["Server-HA"],
+            [],
+            fulltree_excludes=set(),
+        )
+
+    @mock.patch("pungi.phases.gather.gather_packages")
+    def test_failure(self, gather_packages):
+        self.compose.traceback = mock.Mock()
+        gather_packages.side_effect = RuntimeError("Boom")
+
+        with self.assertRaises(RuntimeError):
+            gather._gather_variants({}, self.compose, [])
+
+        self.assertTrue(self.compose.log_error.called)
+        self.assertTrue(self.compose.traceback.called)
+
+    @mock.patch("pungi.phases.gather.gather_packages")
+    def test_run_in_processes(self, gather_packages):
+        self.compose.conf["gather_processes"] = True
+        self.compose.conf["gather_lookaside_repos"] = [("^Server$", {"*": "/repo"})]
+        pkgset = mock.Mock()
+
+        def gather_packages_(compose, arch, variant, package_sets, **kwargs):
+            self.assertEqual(package_sets, [pkgset])
+            return _mk_pkg_map(
+                rpm=[os.getpid()], srpm=compose.conf["gather_lookaside_repos"]
+            )
+
+        gather_packages.side_effect = gather_packages_
+        result = {}
+
+        pool = gather.start_gather_processes(self.compose, [pkgset])
+        try:
+            gather._gather_variants(result, self.compose, [pkgset], pool=pool)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        pkg_map = result["x86_64"]["Server"]
+        self.assertNotEqual(pkg_map["rpm"], [os.getpid()])
+        self.assertEqual(pkg_map["srpm"], [("^Server$", {"*": "/repo"})])
+        six.assertCountEqual(
+            self,
+            pkgset.get_index.call_args_list,
+            [
+                mock.call(arch, kind)
+                for arch in ["amd64", "x86_64"]
+                for kind in ["path", "nevra", "name", "name_arch", "sourcerpm"]
+            ],
+        )
+
+
 class TestGetSystemRelease(unittest.TestCase):
     def setUp(self):
         self.compose = mock.Mock()
@@ -1498,6 +1643,9 @@ class TestGatherPhase(helpers.PungiTestCase):
     @mock.patch("pungi.phases.gather.gather_wrapper")
     def test_run(self, gather_wrapper, link_files):
         pkgset_phase = mock.Mock()
+        pkgset = mock.Mock(index_sizes={("x86_64", "path"): 1024})
+        pkgset.free_indexes.return_value = 1024
+        pkgset_phase.package_sets = [pkgset]
         compose = helpers.DummyCompose(self.topdir, {})
         compose.notifier = mock.Mock()
         compose.all_variants["Client"].is_empty = True
@@ -1519,7 +1667,14 @@ class TestGatherPhase(helpers.PungiTestCase):
 
         self.assertEqual(
             gather_wrapper.call_args_list,
-            [mock.call(compose, pkgset_phase.package_sets, pkgset_phase.path_prefix)],
+            [
+                mock.call(
+                    compose,
+                    pkgset_phase.package_sets,
+                    pkgset_phase.path_prefix,
+                    pool=None,
+                )
+            ],
         )
         six.assertCountEqual(
             self,
@@ -1536,6 +1691,122 @@ class TestGatherPhase(helpers.PungiTestCase):
                 os.path.join(self.topdir, "compose", "metadata", "rpms.json")
             )
         )
+        pkgset.free_indexes.assert_called_once_with()
+
+    @mock.patch("pungi.phases.gather.link_files")
+    @mock.patch("pungi.phases.gather.gather_wrapper")
+    def test_run_waits_for_all_link_batches(self, gather_wrapper, link_files):
+        pkgset_phase = mock.Mock(package_sets=[])
+        compose = helpers.DummyCompose(self.topdir, {})
+        batches = []
+
+        def _link_files(*args, **kwargs):
+            batch = mock.Mock()
+            if len(batches) in (0, 2):
+                batch.wait.side_effect = RuntimeError("error %d" % len(batches))
+            batches.append(batch)
+            return batch
+
+        link_files.side_effect = _link_files
+
+        phase = gather.GatherPhase(compose, pkgset_phase)
+        with self.assertRaises(RuntimeError) as ctx:
+            phase.run()
+
+        self.assertEqual(str(ctx.exception), "error 0")
+        self.assertEqual(len(batches), 5)
+        for batch in batches:
+            batch.wait.assert_called_once_with()
+        self.assertFalse(
+            os.path.isfile(
+                os.path.join(self.topdir, "compose", "metadata", "rpms.json")
+            )
+        )
+
+    @mock.patch("pungi.phases.gather.link_files")
+    @mock.patch("pungi.phases.gather.gather_wrapper")
+    def test_run_waits_for_submitted_batches(self, gather_wrapper, link_files):
+        pkgset_phase = mock.Mock(package_sets=[])
+        compose = helpers.DummyCompose(self.topdir, {})
+        batch = mock.Mock()
+        link_files.side_effect = [batch, OSError("submit failed")]
+
+        phase = gather.GatherPhase(compose, pkgset_phase)
+        with self.assertRaises(OSError):
+            phase.run()
+
+        batch.wait.assert_called_once_with()
+
+    @mock.patch("pungi.phases.gather.get_solver_cache")
+    @mock.patch("pungi.phases.gather.link_files")
+    @mock.patch("pungi.phases.gather.gather_wrapper")
+    def test_run_reports_solver_cache(self, gather_wrapper, link_files, gsc):
+        gsc.return_value = mock.Mock(hits=3, misses=2)
+        pkgset_phase = mock.Mock(package_sets=[])
+        compose = helpers.DummyCompose(self.topdir, {})
+
+        phase = gather.GatherPhase(compose, pkgset_phase)
+        phase.run()
+
+        compose.log_debug.assert_any_call(
+            "Hybrid solver cache: %s hits, %s misses", 3, 2
+        )
+
+    @mock.patch("pungi.phases.gather.start_gather_processes")
+    def test_start_processes_disabled(self, start_gather_processes):
+        compose = helpers.DummyCompose(self.topdir, {})
+
+        phase = gather.GatherPhase(compose, mock.Mock())
+        phase.start_processes()
+
+        self.assertIsNone(phase._process_pool)
+        self.assertEqual(start_gather_processes.call_args_list, [])
+
+    @mock.patch("pungi.phases.gather._join_other_threads", return_value=[])
+    @mock.patch("pungi.linker.close_link_service")
+    @mock.patch("pungi.phases.gather.start_gather_processes")
+    @mock.patch("pungi.phases.gather.link_files")
+    @mock.patch("pungi.phases.gather.gather_wrapper")
+    def test_start_processes(
+        self, gather_wrapper, link_files, start_gather_processes, close, join
+    ):
+        pkgset_phase = mock.Mock(package_sets=[])
+        compose = helpers.DummyCompose(self.topdir, {"gather_processes": True})
+        compose.just_phases = None
+        compose.skip_phases = []
+        pool = start_gather_processes.return_value
+
+        phase = gather.GatherPhase(compose, pkgset_phase)
+        phase.start_processes()
+        phase.run()
+
+        close.assert_called_once_with(compose)
+        start_gather_processes.assert_called_once_with(compose, [])
+        self.assertEqual(
+            gather_wrapper.call_args_list,
+            [mock.call(compose, [], pkgset_phase.path_prefix, pool=pool)],
+        )
+        pool.terminate.assert_called_once_with()
+        self.assertIsNone(phase._process_pool)
+
+    @mock.patch("pungi.phases.gather._join_other_threads")
+    @mock.patch("pungi.linker.close_link_service")
+    @mock.patch("pungi.phases.gather.start_gather_processes")
+    def test_start_processes_with_other_threads(
+        self, start_gather_processes, close, join
+    ):
+        join.return_value = [mock.Mock()]
+        join.return_value[0].name = "buildinstall"
+        compose = helpers.DummyCompose(self.topdir, {"gather_processes": True})
+        compose.just_phases = None
+        compose.skip_phases = []
+
+        phase = gather.GatherPhase(compose, mock.Mock())
+        with self.assertRaises(RuntimeError) as ctx:
+            phase.start_processes()
+
+        self.assertIn("buildinstall", str(ctx.exception))
+        self.assertEqual(start_gather_processes.call_args_list, [])
 
     @mock.patch("pungi.phases.gather.link_files")
     @mock.patch("pungi.phases.gather.gather_wrapper")
@@ -1581,6 +1852,33 @@ class TestGatherPhase(helpers.PungiTestCase):
         phase = gather.GatherPhase(compose, pkgset_phase)
         phase.validate()
 
+    def test_validates_processes_with_gather_server(self):
+        compose = helpers.DummyCompose(
+            self.topdir, {"gather_processes": True, "gather_dnf_server": True}
+        )
+        phase = gather.GatherPhase(compose, mock.Mock())
+        with self.assertRaises(ValueError) as ctx:
+            phase.validate()
+
+        self.assertIn(
+            "gather_dnf_server can not be used with gather_processes",
+            str(ctx.exception),
+        )
+
+    @mock.patch("pungi.wrappers.libsolv.solv", new=mock.Mock())
+    def test_validates_processes_with_libsolv(self):
+        compose = helpers.DummyCompose(
+            self.topdir, {"gather_processes": True, "gather_hybrid_solver": "libsolv"}
+        )
+        phase = gather.GatherPhase(compose, mock.Mock())
+        with self.assertRaises(ValueError) as ctx:
+            phase.validate()
+
+        self.assertEqual(
+            str(ctx.exception),
+            "Using libsolv in hybrid solver is not possible with gather_processes.",
+        )
+
 
 class TestGetPackagesToGather(helpers.PungiTestCase):
     def setUp(self):
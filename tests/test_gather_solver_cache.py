@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from pungi.phases.gather.solver_cache import SolverCache, get_solver_cache
+
+from tests import helpers
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>%(revision)s</revision>
+  <data type="primary">
+    <checksum type="sha256">%(primary)s</checksum>
+    <open-checksum type="sha256">%(primary)s-open</open-checksum>
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+  <data type="other">
+    <checksum type="sha256">%(revision)s</checksum>
+    <location href="repodata/other.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+
+class TestSolverCache(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestSolverCache, self).setUp()
+        self.cache = SolverCache(os.path.join(self.topdir, "cache.db"))
+
+    def make_repo(self, name, primary, revision="1"):
+        path = os.path.join(self.topdir, name)
+        helpers.touch(
+            os.path.join(path, "repodata/repomd.xml"),
+            REPOMD % {"primary": primary, "revision": revision},
+        )
+        return path
+
+    def get_key(self, repos, lookasides, **kwargs):
+        inputs = {
+            "packages": ["foo", "bar"],
+            "modules": [],
+            "platform": None,
+            "filter_packages": ["baz"],
+        }
+        inputs.update(kwargs)
+        return self.cache.get_key("fus", "x86_64", repos, lookasides, **inputs)
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+    def test_store_and_load(self):
+        packages = set(
+            [
+                ("foo-1.0-1", "x86_64", frozenset()),
+                ("bar-1.0-1", "noarch", frozenset(["modular"])),
+            ]
+        )
+        self.cache.put("key", packages, set(["mod:1:2:3"]))
+
+        other = SolverCache(self.cache.path)
+        self.assertEqual(other.get("key"), (packages, set(["mod:1:2:3"])))
+        self.assertEqual((other.hits, other.misses), (1, 0))
+
+    def test_key_ignores_timestamps_and_input_order(self):
+        repo = self.make_repo("repo", "abc", revision="1")
+        key = self.get_key([repo], [])
+
+        other = SolverCache(self.cache.path)
+        repo = self.make_repo("other", "abc", revision="2")
+        self.assertEqual(
+            other.get_key(
+                "fus",
+                "x86_64",
+                [repo],
+                [],
+                packages=["bar", "foo"],
+                modules=[],
+                platform=None,
+                filter_packages=["baz"],
+            ),
+            key,
+        )
+
+    def test_key_changes_with_content(self):
+        repo = self.make_repo("repo", "abc")
+        lookaside = self.make_repo("lookaside", "def")
+        changed = self.make_repo("changed", "xyz")
+        key = self.get_key([repo], [lookaside])
+
+        self.assertNotEqual(self.get_key([changed], [lookaside]), key)
+        self.assertNotEqual(self.get_key([repo], [changed]), key)
+        self.assertNotEqual(self.get_key([lookaside], [repo]), key)
+        self.assertNotEqual(self.get_key([repo], [lookaside], packages=["foo"]), key)
+        self.assertNotEqual(self.get_key([repo], [lookaside], platform="f30"), key)
+        self.assertNotEqual(self.get_key([repo], [lookaside], modules=["m:s"]), key)
+        self.assertNotEqual(self.get_key([repo], [lookaside], filter_packages=[]), key)
+
+    def test_not_configured(self):
+        compose = helpers.DummyCompose(self.topdir, {})
+        self.assertIsNone(get_solver_cache(compose))
+
+    def test_shared_by_compose(self):
+        compose = helpers.DummyCompose(
+            self.topdir,
+            {"gather_hybrid_solver_cache": os.path.join(self.topdir, "shared.db")},
+        )
+        self.assertIs(get_solver_cache(compose), get_solver_cache(compose))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import json
+import koji
 import mock
 
 try:
@@ -367,6 +368,95 @@ class KojiWrapperTest(KojiWrapperBaseTestCase):
         self.koji.koji_proxy.multiCall.assert_called_with(strict=True)
         self.assertEqual(ret, [1, 2])
 
+    def _mock_sessions(self, ClientSession, fail=()):
+        sessions = []
+
+        def new_session(server, opts):
+            session = mock.Mock()
+            sessions.append(session)
+            calls = []
+            session.getBuild.side_effect = lambda arg: calls.append(arg)
+
+            def multicall(strict):
+                result = [[arg * 10] for arg in calls]
+                del calls[:]
+                if set(result[0]) & set(fail):
+                    raise koji.GenericError("Boom")
+                return result
+
+            session.multiCall.side_effect = multicall
+            return session
+
+        new_session.sessions = sessions
+        ClientSession.side_effect = new_session
+
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_chunked_multicall_map(self, ClientSession):
+        self._mock_sessions(ClientSession)
+        self.koji.compose.conf["koji_multicall_chunk_size"] = 2
+        self.koji.compose.conf["koji_multicall_threads"] = 2
+
+        ret = self.koji.chunked_multicall_map("getBuild", [1, 2, 3, 4, 5])
+
+        self.assertEqual(ret, [10, 20, 30, 40, 50])
+        # A thread can reuse a session released by a thread that finished.
+        self.assertLessEqual(len(ClientSession.mock_calls), 2)
+
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_iter_multicall_map_yields_indexes(self, ClientSession):
+        self._mock_sessions(ClientSession)
+        self.koji.compose.conf["koji_multicall_chunk_size"] = 2
+
+        ret = self.koji.iter_multicall_map("getBuild", [1, 2, 3])
+
+        six.assertCountEqual(self, ret, [(0, 10), (1, 20), (2, 30)])
+
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_chunked_multicall_map_closes_sessions(self, ClientSession):
+        self._mock_sessions(ClientSession)
+        self.koji.compose.conf["koji_multicall_chunk_size"] = 1
+        self.koji.compose.conf["koji_multicall_threads"] = 2
+
+        self.koji.chunked_multicall_map("getBuild", [1, 2, 3])
+
+        self.assertEqual(len(ClientSession.mock_calls), 2)
+        for session in ClientSession.side_effect.sessions:
+            session.logout.assert_called_once_with()
+            session.rsession.close.assert_called_once_with()
+
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_chunked_multicall_map_session_failure(self, ClientSession):
+        ClientSession.side_effect = RuntimeError("Boom")
+        self.koji.compose.conf["koji_multicall_threads"] = 2
+
+        with self.assertRaises(RuntimeError):
+            self.koji.chunked_multicall_map("getBuild", [1, 2])
+
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_chunked_multicall_map_empty_response(self, ClientSession):
+        ClientSession.return_value.multiCall.return_value = []
+
+        with self.assertRaises(ValueError):
+            self.koji.chunked_multicall_map("getBuild", [1, 2])
+
+        ClientSession.return_value.logout.assert_called_once_with()
+
+    @mock.patch("pungi.util.time")
+    @mock.patch("pungi.wrappers.kojiwrapper.koji.ClientSession")
+    def test_chunked_multicall_map_failure(self, ClientSession, time):
+        self._mock_sessions(ClientSession, fail=[30])
+        self.koji.compose.conf["koji_multicall_chunk_size"] = 2
+        self.koji.compose.conf["koji_multicall_threads"] = 1
+        # Start of the first chunk, then start, first and second failure of
+        # the second one.
+        time.time.side_effect = [0, 0, 0, 1000]
+
+        with self.assertRaises(koji.GenericError):
+            self.koji.chunked_multicall_map("getBuild", [1, 2, 3, 4])
+
+        # Only the failed chunk is retried.
+        self.assertEqual(len(time.sleep.mock_calls), 1)
+
 
 class LiveMediaTestCase(KojiWrapperBaseTestCase):
     def test_get_live_media_cmd_minimal(self):
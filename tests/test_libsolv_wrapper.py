@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import gzip
+import os
+from textwrap import dedent
+
+import mock
+
+from pungi.wrappers import libsolv
+
+from .helpers import PungiTestCase
+
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+  <data type="filelists">
+    <location href="repodata/filelists.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """<package type="rpm">
+  <name>%(name)s</name>
+  <arch>%(arch)s</arch>
+  <version epoch="0" ver="1.0" rel="1"/>
+  <checksum type="sha256" pkgid="YES">%(name)s</checksum>
+  <location href="%(name)s-1.0-1.%(arch)s.rpm"/>
+  <format>
+    <rpm:sourcerpm>%(name)s-1.0-1.src.rpm</rpm:sourcerpm>
+    <rpm:requires>%(requires)s</rpm:requires>
+  </format>
+</package>
+"""
+
+
+def _write_gzip(path, data):
+    with gzip.open(path, "wb") as f:
+        f.write(data.encode("utf-8"))
+
+
+def make_repo(path, packages):
+    """Create minimal repository metadata. Packages are given as a list of
+    tuples (name, arch, list of required names).
+    """
+    os.makedirs(os.path.join(path, "repodata"))
+    with open(os.path.join(path, "repodata", "repomd.xml"), "w") as f:
+        f.write(REPOMD)
+    primary = [
+        '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+        'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n'
+        % len(packages)
+    ]
+    for name, arch, requires in packages:
+        primary.append(
+            PACKAGE
+            % {
+                "name": name,
+                "arch": arch,
+                "requires": "".join('<rpm:entry name="%s"/>' % req for req in requires),
+            }
+        )
+    primary.append("</metadata>\n")
+    _write_gzip(os.path.join(path, "repodata", "primary.xml.gz"), "".join(primary))
+    _write_gzip(
+        os.path.join(path, "repodata", "filelists.xml.gz"),
+        dedent(
+            """\
+            <filelists xmlns="http://linux.duke.edu/metadata/filelists"
+              packages="0">
+            </filelists>
+            """
+        ),
+    )
+
+
+class TestGetSession(unittest.TestCase):
+    def tearDown(self):
+        libsolv.close_sessions()
+
+    @mock.patch("pungi.wrappers.libsolv.SolverSession.load")
+    def test_reuses_session(self, load):
+        first = libsolv.get_session("x86_64", ["/repo"], ["/lookaside"])
+        second = libsolv.get_session("x86_64", ["/repo"], ["/lookaside"])
+
+        self.assertIs(first, second)
+        self.assertEqual(load.call_count, 2)
+
+    @mock.patch("pungi.wrappers.libsolv.SolverSession.load")
+    def test_different_repos(self, load):
+        first = libsolv.get_session("x86_64", ["/repo"], [])
+        second = libsolv.get_session("x86_64", ["/repo"], ["/lookaside"])
+        third = libsolv.get_session("aarch64", ["/repo"], [])
+
+        self.assertEqual(len(set([first, second, third])), 3)
+        self.assertEqual(libsolv.close_sessions(), 3)
+        self.assertEqual(libsolv.close_sessions(), 0)
+
+
+@unittest.skipUnless(libsolv.solv, "libsolv bindings are not available")
+class TestSolverSession(PungiTestCase):
+    def setUp(self):
+        super(TestSolverSession, self).setUp()
+        self.repo = os.path.join(self.topdir, "repo")
+        self.lookaside = os.path.join(self.topdir, "lookaside")
+        make_repo(
+            self.repo,
+            [
+                ("app", "x86_64", ["lib", "base"]),
+                ("lib", "x86_64", []),
+                ("extra", "x86_64", []),
+            ],
+        )
+        make_repo(self.lookaside, [("base", "x86_64", [])])
+
+    def test_solve(self):
+        session = libsolv.SolverSession("x86_64", [self.repo], [self.lookaside])
+        session.load()
+
+        result, problems = session.solve(["app", "missing"])
+
+        self.assertEqual(
+            result,
+            set(
+                [
+                    ("app-1.0-1", "x86_64", frozenset()),
+                    ("lib-1.0-1", "x86_64", frozenset()),
+                ]
+            ),
+        )
+        self.assertEqual(problems, ["No match for missing"])
+        self.assertFalse(session.modular)
+
+    def test_solve_with_filter(self):
+        session = libsolv.SolverSession("x86_64", [self.repo], [self.lookaside])
+        session.load()
+
+        result, _ = session.solve(["extra", "lib"], ["ext*"])
+
+        self.assertEqual(result, set([("lib-1.0-1", "x86_64", frozenset())]))
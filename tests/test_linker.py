@@ -3,6 +3,7 @@
 
 import mock
 import errno
+import logging
 import os
 import stat
 
@@ -258,6 +259,20 @@ class TestLinkerLink(TestLinkerBase):
         self.assertFalse(os.path.isdir(self.dst_dir))
         self.assertEqual(len(self.logger.mock_calls), 1)
 
+    def test_link_file_with_detail_log(self):
+        detail_log = mock.Mock()
+        self.linker = linker.Linker(logger=self.logger, detail_log=detail_log)
+        dst = os.path.join(self.topdir, "hardlink")
+        self.linker.link(self.path_src, dst, link_type="hardlink")
+
+        self.assertTrue(self.same_inode(self.path_src, dst))
+        self.assertEqual(self.logger.mock_calls, [])
+        self.assertEqual(
+            detail_log.mock_calls,
+            [mock.call.record("hardlink", src=self.path_src, dst=dst, test=False)],
+        )
+        self.assertEqual(self.linker.get_summary(), "hardlink: 1")
+
     def test_link_file_to_existing_destination(self):
         self.assertRaises(
             OSError, self.linker.link, self.file1, self.file2, link_type="hardlink"
@@ -348,3 +363,189 @@ class TestLinkerLink(TestLinkerBase):
         self.assertTrue(self.same_inode(self.file1, self.hardlink1))
         self.linker.link(self.src_dir, self.dst_dir, link_type="copy")
         self.assertTrue(self.same_inode(self.dst_file1, self.dst_hardlink1))
+
+
+class TestCopyFile(TestLinkerBase):
+    def setUp(self):
+        super(TestCopyFile, self).setUp()
+        self.path_dst = os.path.join(self.topdir, "copy")
+
+    def assertCopied(self):
+        self.assertDifferentFile(self.path_src, self.path_dst)
+        self.assertTrue(self.same_content(self.path_src, self.path_dst))
+        self.assertSameStat(self.path_src, self.path_dst)
+
+    @mock.patch("fcntl.ioctl")
+    def test_reflink(self, ioctl):
+        linker.copy_file(self.path_src, self.path_dst)
+
+        self.assertEqual(len(ioctl.call_args_list), 1)
+        self.assertEqual(ioctl.call_args[0][1], linker.FICLONE)
+
+    @mock.patch("fcntl.ioctl")
+    def test_fallback_to_copy_file_range(self, ioctl):
+        ioctl.side_effect = OSError(errno.EOPNOTSUPP, "Not supported")
+
+        linker.copy_file(self.path_src, self.path_dst)
+
+        self.assertCopied()
+
+    @mock.patch("pungi.linker._copy_file_range")
+    @mock.patch("fcntl.ioctl")
+    def test_fallback_to_userspace_copy(self, ioctl, copy_file_range):
+        ioctl.side_effect = OSError(errno.EXDEV, "Cross-device link")
+        copy_file_range.return_value = False
+
+        linker.copy_file(self.path_src, self.path_dst)
+
+        self.assertCopied()
+
+    @mock.patch("fcntl.ioctl")
+    def test_other_error(self, ioctl):
+        ioctl.side_effect = OSError(errno.ENOSPC, "No space left on device")
+
+        with self.assertRaises(OSError):
+            linker.copy_file(self.path_src, self.path_dst)
+
+
+class TestLinkerThread(TestLinkerBase):
+    @mock.patch("pungi.linker.makedirs")
+    def test_creates_each_directory_once(self, makedirs):
+        pool = mock.Mock(linker=self.linker, link_type="copy", queue_total=3)
+        thread = linker.LinkerThread(pool)
+        self.linker.link = mock.Mock()
+
+        for num, name in enumerate(["a", "b", "c"], 1):
+            thread.process((self.path_src, os.path.join("/dst", name)), num)
+
+        self.assertEqual(makedirs.call_args_list, [mock.call("/dst")])
+        self.assertEqual(len(self.linker.link.call_args_list), 3)
+
+
+class TestLinkService(TestLinkerBase):
+    def setUp(self):
+        super(TestLinkService, self).setUp()
+        self.service = linker.LinkService(threads_per_filesystem=2, logger=self.logger)
+
+    def tearDown(self):
+        self.service.stop()
+        super(TestLinkService, self).tearDown()
+
+    def test_link_batches(self):
+        files = [self.touch("src/%s" % name, name) for name in "abc"]
+        batch1 = self.service.submit(
+            [(files[0], os.path.join(self.topdir, "dst1/a"))], "hardlink", phase="p1"
+        )
+        batch2 = self.service.submit(
+            [
+                (f, os.path.join(self.topdir, "dst2/sub", os.path.basename(f)))
+                for f in files
+            ],
+            "copy",
+            phase="p2",
+            msg="Linking p2",
+        )
+        batch1.wait()
+        batch2.wait()
+
+        self.assertSameFile(files[0], os.path.join(self.topdir, "dst1/a"))
+        for f in files:
+            dst = os.path.join(self.topdir, "dst2/sub", os.path.basename(f))
+            self.assertDifferentFile(f, dst)
+            self.assertTrue(self.same_content(f, dst))
+        self.assertEqual((batch2.files, batch2.bytes), (3, 3))
+        # All destinations are on one filesystem.
+        self.assertEqual(len(self.service._queues), 1)
+        self.assertIn(
+            mock.call(logging.INFO, "[DONE ] Linking p2"),
+            self.logger.log.call_args_list,
+        )
+
+        report = self.service.get_report()
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[0].startswith("p1: 1 files"))
+        self.assertTrue(report[1].startswith("p2: 3 files"))
+
+    def test_batch_summary_with_detail_log(self):
+        detail_log = mock.Mock(path="/details.jsonl.gz")
+        self.service.detail_log = detail_log
+        files = [self.touch("src/%s" % name, name) for name in "ab"]
+        batch = self.service.submit(
+            [(f, os.path.join(self.topdir, "dst", os.path.basename(f))) for f in files],
+            "copy",
+            phase="p",
+            msg="Linking p",
+        )
+        batch.wait()
+
+        self.assertEqual(len(detail_log.record.call_args_list), 2)
+        detail_log.flush.assert_called_once_with()
+        self.assertIn(
+            mock.call(
+                logging.INFO,
+                "[DONE ] %s (%s, details in %s)",
+                "Linking p",
+                "copy: 2",
+                "/details.jsonl.gz",
+            ),
+            self.logger.log.call_args_list,
+        )
+
+    def test_empty_batch(self):
+        batch = self.service.submit([], phase="p")
+        batch.wait()
+        self.assertEqual(batch.files, 0)
+        self.assertTrue(self.service.get_report()[0].startswith("p: 0 files"))
+
+    def test_error_is_raised(self):
+        existing = self.touch("dst/file", "other content")
+        batch = self.service.submit([(self.path_src, existing)], "copy")
+
+        with self.assertRaises(OSError):
+            batch.wait()
+
+    def test_batch_finishes_when_flush_fails(self):
+        detail_log = mock.Mock(path="/details.jsonl.gz")
+        detail_log.flush.side_effect = IOError("No space left on device")
+        self.service.detail_log = detail_log
+        batch = self.service.submit(
+            [(self.path_src, os.path.join(self.topdir, "dst/file"))], "copy"
+        )
+
+        with self.assertRaises(IOError):
+            batch.wait()
+
+        # The worker thread survives and links following batches.
+        detail_log.flush.side_effect = None
+        batch = self.service.submit(
+            [(self.path_src, os.path.join(self.topdir, "dst/other"))], "copy"
+        )
+        batch.wait()
+
+    def test_nothing_is_queued_when_device_fails(self):
+        self.service._get_device = mock.Mock(side_effect=[1, OSError("fail")])
+
+        with self.assertRaises(OSError):
+            self.service.submit(
+                [
+                    (self.path_src, os.path.join(self.topdir, "dst/a")),
+                    (self.path_src, os.path.join(self.topdir, "dst/b")),
+                ],
+                "copy",
+            )
+
+        self.assertEqual(self.service._queues[1].qsize(), 0)
+
+
+class TestGetLinkService(helpers.PungiTestCase):
+    def test_one_service_per_compose(self):
+        compose = helpers.DummyCompose(self.topdir, {})
+        service = linker.get_link_service(compose)
+
+        self.assertIs(linker.get_link_service(compose), service)
+        self.assertEqual(service.threads_per_filesystem, 10)
+
+        linker.close_link_service(compose)
+
+        self.assertIsNot(linker.get_link_service(compose), service)
+        linker.close_link_service(compose)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import functools
 import os
 
 import mock
@@ -47,11 +48,12 @@ class TestMaterializedPkgsetCreate(helpers.PungiTestCase):
         pkgset.name = name
         pkgset.reuse = None
 
-        def mock_subset(primary, arch_list, exclusive_noarch):
-            self.subsets[primary] = mock.Mock()
-            return self.subsets[primary]
+        def mock_subsets(arch_lists, exclusive_noarch):
+            for primary in arch_lists:
+                self.subsets[primary] = mock.Mock()
+            return self.subsets
 
-        pkgset.subset.side_effect = mock_subset
+        pkgset.subsets.side_effect = mock_subsets
         return pkgset
 
     def _mk_paths(self, name, arches):
@@ -72,15 +74,16 @@ class TestMaterializedPkgsetCreate(helpers.PungiTestCase):
         self.assertEqual(result["x86_64"], self.subsets["x86_64"])
         self.assertEqual(result["amd64"], self.subsets["amd64"])
 
-        self.pkgset.subset.assert_any_call(
-            "x86_64", ["x86_64", "noarch", "src"], exclusive_noarch=True
-        )
-        self.pkgset.subset.assert_any_call(
-            "amd64", ["amd64", "x86_64", "noarch", "src"], exclusive_noarch=True
+        self.pkgset.subsets.assert_called_once_with(
+            {
+                "x86_64": ["x86_64", "noarch", "src"],
+                "amd64": ["amd64", "x86_64", "noarch", "src"],
+            },
+            exclusive_noarch=True,
         )
 
         for arch, pkgset in result.package_sets.items():
-            pkgset.save_file_list.assed_any_call(
+            pkgset.save_file_list.assert_any_call(
                 os.path.join(
                     self.topdir, "work", arch, "package_list", arch + ".foo.conf"
                 ),
@@ -94,6 +97,48 @@ class TestMaterializedPkgsetCreate(helpers.PungiTestCase):
             any_order=True,
         )
 
+    def test_arch_repos_wait_for_global_repo(self, mock_run):
+        global_repo = self._mk_call("global", "foo")
+        calls = []
+
+        def fake_run(*args, **kwargs):
+            if mock.call(*args, **kwargs) != global_repo:
+                self.assertIn(global_repo, calls)
+            calls.append(mock.call(*args, **kwargs))
+
+        mock_run.side_effect = fake_run
+
+        common.MaterializedPackageSet.create(self.compose, self.pkgset, self.prefix)
+
+        self.assertEqual(len(calls), 3)
+        for arch in ["amd64", "x86_64"]:
+            self.subsets[arch].save_file_list.assert_called_once_with(
+                os.path.join(
+                    self.topdir, "work", arch, "package_list", arch + ".foo.conf"
+                ),
+                remove_path_prefix=self.prefix,
+            )
+
+    def test_reports_critical_path(self, mock_run):
+        common.MaterializedPackageSet.create(self.compose, self.pkgset, self.prefix)
+
+        messages = [
+            call[0][0] % call[0][1:] for call in self.compose.log_info.call_args_list
+        ]
+        self.assertIn("Package set foo: global-repo: 0.00 s", messages)
+        critical_path = [m for m in messages if "Critical path" in m]
+        self.assertEqual(len(critical_path), 1)
+        six.assertRegex(self, critical_path[0], r" -> repo-(amd64|x86_64)$")
+
+    def test_failure_is_reported(self, mock_run):
+        mock_run.side_effect = RuntimeError("Boom")
+
+        with self.assertRaises(RuntimeError):
+            common.MaterializedPackageSet.create(self.compose, self.pkgset, self.prefix)
+
+        # Arch repos are not started when the global one fails.
+        self.assertEqual(mock_run.call_args_list, [self._mk_call("global", "foo")])
+
     @helpers.unittest.skipUnless(Modulemd, "Skipping tests, no module support")
     @mock.patch("pungi.phases.pkgset.common.collect_module_defaults")
     @mock.patch("pungi.phases.pkgset.common.add_modular_metadata")
@@ -116,9 +161,9 @@ class TestMaterializedPkgsetCreate(helpers.PungiTestCase):
         cmd.return_value.add_module_stream.assert_called_once_with(mmd["x86_64"][0])
 
 
-class TestCreateArchRepos(helpers.PungiTestCase):
+class TestCreateArchRepo(helpers.PungiTestCase):
     def setUp(self):
-        super(TestCreateArchRepos, self).setUp()
+        super(TestCreateArchRepo, self).setUp()
         self.compose = helpers.DummyCompose(self.topdir, {})
         self.prefix = "/prefix"
         self.paths = {}
@@ -126,56 +171,213 @@ class TestCreateArchRepos(helpers.PungiTestCase):
         self.pkgset.reuse = None
         self.pkgset.name = "foo"
 
-    @mock.patch("pungi.phases.pkgset.common._create_arch_repo")
-    def test_call_create_arch_repo(self, mock_create):
-        common.create_arch_repos(
-            self.compose, self.prefix, self.paths, self.pkgset, None
-        )
-        mock_create.assert_has_calls(
-            [
-                mock.call(
-                    mock.ANY,
-                    (self.compose, "amd64", self.prefix, self.paths, self.pkgset, None),
-                    1,
-                ),
-                mock.call(
-                    mock.ANY,
-                    (
-                        self.compose,
-                        "x86_64",
-                        self.prefix,
-                        self.paths,
-                        self.pkgset,
-                        None,
-                    ),
-                    2,
-                ),
-            ]
-        )
-
     @mock.patch("pungi.phases.pkgset.common.os.path.isdir", return_value=True)
     @mock.patch("pungi.phases.pkgset.common.copy_all")
     def test_reuse_arch_repo(self, mock_copy_all, mock_isdir):
         self.pkgset.reuse = "/path/to/old/global/repo"
         old_repo = "/path/to/old/repo"
         self.compose.paths.old_compose_path = mock.Mock(return_value=old_repo)
-        common.create_arch_repos(
-            self.compose, self.prefix, self.paths, self.pkgset, None
-        )
-        mock_copy_all.assert_has_calls(
-            [
-                mock.call(
-                    old_repo, os.path.join(self.compose.topdir, "work/amd64/repo/foo")
-                ),
-                mock.call(
-                    old_repo, os.path.join(self.compose.topdir, "work/x86_64/repo/foo")
-                ),
-            ],
-            any_order=True,
+        common.create_arch_repo(
+            self.compose, "x86_64", self.prefix, self.paths, self.pkgset, None
         )
+        repo_dir = os.path.join(self.compose.topdir, "work/x86_64/repo/foo")
+        mock_copy_all.assert_called_once_with(old_repo, repo_dir)
+        self.assertEqual(self.paths, {"x86_64": repo_dir})
         self.compose.log_info.assert_has_calls(
             [
                 mock.call("[BEGIN] %s", "Copying repodata for reuse: %s" % old_repo),
                 mock.call("[DONE ] %s", "Copying repodata for reuse: %s" % old_repo),
             ]
         )
+
+
+class FakePkgset(dict):
+    def __init__(self, name, count, size):
+        super(FakePkgset, self).__init__(
+            ("/pkg/%s-%d.rpm" % (name, i), mock.Mock(size=size)) for i in range(count)
+        )
+        self.name = name
+
+
+class TestCreateMany(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestCreateMany, self).setUp()
+        self.compose = helpers.DummyCompose(
+            self.topdir, {"createrepo_cpu_budget": 4, "createrepo_memory_budget": 1000}
+        )
+
+    def test_estimate_cost(self):
+        pkgset = FakePkgset("foo", 1000, 5 * 1024**2)
+
+        self.assertEqual(
+            common.estimate_createrepo_cost(self.compose, pkgset), (3, 200)
+        )
+
+    def test_estimate_cost_caps_cpus_by_workers(self):
+        pkgset = FakePkgset("foo", 10, 1024**4)
+
+        # 3 workers for global repo and two arches
+        self.assertEqual(
+            common.estimate_createrepo_cost(self.compose, pkgset), (9, 101)
+        )
+
+    def test_create_many(self):
+        def create(compose, pkgset, path_prefix, mmd=None):
+            return pkgset.name
+
+        pkgsets = [
+            FakePkgset("small", 10, 1024),
+            FakePkgset("big", 5000, 5 * 1024**2),
+        ]
+        partials = [
+            functools.partial(create, self.compose, pkgset, "/prefix", mmd=None)
+            for pkgset in pkgsets
+        ]
+
+        result = common.MaterializedPackageSet.create_many(partials)
+
+        self.assertEqual(result, ["small", "big"])
+        self.compose.log_info.assert_any_call(
+            "Starting %s (%d CPUs, %d MiB), free: %d CPUs, %d MiB",
+            "big",
+            4,
+            600,
+            0,
+            400,
+        )
+
+    def test_create_many_empty(self):
+        self.assertEqual(common.MaterializedPackageSet.create_many([]), [])
+
+
+class TestPackageIndexes(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestPackageIndexes, self).setUp()
+        self.bash = mock.Mock(
+            file_path="/p/bash-1.0-1.x86_64.rpm",
+            epoch=None,
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            sourcerpm="bash-1.0-1.src.rpm",
+        )
+        self.bash.name = "bash"
+        self.bash_i686 = mock.Mock(
+            file_path="/p/bash-1.0-1.i686.rpm",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="i686",
+            sourcerpm="bash-1.0-1.src.rpm",
+        )
+        self.bash_i686.name = "bash"
+        self.foo = mock.Mock(
+            file_path="/p/foo-1.0-1.noarch.rpm",
+            epoch="2",
+            version="1.0",
+            release="1",
+            arch="noarch",
+            sourcerpm="foo-1.0-1.src.rpm",
+        )
+        self.foo.name = "foo"
+        self.pkgset = common.MaterializedPackageSet(
+            {
+                "x86_64": mock.Mock(
+                    rpms_by_arch={
+                        "x86_64": [self.bash],
+                        "i686": [self.bash_i686],
+                        "noarch": [self.foo],
+                    }
+                )
+            },
+            {},
+        )
+
+    def test_indexes(self):
+        self.assertEqual(
+            self.pkgset.get_index("x86_64", "path"),
+            {
+                "/p/bash-1.0-1.x86_64.rpm": self.bash,
+                "/p/bash-1.0-1.i686.rpm": self.bash_i686,
+                "/p/foo-1.0-1.noarch.rpm": self.foo,
+            },
+        )
+        self.assertEqual(
+            self.pkgset.get_index("x86_64", "nevra"),
+            {
+                "bash-1.0-1.x86_64": self.bash,
+                "bash-1.0-1.i686": self.bash_i686,
+                "foo-2:1.0-1.noarch": self.foo,
+            },
+        )
+        self.assertEqual(
+            self.pkgset.get_index("x86_64", "name"),
+            {"bash": [self.bash, self.bash_i686], "foo": [self.foo]},
+        )
+        self.assertEqual(
+            self.pkgset.get_index("x86_64", "name_arch"),
+            {
+                ("bash", "x86_64"): [self.bash],
+                ("bash", "i686"): [self.bash_i686],
+                ("foo", "noarch"): [self.foo],
+            },
+        )
+        self.assertEqual(
+            self.pkgset.get_index("x86_64", "sourcerpm"),
+            {
+                "bash-1.0-1.src.rpm": [self.bash, self.bash_i686],
+                "foo-1.0-1.src.rpm": [self.foo],
+            },
+        )
+
+    def test_index_is_cached_until_freed(self):
+        index = self.pkgset.get_index("x86_64", "name")
+
+        self.assertIs(self.pkgset.get_index("x86_64", "name"), index)
+        size = self.pkgset.index_sizes[("x86_64", "name")]
+        self.assertGreater(size, 0)
+
+        self.assertEqual(self.pkgset.free_indexes(), size)
+        self.assertEqual(self.pkgset.index_sizes, {})
+        self.assertIsNot(self.pkgset.get_index("x86_64", "name"), index)
+
+    def test_uncached_index(self):
+        index = self.pkgset.get_index("x86_64", "name", cache=False)
+
+        self.assertEqual(
+            index, {"bash": [self.bash, self.bash_i686], "foo": [self.foo]}
+        )
+        self.assertEqual(self.pkgset.index_sizes, {})
+        cached = self.pkgset.get_index("x86_64", "name")
+        self.assertIs(self.pkgset.get_index("x86_64", "name", cache=False), cached)
+
+    def test_index_is_built_without_global_lock(self):
+        build = common.build_package_index
+
+        def build_package_index(packages, kind):
+            self.assertFalse(self.pkgset._indexes_lock.locked())
+            return build(packages, kind)
+
+        with mock.patch(
+            "pungi.phases.pkgset.common.build_package_index",
+            side_effect=build_package_index,
+        ):
+            index = self.pkgset.get_index("x86_64", "name")
+
+        self.assertIs(self.pkgset.get_index("x86_64", "name"), index)
+
+    def test_merged_index(self):
+        other = {"x86_64": {self.bash.file_path: self.bash}}
+
+        self.assertIs(
+            common.get_merged_index([self.pkgset], "x86_64", "name"),
+            self.pkgset.get_index("x86_64", "name"),
+        )
+        self.assertEqual(
+            common.get_merged_index([self.pkgset, other], "x86_64", "name"),
+            {"bash": [self.bash, self.bash_i686, self.bash], "foo": [self.foo]},
+        )
+        self.assertEqual(
+            common.get_merged_index([other, self.pkgset], "x86_64", "path"),
+            self.pkgset.get_index("x86_64", "path"),
+        )
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from pungi.phases.pkgset.header_cache import HeaderCache
+from pungi.phases.pkgset.store import PackageStat, PackageStore
+
+
+FIELDS = {
+    "name": "bash",
+    "version": "4.3.42",
+    "release": "4.fc24",
+    "epoch": None,
+    "arch": "x86_64",
+    "sourcerpm": "bash-4.3.42-4.fc24.src.rpm",
+    "signature": "CAFEBABE",
+    "checksum_type": "sha256",
+    "excludearch": [],
+    "exclusivearch": [],
+    "requires": ["glibc"],
+    "provides": ["bash", "bash(x86-64)"],
+    "is_source": False,
+    "is_system_release": False,
+}
+
+
+class TestHeaderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "headers.db")
+        self.stat = PackageStat(1, 2, 1024, 1234.5)
+        self.pkg = PackageStore().add("/mnt/koji/bash.rpm", self.stat, FIELDS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_and_load(self):
+        cache = HeaderCache(self.path)
+        cache.put(self.pkg)
+        cache.close()
+
+        cache = HeaderCache(self.path)
+        self.assertEqual(cache.get("/mnt/koji/bash.rpm", self.stat), FIELDS)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_pending_records_are_visible_after_flush(self):
+        cache = HeaderCache(self.path)
+        cache.put(self.pkg)
+        cache.flush()
+
+        self.assertEqual(cache.get("/mnt/koji/bash.rpm", self.stat), FIELDS)
+
+    def test_missing_package(self):
+        cache = HeaderCache(self.path)
+
+        self.assertIsNone(cache.get("/mnt/koji/bash.rpm", self.stat))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_changed_file_is_not_used(self):
+        cache = HeaderCache(self.path)
+        cache.put(self.pkg)
+        cache.flush()
+
+        self.assertIsNone(
+            cache.get("/mnt/koji/bash.rpm", PackageStat(1, 2, 1024, 1300.0))
+        )
+        self.assertIsNone(
+            cache.get("/mnt/koji/bash.rpm", PackageStat(1, 2, 2048, 1234.5))
+        )
+
+    def test_different_version_is_not_used(self):
+        cache = HeaderCache(self.path)
+        cache.put(self.pkg)
+        cache.close()
+
+        cache = HeaderCache(self.path)
+        cache.VERSION += 1
+
+        self.assertIsNone(cache.get("/mnt/koji/bash.rpm", self.stat))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from pungi.phases.pkgset import package_file
+from pungi.phases.pkgset.package_file import (
+    PackageFile,
+    PackageFileError,
+    write_package_file,
+)
+from pungi.phases.pkgset.store import PackageStat, PackageStore
+
+
+def fake_reader(file_path, **kwargs):
+    name, version, release, arch = os.path.basename(file_path).split("@")
+    return {
+        "name": name,
+        "version": version,
+        "release": release,
+        "epoch": None,
+        "arch": arch,
+        "sourcerpm": "%s-%s-%s.src.rpm" % (name, version, release),
+        "signature": "CAFEBABE",
+        "checksum_type": "sha256",
+        "excludearch": [],
+        "exclusivearch": ["x86_64"] if arch == "src" else [],
+        "requires": ["glibc"],
+        "provides": [name, "%s(x86-64)" % name],
+        "is_source": arch == "src",
+        "is_system_release": False,
+    }
+
+
+class TestPackageFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "pkgset.bin")
+        store = PackageStore()
+        self.packages = [
+            store.add(path, PackageStat(1, i, 1024, 1234.5), fake_reader(path))
+            for i, path in enumerate(
+                [
+                    "/mnt/koji/bash@4.3.42@4.fc24@src",
+                    "/mnt/koji/bash@4.3.42@4.fc24@x86_64",
+                    "/mnt/koji/bash@4.3.42@5.fc24@x86_64",
+                    "/mnt/koji/bash@4.3.42@4.fc24@i686",
+                ]
+            )
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_and_read(self):
+        write_package_file(self.path, self.packages, metadata={"name": "f30"})
+
+        pkgs = PackageFile(self.path)
+
+        self.assertEqual(pkgs.metadata, {"name": "f30"})
+        self.assertEqual(len(pkgs), 4)
+        self.assertEqual(list(pkgs), [pkg.file_path for pkg in self.packages])
+        self.assertIn("/mnt/koji/bash@4.3.42@4.fc24@i686", pkgs)
+        pkg = pkgs["/mnt/koji/bash@4.3.42@4.fc24@src"]
+        self.assertEqual(pkg.nevra, "bash-0:4.3.42-4.fc24.src")
+        self.assertEqual(pkg.exclusivearch, ["x86_64"])
+        self.assertEqual(pkg.provides, set(["bash", "bash(x86-64)"]))
+        self.assertTrue(pkg.is_source)
+        self.assertEqual(pkg.stat, PackageStat(1, 0, 1024, 1234.5))
+
+    def test_records_are_decoded_lazily(self):
+        write_package_file(self.path, self.packages)
+
+        pkgs = PackageFile(self.path)
+
+        self.assertIsNone(pkgs.metadata)
+        self.assertEqual(len(pkgs._store), 0)
+        pkg = pkgs["/mnt/koji/bash@4.3.42@4.fc24@x86_64"]
+        self.assertIs(pkgs["/mnt/koji/bash@4.3.42@4.fc24@x86_64"], pkg)
+        self.assertEqual(len(pkgs._store), 1)
+
+    def test_lookup_by_name_and_arch(self):
+        write_package_file(self.path, self.packages)
+
+        pkgs = PackageFile(self.path)
+
+        self.assertEqual(
+            [pkg.nvra for pkg in pkgs.get_by_name_arch("bash", "x86_64")],
+            ["bash-4.3.42-4.fc24.x86_64", "bash-4.3.42-5.fc24.x86_64"],
+        )
+        self.assertEqual(pkgs.get_by_name_arch("bash", "ppc64le"), [])
+
+    def test_items(self):
+        write_package_file(self.path, self.packages)
+
+        pkgs = PackageFile(self.path)
+
+        self.assertEqual(
+            [(path, pkg.file_path) for path, pkg in pkgs.items()],
+            [(pkg.file_path, pkg.file_path) for pkg in self.packages],
+        )
+
+    def test_pickle(self):
+        write_package_file(self.path, self.packages)
+
+        pkgs = pickle.loads(pickle.dumps(PackageFile(self.path)))
+
+        self.assertEqual(len(pkgs), 4)
+        self.assertEqual(
+            pkgs["/mnt/koji/bash@4.3.42@4.fc24@i686"].nvra, "bash-4.3.42-4.fc24.i686"
+        )
+
+    def test_reject_other_file(self):
+        with open(self.path, "wb") as f:
+            pickle.dump({"a": 1}, f)
+
+        with self.assertRaises(PackageFileError):
+            PackageFile(self.path)
+
+    def test_reject_different_version(self):
+        write_package_file(self.path, self.packages)
+        with open(self.path, "r+b") as f:
+            f.seek(len(package_file.MAGIC))
+            f.write(struct.pack("<I", package_file.VERSION + 1))
+
+        with self.assertRaises(PackageFileError) as ctx:
+            PackageFile(self.path)
+
+        self.assertIn("unsupported version", str(ctx.exception))
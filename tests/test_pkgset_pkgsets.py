@@ -102,6 +102,7 @@ class FakePool(object):
         self.queue = []
         self.worker = None
         self.package_set = package_set
+        self.unread_paths = []
 
     def log_warning(self, *args, **kwargs):
         pass
@@ -124,6 +125,42 @@ class FakePool(object):
         pass
 
 
+class FakeProcessPool(object):
+    """Substitute for multiprocessing.Pool running everything in process."""
+
+    def __init__(self, processes):
+        self.processes = processes
+
+    def imap_unordered(self, func, iterable):
+        return [func(item) for item in iterable]
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+def fake_read_rpm_header_fields(file_path):
+    name, version, release, arch = os.path.basename(file_path).split("@")
+    return {
+        "name": name,
+        "version": version,
+        "release": release,
+        "epoch": None,
+        "arch": arch,
+        "sourcerpm": "%s@%s@%s@src" % (name, version, release),
+        "signature": None,
+        "checksum_type": "sha256",
+        "excludearch": [],
+        "exclusivearch": ["x86_64"] if arch == "src" else [],
+        "requires": [],
+        "provides": [name],
+        "is_source": arch == "src",
+        "is_system_release": False,
+    }
+
+
 class PkgsetCompareMixin(object):
     def assertPkgsetEqual(self, actual, expected):
         for k, v1 in expected.items():
@@ -225,6 +262,85 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
             },
         )
 
+    @mock.patch(
+        "pungi.phases.pkgset.pkgsets.read_rpm_header_fields",
+        new=fake_read_rpm_header_fields,
+    )
+    @mock.patch("multiprocessing.Pool", new=FakeProcessPool)
+    def test_read_headers_in_processes(self):
+        self._touch_files(
+            [
+                "rpms/pungi@4.1.3@3.fc25@noarch",
+                "rpms/pungi@4.1.3@3.fc25@src",
+                "rpms/bash@4.3.42@4.fc24@x86_64",
+                "rpms/bash@4.3.42@4.fc24@src",
+                "rpms/bash-debuginfo@4.3.42@4.fc24@x86_64",
+            ]
+        )
+
+        pkgset = pkgsets.KojiPackageSet(
+            "pkgset",
+            self.koji_wrapper,
+            [None],
+            arches=["x86_64", "noarch", "src"],
+            reader_processes=2,
+        )
+
+        result = pkgset.populate("f25")
+
+        self.assertEqual(
+            dict(
+                (arch, sorted(p.file_name for p in pkgs))
+                for arch, pkgs in result.items()
+            ),
+            {
+                "src": ["bash@4.3.42@4.fc24@src", "pungi@4.1.3@3.fc25@src"],
+                "noarch": ["pungi@4.1.3@3.fc25@noarch"],
+                "x86_64": [
+                    "bash-debuginfo@4.3.42@4.fc24@x86_64",
+                    "bash@4.3.42@4.fc24@x86_64",
+                ],
+            },
+        )
+        self.assertEqual(len(pkgset.store), 5)
+        # SRPMs were read first, so the noarch package got its ExclusiveArch.
+        self.assertEqual(result["noarch"][0].exclusivearch, ["x86_64"])
+
+    @mock.patch("pungi.phases.pkgset.pkgsets.read_rpm_header_fields")
+    def test_read_headers_from_header_cache(self, read_fields):
+        self._touch_files(
+            [
+                "rpms/bash@4.3.42@4.fc24@x86_64",
+                "rpms/bash-debuginfo@4.3.42@4.fc24@x86_64",
+            ]
+        )
+        header_cache = mock.Mock()
+        header_cache.get.side_effect = lambda path, stat: fake_read_rpm_header_fields(
+            path
+        )
+
+        pkgset = pkgsets.KojiPackageSet(
+            "pkgset",
+            self.koji_wrapper,
+            [None],
+            arches=["x86_64"],
+            header_cache=header_cache,
+        )
+
+        result = pkgset.populate("f25")
+
+        self.assertEqual(
+            sorted(p.file_name for p in result["x86_64"]),
+            [
+                "bash-debuginfo@4.3.42@4.fc24@x86_64",
+                "bash@4.3.42@4.fc24@x86_64",
+            ],
+        )
+        self.assertEqual(len(pkgset.store), 2)
+        self.assertEqual(read_fields.call_count, 0)
+        self.assertEqual(header_cache.put.call_count, 0)
+        header_cache.flush.assert_called_once_with()
+
     def test_find_signed_with_preference(self):
         self._touch_files(
             [
@@ -303,21 +419,17 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
         )
         self.assertRegex(str(ctx.exception), figure)
 
-    @mock.patch("os.path.isfile")
     @mock.patch("time.sleep")
-    def test_find_signed_after_wait(self, sleep, isfile):
-        checked_files = set()
-
-        def check_file(path):
-            """First check for any path will fail, second and further will succeed."""
-            if path in checked_files:
-                return True
-            checked_files.add(path)
-            return False
+    def test_find_signed_after_wait(self, sleep):
+        fst_key, snd_key = ["cafebabe", "deadbeef"]
+        fst_pkg = "signed/%s/bash-debuginfo@4.3.42@4.fc24@x86_64"
+        snd_pkg = "signed/%s/bash@4.3.42@4.fc24@x86_64"
 
-        isfile.side_effect = check_file
+        # The signed copies appear while waiting.
+        sleep.side_effect = lambda _: self._touch_files(
+            [fst_pkg % fst_key, snd_pkg % fst_key]
+        )
 
-        fst_key, snd_key = ["cafebabe", "deadbeef"]
         pkgset = pkgsets.KojiPackageSet(
             "pkgset",
             self.koji_wrapper,
@@ -334,25 +446,43 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
             [mock.call.listTaggedRPMS("f25", event=None, inherit=True, latest=True)],
         )
 
-        fst_pkg = "signed/%s/bash-debuginfo@4.3.42@4.fc24@x86_64"
-        snd_pkg = "signed/%s/bash@4.3.42@4.fc24@x86_64"
-
         self.assertPkgsetEqual(
             result, {"x86_64": [fst_pkg % "cafebabe", snd_pkg % "cafebabe"]}
         )
-        # Wait once for each of the two packages
-        self.assertEqual(sleep.call_args_list, [mock.call(5)] * 2)
-        # Each file will be checked three times
-        self.assertEqual(
-            isfile.call_args_list,
+        # Wait once for both packages
+        self.assertEqual(sleep.call_args_list, [mock.call(5)])
+
+    @mock.patch("os.path.isfile")
+    def test_signed_paths_are_not_checked_one_by_one(self, isfile):
+        self._touch_files(
             [
-                mock.call(os.path.join(self.topdir, fst_pkg % fst_key)),
-                mock.call(os.path.join(self.topdir, fst_pkg % snd_key)),
-                mock.call(os.path.join(self.topdir, fst_pkg % fst_key)),
-                mock.call(os.path.join(self.topdir, snd_pkg % fst_key)),
-                mock.call(os.path.join(self.topdir, snd_pkg % snd_key)),
-                mock.call(os.path.join(self.topdir, snd_pkg % fst_key)),
-            ],
+                "signed/deadbeef/bash@4.3.42@4.fc24@x86_64",
+                "signed/deadbeef/bash-debuginfo@4.3.42@4.fc24@x86_64",
+            ]
+        )
+
+        pkgset = pkgsets.KojiPackageSet(
+            "pkgset",
+            self.koji_wrapper,
+            ["cafebabe", "deadbeef"],
+            arches=["x86_64"],
+        )
+        pkgset.log_debug = mock.Mock()
+
+        result = pkgset.populate("f25")
+
+        self.assertPkgsetEqual(
+            result,
+            {
+                "x86_64": [
+                    "signed/deadbeef/bash@4.3.42@4.fc24@x86_64",
+                    "signed/deadbeef/bash-debuginfo@4.3.42@4.fc24@x86_64",
+                ]
+            },
+        )
+        self.assertEqual(isfile.call_args_list, [])
+        pkgset.log_debug.assert_any_call(
+            "Package set: 2 directory listings replaced 4 stat calls"
         )
 
     def test_can_not_find_signed_package_allow_invalid_sigkeys(self):
@@ -421,8 +551,8 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
             str(ctx.exception),
             r"^RPM\(s\) not found for sigs: .+Check log for details.+",
         )
-        # Two packages making three attempts each, so two waits per package.
-        self.assertEqual(time.call_args_list, [mock.call(5)] * 4)
+        # Three attempts for all packages at once, so two waits.
+        self.assertEqual(time.call_args_list, [mock.call(5)] * 2)
 
     def test_packages_attribute(self):
         self._touch_files(
@@ -497,7 +627,7 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
                 "srpm": "tasks/5478/29155478/pungi-4.1.39-5.f30.src.rpm",
             },
         ]
-        self.koji_wrapper.retrying_multicall_map.side_effect = [
+        self.koji_wrapper.chunked_multicall_map.side_effect = [
             children_tasks,
             task_results,
         ]
@@ -528,6 +658,69 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
         rpms = pkgset.get_extra_rpms_from_tasks()
         self.assertEqual(rpms, expected_rpms)
 
+    def test_populate_incrementally(self):
+        self._touch_files(
+            [
+                "rpms/bash@4.3.42@4.fc24@x86_64",
+                "rpms/bash@4.3.42@4.fc24@src",
+                "rpms/bash-debuginfo@4.3.42@4.fc24@x86_64",
+            ]
+        )
+        reused = {
+            "src": [
+                MockFile("rpms/pungi@4.1.3@3.fc25@src"),
+                MockFile("rpms/bash@4.3.41@1.fc24@src"),
+            ],
+            "noarch": [MockFile("rpms/pungi@4.1.3@3.fc25@noarch")],
+            "x86_64": [MockFile("rpms/bash@4.3.41@1.fc24@x86_64")],
+        }
+        rpms, builds = self.tagged_rpms
+        self.koji_wrapper.chunked_multicall_map.return_value = [
+            [
+                [rpm for rpm in rpms if rpm["build_id"] == 716627],
+                [build for build in builds if build["name"] == "bash"],
+            ]
+        ]
+
+        pkgset = pkgsets.KojiPackageSet(
+            "pkgset", self.koji_wrapper, [None], arches=["x86_64", "noarch", "src"]
+        )
+        pkgset.incremental_reuse = (
+            {
+                "rpms_by_arch": reused,
+                "srpms_by_name": dict((rpm.file_name, rpm) for rpm in reused["src"]),
+            },
+            set(["bash"]),
+        )
+
+        result = pkgset.populate("f25", event=3)
+
+        self.assertEqual(self.koji_wrapper.koji_proxy.listTaggedRPMS.mock_calls, [])
+        self.koji_wrapper.chunked_multicall_map.assert_called_once_with(
+            "listTaggedRPMS",
+            list_of_args=["f25"],
+            list_of_kwargs=[
+                {"event": 3, "inherit": True, "latest": True, "package": "bash"}
+            ],
+        )
+        self.assertPkgsetEqual(
+            result,
+            {
+                "src": ["rpms/pungi@4.1.3@3.fc25@src", "rpms/bash@4.3.42@4.fc24@src"],
+                "noarch": ["rpms/pungi@4.1.3@3.fc25@noarch"],
+                "x86_64": [
+                    "rpms/bash@4.3.42@4.fc24@x86_64",
+                    "rpms/bash-debuginfo@4.3.42@4.fc24@x86_64",
+                ],
+            },
+        )
+        six.assertCountEqual(
+            self,
+            pkgset.srpms_by_name,
+            ["pungi@4.1.3@3.fc25@src", "bash@4.3.42@4.fc24@src"],
+        )
+        self.assertIsNone(pkgset.incremental_reuse)
+
     def test_get_latest_rpms_cache(self):
         self._touch_files(
             [
@@ -622,7 +815,7 @@ class TestKojiPkgset(PkgsetCompareMixin, helpers.PungiTestCase):
         extra_builds = [
             build for build in self.tagged_rpms[1] if build["package_name"] == "pungi"
         ]
-        self.koji_wrapper.retrying_multicall_map.side_effect = [
+        self.koji_wrapper.chunked_multicall_map.side_effect = [
             extra_builds,
             [extra_rpms],
         ]
@@ -728,6 +921,67 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
         )
         self.assert_not_reuse()
 
+    @mock.patch("pungi.paths.os.path.exists", return_value=True)
+    @mock.patch.object(helpers.paths.Paths, "get_old_compose_topdir")
+    def test_reuse_incremental(self, mock_old_topdir, mock_exists):
+        mock_old_topdir.return_value = self.old_compose_dir
+        self.compose.conf["pkgset_incremental_reuse"] = True
+        self.pkgset._get_koji_event_from_file = mock.Mock(side_effect=[3, 1])
+        self.koji_wrapper.koji_proxy.queryHistory.side_effect = [
+            {"tag_listing": [{"name": "bash"}], "tag_inheritance": []},
+            {
+                "tag_listing": [{"name": "pungi"}, {"name": "bash"}],
+                "tag_inheritance": [],
+            },
+        ]
+        self.koji_wrapper.koji_proxy.getFullInheritance.return_value = [
+            {"name": self.inherited_tag}
+        ]
+        reuse_data = {
+            "allow_invalid_sigkeys": self.pkgset._allow_invalid_sigkeys,
+            "packages": self.pkgset.packages,
+            "populate_only_packages": self.pkgset.populate_only_packages,
+            "extra_builds": self.pkgset.extra_builds,
+            "sigkeys": self.pkgset.sigkey_ordering,
+            "include_packages": None,
+            "rpms_by_arch": mock.Mock(),
+            "srpms_by_name": mock.Mock(),
+        }
+        self.pkgset.load_reuse_file = mock.Mock(return_value=reuse_data)
+
+        self.assertFalse(self.pkgset.try_to_reuse(self.compose, self.tag))
+
+        self.assertEqual(
+            self.pkgset.log_info.mock_calls,
+            [
+                mock.call("Trying to reuse pkgset data of old compose"),
+                mock.call("Reusing pkgset data, 2 packages changed: bash pungi"),
+            ],
+        )
+        self.assertEqual(
+            self.pkgset.incremental_reuse, (reuse_data, set(["bash", "pungi"]))
+        )
+        self.assertIsNone(self.pkgset.reuse)
+
+    @mock.patch.object(helpers.paths.Paths, "get_old_compose_topdir")
+    def test_reuse_incremental_with_extra_builds(self, mock_old_topdir):
+        mock_old_topdir.return_value = self.old_compose_dir
+        self.compose.conf["pkgset_incremental_reuse"] = True
+        self.pkgset.extra_builds = ["bash-4.3.42-4.fc24"]
+        self.pkgset._get_koji_event_from_file = mock.Mock(side_effect=[3, 1])
+        self.koji_wrapper.koji_proxy.queryHistory.return_value = {
+            "tag_listing": [{"name": "bash"}],
+            "tag_inheritance": [],
+        }
+
+        self.pkgset.try_to_reuse(self.compose, self.tag)
+
+        self.pkgset.log_debug.assert_called_with(
+            "Builds under tag %s changed. Can't reuse." % self.tag
+        )
+        self.assert_not_reuse()
+        self.assertIsNone(self.pkgset.incremental_reuse)
+
     @mock.patch.object(helpers.paths.Paths, "get_old_compose_topdir")
     def test_reuse_build_under_inherited_tag_changed(self, mock_old_topdir):
         mock_old_topdir.return_value = self.old_compose_dir
@@ -766,9 +1020,7 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
             "tag_inheritance": [],
         }
         self.koji_wrapper.koji_proxy.getFullInheritance.return_value = []
-        self.pkgset.load_old_file_cache = mock.Mock(
-            side_effect=Exception("unknown error")
-        )
+        self.pkgset.load_reuse_file = mock.Mock(side_effect=Exception("unknown error"))
 
         self.pkgset.try_to_reuse(self.compose, self.tag)
 
@@ -783,7 +1035,7 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
                     % os.path.join(
                         self.old_compose_dir,
                         "work/global",
-                        "pkgset_%s_reuse.pickle" % self.tag,
+                        "pkgset_%s_reuse.bin" % self.tag,
                     )
                 ),
                 mock.call("Failed to load reuse file: unknown error"),
@@ -801,7 +1053,7 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
             "tag_inheritance": [],
         }
         self.koji_wrapper.koji_proxy.getFullInheritance.return_value = []
-        self.pkgset.load_old_file_cache = mock.Mock(
+        self.pkgset.load_reuse_file = mock.Mock(
             return_value={"allow_invalid_sigkeys": True}
         )
 
@@ -818,7 +1070,7 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
                     % os.path.join(
                         self.old_compose_dir,
                         "work/global",
-                        "pkgset_%s_reuse.pickle" % self.tag,
+                        "pkgset_%s_reuse.bin" % self.tag,
                     )
                 ),
             ],
@@ -843,7 +1095,7 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
             "tag_inheritance": [],
         }
         self.koji_wrapper.koji_proxy.getFullInheritance.return_value = []
-        self.pkgset.load_old_file_cache = mock.Mock(
+        self.pkgset.load_reuse_file = mock.Mock(
             return_value={
                 "allow_invalid_sigkeys": self.pkgset._allow_invalid_sigkeys,
                 "packages": self.pkgset.packages,
@@ -870,6 +1122,39 @@ class TestReuseKojiPkgset(helpers.PungiTestCase):
         self.assertEqual(old_repo_dir, self.pkgset.reuse)
         self.assertEqual(self.pkgset.file_cache, self.pkgset.old_file_cache)
 
+    def test_write_and_load_reuse_file(self):
+        store = pkgsets.PackageStore()
+        for path in ["/mnt/pungi@4.1.3@3.fc25@src", "/mnt/pungi@4.1.3@3.fc25@noarch"]:
+            rpm_obj = store.add(
+                path,
+                pkgsets.PackageStat(1, 2, 3, 4.0),
+                fake_read_rpm_header_fields(path),
+            )
+            self.pkgset.add_to_arch_lists(rpm_obj)
+
+        self.compose.paths.work.topdir(arch="global")
+        self.pkgset.write_reuse_file(self.compose, include_packages=None)
+        reuse_data = self.pkgset.load_reuse_file(
+            self.compose.paths.work.pkgset_reuse_file(self.tag)
+        )
+
+        self.assertEqual(reuse_data["packages"], self.pkgset.packages)
+        self.assertEqual(reuse_data["sigkeys"], self.pkgset.sigkey_ordering)
+        self.assertIsNone(reuse_data["include_packages"])
+        self.assertEqual(
+            dict(
+                (k, [str(i) for i in v]) for k, v in reuse_data["rpms_by_arch"].items()
+            ),
+            {
+                "src": ["pungi-4.1.3-3.fc25.src.rpm"],
+                "noarch": ["pungi-4.1.3-3.fc25.noarch.rpm"],
+            },
+        )
+        self.assertEqual(list(reuse_data["srpms_by_name"]), ["pungi@4.1.3@3.fc25@src"])
+        self.assertEqual(
+            reuse_data["rpms_by_arch"]["noarch"][0].exclusivearch, ["x86_64"]
+        )
+
 
 @mock.patch("kobo.pkgset.FileCache", new=MockFileCache)
 class TestMergePackageSets(PkgsetCompareMixin, unittest.TestCase):
@@ -1006,6 +1291,116 @@ class TestMergePackageSets(PkgsetCompareMixin, unittest.TestCase):
         )
 
 
+class TestSubsets(PkgsetCompareMixin, unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("kobo.pkgset.FileCache", new=MockFileCache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pkgset = pkgsets.PackageSetBase("global", [None])
+        for name in [
+            "rpms/pungi@4.1.3@3.fc25@noarch",
+            "rpms/pungi@4.1.3@3.fc25@src",
+            "rpms/bash@4.3.42@4.fc24@i686",
+            "rpms/bash@4.3.42@4.fc24@x86_64",
+            "rpms/bash@4.3.42@4.fc24@src",
+            "rpms/grub2@2.06@1.fc35@noarch",
+            "rpms/grub2@2.06@1.fc35@src",
+            "rpms/ppc64-utils@1@1.fc35@ppc64le",
+            "rpms/ppc64-utils@1@1.fc35@src",
+            "rpms/orphan@1@1.fc35@src",
+        ]:
+            pkg = self.pkgset.file_cache.add(name)
+            if pkg.name == "grub2" and pkg.arch == "noarch":
+                pkg.exclusivearch = ["x86_64", "ppc64le"]
+            self.pkgset.rpms_by_arch.setdefault(pkg.arch, []).append(pkg)
+        self.arch_lists = {
+            "x86_64": ["x86_64", "i686", "noarch", "src"],
+            "i386": ["i686", "noarch", "src"],
+            "ppc64le": ["ppc64le", "noarch", "src"],
+        }
+
+    def test_subsets(self):
+        result = self.pkgset.subsets(self.arch_lists)
+
+        self.assertPkgsetEqual(
+            result["i386"].rpms_by_arch,
+            {
+                "i686": ["rpms/bash@4.3.42@4.fc24@i686"],
+                "noarch": ["rpms/pungi@4.1.3@3.fc25@noarch"],
+                "src": [
+                    "rpms/bash@4.3.42@4.fc24@src",
+                    "rpms/pungi@4.1.3@3.fc25@src",
+                ],
+                "nosrc": [],
+            },
+        )
+        self.assertEqual(result["i386"].arches, ["i686", "noarch", "nosrc", "src"])
+        six.assertCountEqual(
+            self,
+            result["ppc64le"].file_cache,
+            [
+                "rpms/ppc64-utils@1@1.fc35@ppc64le",
+                "rpms/ppc64-utils@1@1.fc35@src",
+                "rpms/pungi@4.1.3@3.fc25@noarch",
+                "rpms/pungi@4.1.3@3.fc25@src",
+                "rpms/grub2@2.06@1.fc35@noarch",
+                "rpms/grub2@2.06@1.fc35@src",
+            ],
+        )
+
+    def test_subsets_match_merge(self):
+        for exclusive_noarch in (True, False):
+            result = self.pkgset.subsets(
+                dict((k, list(v)) for k, v in self.arch_lists.items()),
+                exclusive_noarch=exclusive_noarch,
+            )
+
+            for primary_arch, arch_list in self.arch_lists.items():
+                expected = pkgsets.PackageSetBase("global", [None])
+                expected.merge(
+                    self.pkgset,
+                    primary_arch,
+                    list(arch_list),
+                    exclusive_noarch=exclusive_noarch,
+                )
+                self.assertEqual(
+                    result[primary_arch].rpms_by_arch, expected.rpms_by_arch
+                )
+
+    def test_subsets_with_detail_log(self):
+        self.pkgset.detail_log = mock.Mock(path="/details.jsonl.gz")
+        self.pkgset.subsets(self.arch_lists)
+
+        self.assertEqual(
+            self.pkgset.detail_log.mock_calls,
+            [
+                mock.call.record(
+                    "exclude",
+                    pkgset="global",
+                    file_name="grub2@2.06@1.fc35@noarch",
+                    excludearch=[],
+                    exclusivearch=["ppc64le", "x86_64"],
+                    subsets=["i386"],
+                ),
+                mock.call.flush(),
+            ],
+        )
+
+    def test_subset(self):
+        result = self.pkgset.subset("x86_64", ["x86_64", "noarch"])
+
+        self.assertPkgsetEqual(
+            result.rpms_by_arch,
+            {
+                "x86_64": ["rpms/bash@4.3.42@4.fc24@x86_64"],
+                "noarch": [
+                    "rpms/pungi@4.1.3@3.fc25@noarch",
+                    "rpms/grub2@2.06@1.fc35@noarch",
+                ],
+            },
+        )
+
+
 @mock.patch("kobo.pkgset.FileCache", new=MockFileCache)
 class TestSaveFileList(unittest.TestCase):
     def setUp(self):
@@ -99,6 +99,19 @@ class TestPopulateGlobalPkgset(helpers.PungiTestCase):
             [mock.call.populate("f25", 123456, inherit=True, include_packages=set())],
         )
 
+    @mock.patch("pungi.phases.pkgset.sources.source_koji.get_header_cache")
+    @mock.patch("pungi.phases.pkgset.pkgsets.KojiPackageSet")
+    def test_populate_failure_closes_header_cache(self, KojiPackageSet, ghc):
+        KojiPackageSet.return_value.reuse = None
+        KojiPackageSet.return_value.populate.side_effect = RuntimeError("Boom")
+
+        with self.assertRaises(RuntimeError):
+            source_koji.populate_global_pkgset(
+                self.compose, self.koji_wrapper, "/prefix", 123456
+            )
+
+        ghc.return_value.close.assert_called_once_with()
+
     def mock_materialize(self, compose, pkgset, prefix, mmd):
         self.assertEqual(prefix, "/prefix")
         self.assertEqual(compose, self.compose)
@@ -222,7 +235,7 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         ]
 
         self.koji_wrapper.koji_proxy.search.return_value = mock_build_ids
-        self.koji_wrapper.koji_proxy.getBuild.return_value = mock_build_md[0]
+        self.koji_wrapper.chunked_multicall_map.return_value = mock_build_md
         event = {"id": 12345, "ts": 1533473124.0}
 
         module_info_str = "testmodule2:master-dash:20180406051653:96c371af"
@@ -243,8 +256,8 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         self.koji_wrapper.koji_proxy.search.assert_called_once_with(
             expected_query, "build", "glob"
         )
-        self.koji_wrapper.koji_proxy.getBuild.assert_called_once_with(
-            mock_build_ids[0]["id"]
+        self.koji_wrapper.chunked_multicall_map.assert_called_once_with(
+            "getBuild", list_of_args=[mock_build_ids[0]["id"]]
         )
 
     def test_get_koji_modules_filter_by_event(self):
@@ -274,7 +287,7 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         ]
 
         self.koji_wrapper.koji_proxy.search.return_value = mock_build_ids
-        self.koji_wrapper.koji_proxy.getBuild.return_value = mock_build_md[0]
+        self.koji_wrapper.chunked_multicall_map.return_value = mock_build_md
         event = {"id": 12345, "ts": 1533473124.0}
 
         with self.assertRaises(ValueError) as ctx:
@@ -287,8 +300,8 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         self.koji_wrapper.koji_proxy.search.assert_called_once_with(
             "testmodule2-master_dash-*", "build", "glob"
         )
-        self.koji_wrapper.koji_proxy.getBuild.assert_called_once_with(
-            mock_build_ids[0]["id"]
+        self.koji_wrapper.chunked_multicall_map.assert_called_once_with(
+            "getBuild", list_of_args=[mock_build_ids[0]["id"]]
         )
         self.koji_wrapper.koji_proxy.listArchives.assert_not_called()
         self.koji_wrapper.koji_proxy.listRPMs.assert_not_called()
@@ -350,7 +363,7 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         ]
 
         self.koji_wrapper.koji_proxy.search.return_value = mock_build_ids
-        self.koji_wrapper.koji_proxy.getBuild.side_effect = mock_build_md
+        self.koji_wrapper.chunked_multicall_map.return_value = mock_build_md
 
         event = {"id": 12345, "ts": 1533473124.0}
 
@@ -373,11 +386,10 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
             expected_query, "build", "glob"
         )
 
-        expected_calls = [
-            mock.call(mock_build_ids[0]["id"]),
-            mock.call(mock_build_ids[1]["id"]),
-        ]
-        self.koji_wrapper.koji_proxy.getBuild.mock_calls == expected_calls
+        self.koji_wrapper.chunked_multicall_map.assert_called_once_with(
+            "getBuild",
+            list_of_args=[mock_build_ids[0]["id"], mock_build_ids[1]["id"]],
+        )
 
     def test_get_koji_modules_ignore_deleted(self):
         mock_build_ids = [
@@ -410,7 +422,7 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         ]
 
         self.koji_wrapper.koji_proxy.search.return_value = mock_build_ids
-        self.koji_wrapper.koji_proxy.getBuild.return_value = mock_build_md[0]
+        self.koji_wrapper.chunked_multicall_map.return_value = mock_build_md
         event = {"id": 12345, "ts": 1533473124.0}
 
         with self.assertRaises(ValueError) as ctx:
@@ -427,8 +439,8 @@ class TestGetPackageSetFromKoji(helpers.PungiTestCase):
         self.koji_wrapper.koji_proxy.search.assert_called_once_with(
             "testmodule2-master_dash-*", "build", "glob"
         )
-        self.koji_wrapper.koji_proxy.getBuild.assert_called_once_with(
-            mock_build_ids[0]["id"]
+        self.koji_wrapper.chunked_multicall_map.assert_called_once_with(
+            "getBuild", list_of_args=[mock_build_ids[0]["id"]]
         )
         self.koji_wrapper.koji_proxy.listArchives.assert_not_called()
         self.koji_wrapper.koji_proxy.listRPMs.assert_not_called()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from pungi.phases.pkgset.store import PackageStat, PackageStore
+
+
+def fake_reader(file_path, **kwargs):
+    name, version, release, arch = os.path.basename(file_path).split("@")
+    return {
+        "name": name,
+        "version": version,
+        "release": release,
+        "epoch": None,
+        "arch": arch,
+        "sourcerpm": "%s-%s-%s.src.rpm" % (name, version, release),
+        "signature": "CAFEBABE",
+        "checksum_type": "sha256",
+        "excludearch": [],
+        "exclusivearch": ["x86_64"] if arch == "src" else [],
+        "requires": ["glibc", "libc.so.6()(64bit)", "glibc"],
+        "provides": [name, "%s(x86-64)" % name],
+        "is_source": arch == "src",
+        "is_system_release": name == "fedora-release",
+    }
+
+
+class TestPackageStore(unittest.TestCase):
+    def setUp(self):
+        self.store = PackageStore(fake_reader)
+        self.stat = PackageStat(1, 2, 1024, 1234.5)
+
+    def _add(self, path):
+        return self.store.add(path, self.stat, fake_reader(path))
+
+    def test_add_package(self):
+        pkg = self._add("/mnt/koji/bash@4.3.42@4.fc24@x86_64")
+
+        self.assertEqual(pkg.file_path, "/mnt/koji/bash@4.3.42@4.fc24@x86_64")
+        self.assertEqual(pkg.file_name, "bash@4.3.42@4.fc24@x86_64")
+        self.assertEqual(pkg.name, "bash")
+        self.assertEqual(pkg.arch, "x86_64")
+        self.assertIsNone(pkg.epoch)
+        self.assertEqual(pkg.sourcerpm, "bash-4.3.42-4.fc24.src.rpm")
+        self.assertEqual(pkg.signature, "CAFEBABE")
+        self.assertEqual(pkg.nevra, "bash-0:4.3.42-4.fc24.x86_64")
+        self.assertEqual(pkg.requires, set(["glibc", "libc.so.6()(64bit)"]))
+        self.assertEqual(pkg.provides, set(["bash", "bash(x86-64)"]))
+        self.assertEqual(pkg.exclusivearch, [])
+        self.assertFalse(pkg.is_source)
+        self.assertFalse(pkg.is_system_release)
+        self.assertEqual(pkg.size, 1024)
+        self.assertEqual(pkg.stat, self.stat)
+        self.assertEqual(str(pkg), "bash-4.3.42-4.fc24.x86_64.rpm")
+
+    def test_strings_are_shared(self):
+        self._add("/mnt/koji/bash@4.3.42@4.fc24@x86_64")
+        values = len(self.store._values)
+        self._add("/mnt/koji/bash@4.3.42@4.fc24@i686")
+
+        self.assertEqual(len(self.store), 2)
+        # Only the file path and the arch are new.
+        self.assertEqual(len(self.store._values), values + 2)
+
+    def test_set_arch_lists(self):
+        srpm = self._add("/mnt/koji/pungi@4.1.3@3.fc25@src")
+        pkg = self._add("/mnt/koji/pungi@4.1.3@3.fc25@noarch")
+
+        pkg.exclusivearch = srpm.exclusivearch
+
+        self.assertEqual(pkg.exclusivearch, ["x86_64"])
+        self.assertTrue(srpm.is_source)
+
+    def test_copy_from_other_store(self):
+        other = PackageStore(fake_reader)
+        pkg = other.add(
+            "/mnt/koji/fedora-release@30@1@noarch",
+            self.stat,
+            fake_reader("/mnt/koji/fedora-release@30@1@noarch"),
+        )
+
+        copy = self.store.copy(pkg)
+
+        self.assertIs(copy._store, self.store)
+        self.assertEqual(copy.nvra, "fedora-release-30-1.noarch")
+        self.assertEqual(copy.requires, pkg.requires)
+        self.assertTrue(copy.is_system_release)
+
+    def test_pickle(self):
+        pkg = self._add("/mnt/koji/bash@4.3.42@4.fc24@x86_64")
+        other = self._add("/mnt/koji/bash@4.3.42@4.fc24@i686")
+
+        pkg2, other2 = pickle.loads(pickle.dumps([pkg, other], protocol=2))
+
+        self.assertIs(pkg2._store, other2._store)
+        self.assertEqual(pkg2.nvra, "bash-4.3.42-4.fc24.x86_64")
+        self.assertEqual(other2.requires, other.requires)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import json
+import os
+
+import mock
+import six
+
+try:
+    from pungi.scripts import pungi_gather
+
+    HAS_DNF = True
+except ImportError:
+    HAS_DNF = False
+
+from tests import helpers
+
+
+@unittest.skipUnless(HAS_DNF, "DNF is not available")
+@mock.patch("pungi.scripts.pungi_gather.run_request")
+class TestServe(helpers.PungiTestCase):
+    def _serve(self, requests):
+        replies = six.StringIO()
+        pungi_gather.serve(
+            "/persist",
+            "/cache",
+            requests=six.StringIO("".join(json.dumps(r) + "\n" for r in requests)),
+            replies=replies,
+        )
+        return [json.loads(line) for line in replies.getvalue().splitlines()]
+
+    def test_reuses_session(self, run_request):
+        run_request.side_effect = lambda ns, session, *args: ns.arch
+        out1 = os.path.join(self.topdir, "out1")
+        out2 = os.path.join(self.topdir, "out2")
+
+        replies = self._serve(
+            [
+                {"args": ["--arch=x86_64", "--config=ks1"], "output": out1},
+                {"args": ["--arch=x86_64", "--config=ks2"], "output": out2},
+            ]
+        )
+
+        self.assertEqual(replies, [{"status": "ok"}, {"status": "ok"}])
+        self.assertEqual(
+            [c[0][1] for c in run_request.call_args_list], [None, "x86_64"]
+        )
+        self.assertEqual(run_request.call_args_list[1][0][0].config, "ks2")
+
+    def test_failure(self, run_request):
+        run_request.side_effect = RuntimeError("Boom")
+        output = os.path.join(self.topdir, "out")
+
+        replies = self._serve([{"args": ["--arch=x86_64"], "output": output}])
+
+        self.assertEqual(replies, [{"status": "error", "error": "Boom"}])
+        with open(output) as f:
+            self.assertIn("RuntimeError: Boom", f.read())
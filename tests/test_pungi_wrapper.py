@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import mock
+import six
+
+from pungi.wrappers import pungi
+
+from tests import helpers
+
+
+@mock.patch("subprocess.Popen")
+class TestGatherServer(helpers.PungiTestCase):
+    def setUp(self):
+        super(TestGatherServer, self).setUp()
+        self.logfile = os.path.join(self.topdir, "server.log")
+
+    def _start(self, Popen, replies):
+        Popen.return_value.stdout = six.StringIO(
+            "".join(json.dumps(reply) + "\n" for reply in replies)
+        )
+        return pungi.GatherServer("/tmp", self.logfile)
+
+    def test_run(self, Popen):
+        server = self._start(Popen, [{"status": "ok"}])
+
+        server.run(["--arch=x86_64", "--config=ks"], "/out.log")
+
+        self.assertEqual(
+            Popen.call_args[0][0], ["pungi-gather", "--server", "--tempdir=/tmp"]
+        )
+        request = Popen.return_value.stdin.write.call_args[0][0]
+        self.assertEqual(
+            json.loads(request),
+            {"args": ["--arch=x86_64", "--config=ks"], "output": "/out.log"},
+        )
+
+    def test_failed_request(self, Popen):
+        server = self._start(Popen, [{"status": "error", "error": "Boom"}])
+
+        with self.assertRaises(RuntimeError) as ctx:
+            server.run([], "/out.log")
+
+        self.assertIn("Boom", str(ctx.exception))
+
+    def test_server_exited(self, Popen):
+        server = self._start(Popen, [])
+        Popen.return_value.poll.return_value = 1
+
+        with self.assertRaises(RuntimeError) as ctx:
+            server.run([], "/out.log")
+
+        self.assertIn("exited with 1", str(ctx.exception))
+
+    def test_one_server_per_arch(self, Popen):
+        Popen.side_effect = lambda *args, **kwargs: mock.Mock()
+        first = pungi.get_gather_server("x86_64", "/tmp", self.logfile)
+        second = pungi.get_gather_server("x86_64", "/tmp", self.logfile)
+        other = pungi.get_gather_server("s390x", "/tmp", self.logfile)
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(pungi.close_gather_servers(), 2)
+        first.proc.stdin.close.assert_called_once_with()
+        first.proc.wait.assert_called_once_with()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from pungi.scheduler import BudgetScheduler, Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def test_runs_dependencies_first(self):
+        done = []
+        scheduler = Scheduler()
+        scheduler.add("a", lambda: done.append("a"))
+        scheduler.add("b", lambda: done.append("b"), deps=["a"])
+        scheduler.add("c", lambda: done.append("c"), deps=["a", "b"])
+
+        scheduler.run(threads=3)
+
+        self.assertEqual(done, ["a", "b", "c"])
+        self.assertEqual(scheduler.get_critical_path(), ["a", "b", "c"])
+
+    def test_independent_tasks_overlap(self):
+        started = threading.Event()
+
+        def first():
+            # Would time out if the other task did not run at the same time.
+            self.assertTrue(started.wait(5))
+
+        scheduler = Scheduler()
+        scheduler.add("first", first)
+        scheduler.add("second", started.set)
+
+        scheduler.run(threads=2)
+
+        self.assertEqual(sorted(scheduler.timings), ["first", "second"])
+
+    def test_unknown_dependency(self):
+        scheduler = Scheduler()
+        with self.assertRaises(ValueError):
+            scheduler.add("a", lambda: None, deps=["b"])
+
+    def test_duplicate_task(self):
+        scheduler = Scheduler()
+        scheduler.add("a", lambda: None)
+        with self.assertRaises(ValueError):
+            scheduler.add("a", lambda: None)
+
+    def test_failure_stops_dependants(self):
+        done = []
+
+        def fail():
+            raise RuntimeError("Boom")
+
+        scheduler = Scheduler()
+        scheduler.add("a", fail)
+        scheduler.add("b", lambda: done.append("b"), deps=["a"])
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run(threads=2)
+
+        self.assertEqual(done, [])
+        self.assertNotIn("b", scheduler.timings)
+
+    def test_empty(self):
+        scheduler = Scheduler()
+        scheduler.run(threads=1)
+        self.assertEqual(scheduler.get_critical_path(), [])
+        self.assertEqual(scheduler.get_report(), [])
+
+    def test_report(self):
+        scheduler = Scheduler()
+        scheduler.add("a", lambda: None)
+        scheduler.add("b", lambda: None, deps=["a"])
+        scheduler.run(threads=1)
+        scheduler.timings = {"a": (10, 12), "b": (12, 15.5)}
+
+        self.assertEqual(
+            scheduler.get_report(),
+            ["a: 2.00 s", "b: 3.50 s", "Critical path (5.50 s): a -> b"],
+        )
+
+
+class TestBudgetScheduler(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = []
+        self.max_running = []
+
+    def _job(self, name, result=None):
+        def job():
+            with self.lock:
+                self.running.append(name)
+                self.max_running.append(sorted(self.running))
+            with self.lock:
+                self.running.remove(name)
+            return result
+
+        return job
+
+    def test_returns_results_in_order(self):
+        scheduler = BudgetScheduler(cpus=4, memory=1000)
+        scheduler.add("a", self._job("a", 1), cpus=1, memory=100)
+        scheduler.add("b", self._job("b", 2), cpus=3, memory=100)
+        scheduler.add("c", self._job("c", 3), cpus=2, memory=100)
+
+        self.assertEqual(scheduler.run(), [1, 2, 3])
+
+    def test_starts_largest_first(self):
+        scheduler = BudgetScheduler(cpus=4, memory=1000)
+        scheduler.add("small", lambda: None, cpus=1, memory=100)
+        scheduler.add("big", lambda: None, cpus=4, memory=100)
+
+        scheduler.run()
+
+        self.assertEqual(
+            scheduler.decisions[0],
+            "Starting big (4 CPUs, 100 MiB), free: 0 CPUs, 900 MiB",
+        )
+
+    def test_does_not_go_over_budget(self):
+        scheduler = BudgetScheduler(cpus=4, memory=1000)
+
+        def big():
+            # Give the scheduler a chance to start another job if it wanted.
+            time.sleep(0.1)
+
+        scheduler.add("big", big, cpus=1, memory=800)
+        scheduler.add("other", lambda: None, cpus=1, memory=300)
+
+        scheduler.run()
+
+        self.assertEqual(
+            [d.split(" (")[0].split(",")[0] for d in scheduler.decisions],
+            ["Starting big", "Finished big", "Starting other", "Finished other"],
+        )
+
+    def test_fills_free_budget_with_smaller_jobs(self):
+        small_started = threading.Event()
+        scheduler = BudgetScheduler(cpus=4, memory=1000)
+        scheduler.add("big", lambda: small_started.wait(5), cpus=3, memory=500)
+        scheduler.add("medium", lambda: None, cpus=2, memory=100)
+        scheduler.add("small", small_started.set, cpus=1, memory=100)
+
+        scheduler.run()
+
+        started = [d.split(" ")[1] for d in scheduler.decisions if "Starting" in d]
+        self.assertEqual(started, ["big", "small", "medium"])
+
+    def test_job_over_budget_runs_alone(self):
+        scheduler = BudgetScheduler(cpus=2, memory=100)
+        scheduler.add("huge", self._job("huge"), cpus=8, memory=100)
+        scheduler.add("small", self._job("small"), cpus=1, memory=10)
+
+        scheduler.run()
+
+        self.assertEqual(self.max_running, [["huge"], ["small"]])
+
+    def test_failure(self):
+        def fail():
+            raise RuntimeError("Boom")
+
+        log = []
+        scheduler = BudgetScheduler(
+            cpus=1, memory=100, log=lambda msg, *args: log.append(msg % args)
+        )
+        scheduler.add("a", fail, cpus=1, memory=10)
+        scheduler.add("b", self._job("b"), cpus=1, memory=1)
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run()
+
+        self.assertEqual(self.max_running, [])
+        self.assertEqual(
+            log,
+            [
+                "Starting a (1 CPUs, 10 MiB), free: 0 CPUs, 90 MiB",
+                "Finished a, free: 1 CPUs, 100 MiB",
+            ],
+        )